@@ -0,0 +1,17 @@
+import { AmplifyApiRestResourceStackTemplate } from '@aws-amplify/cli-extensibility-helper';
+
+export function override(resources: AmplifyApiRestResourceStackTemplate) {
+    // splitrapi base64-encodes compressed responses, which API Gateway only decodes for binary
+    // media types. Treating every type as binary makes that hold whatever the client accepts.
+    // Request bodies then reach the function base64-encoded, which aws-wsgi decodes.
+    const body = resources.restApi.body;
+    body['x-amazon-apigateway-binary-media-types'] = ['*/*'];
+
+    // CORS preflight requests are answered by mock integrations, which only work on text
+    for (const path of Object.values<any>(body.paths)) {
+        const integration = path.options?.['x-amazon-apigateway-integration'];
+        if (integration?.type === 'mock') {
+            integration.contentHandling = 'CONVERT_TO_TEXT';
+        }
+    }
+}
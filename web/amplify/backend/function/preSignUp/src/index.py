@@ -1,9 +1,23 @@
-import json
+import os
+from datetime import date
+
+import boto3
 
 ACCESS_KEY = 'custom:accessKey'
 INVALID_ACCESS_KEY = 'Invalid access code'
 
+PRE_SIGN_UP = 'PreSignUp_SignUp'
+POST_CONFIRMATION = 'PostConfirmation_ConfirmSignUp'
+
+table = boto3.resource('dynamodb', region_name=os.environ.get('REGION')).Table(os.environ.get('STORAGE_SPLITR_NAME'))
+
 def handler(event, context):
+    # This function is attached to both the pre sign-up and the post confirmation trigger
+    if event['triggerSource'] == POST_CONFIRMATION:
+        return post_confirmation(event)
+    if event['triggerSource'] != PRE_SIGN_UP:
+        return event
+
     # Auto confirm all emails
     # Note: Since all sign ups are protected by presenting the correct access phrase (see below code),
     # I don't really see a need to confirm user emails.
@@ -11,9 +25,38 @@ def handler(event, context):
     if 'email' in event['request']['userAttributes']:
         event['response']['autoVerifyEmail'] = True
 
-    # Verify that user presented the correct access code
-    if ACCESS_KEY in event['request']['userAttributes']:
-        if event['request']['userAttributes'][ACCESS_KEY] != 'seattleite':
-            raise Exception(INVALID_ACCESS_KEY)
-    else: raise Exception(INVALID_ACCESS_KEY)
+    # Verify that user presented an access code belonging to a group
+    get_access_key(event)
+    return event
+
+def get_access_key(event):
+    if ACCESS_KEY not in event['request']['userAttributes']:
+        raise Exception(INVALID_ACCESS_KEY)
+    key = f"AccessKey#{event['request']['userAttributes'][ACCESS_KEY]}"
+    access_key = table.get_item(Key={'id': key, 'sk': key}).get('Item')
+    if access_key is None:
+        raise Exception(INVALID_ACCESS_KEY)
+    return access_key
+
+def post_confirmation(event):
+    # Add the user to the group the access code belongs to.
+    # This only happens once Cognito has created the user, so sign ups which fail after the
+    # pre sign-up trigger don't leave memberships behind for users which don't exist.
+    # Cognito retries triggers which fail or time out, so an existing membership is kept as it is.
+    # This mirrors `GroupUserModel` in the splitrapi function
+    access_key = get_access_key(event)
+    user_id = event['userName']
+    try:
+        table.put_item(
+            Item={
+                'id': access_key['group'],
+                'sk': f'User#{user_id}',
+                'type': 'GroupUser',
+                'tag': f'Member#{user_id}',
+                'date': date.today().isoformat()
+            },
+            ConditionExpression='attribute_not_exists(id)'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
     return event
@@ -0,0 +1,151 @@
+"""
+Cold storage for old, settled expenses.
+
+Archived expenses are grouped into gzipped JSON chunks, partitioned by the month of the
+expense date, and written to an object store. Each archived expense is replaced in the table
+by an `ArchivedExpenseModel` tombstone pointing to its chunk.
+
+When deployed, the function's stack creates the archive bucket and sets ARCHIVE_URL to it, and
+the job runs on the schedule given by the `CloudWatchRule` parameter (see parameters.json).
+A run which can't finish before the function times out queues the rest of the job to run next.
+Setting `CloudWatchRule` to `NONE` disables the job, and leaving ARCHIVE_URL unset makes it a no-op.
+"""
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+import copy
+import gzip
+import json
+import os
+
+from pynamodb.exceptions import PutError
+
+import models
+from objectstore import ObjectStore, object_store_from_url
+import storage
+
+ARCHIVE_URL = os.environ.get("ARCHIVE_URL")
+"""Where archive chunks are stored. Either `s3://<bucket>/<prefix>` or `file://<directory>`"""
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+"""Settled expenses dated more than this many days ago are archived"""
+ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE", 16))
+"""Number of recently read archive chunks kept in memory"""
+ARCHIVE_CHUNK_SIZE = int(os.environ.get("ARCHIVE_CHUNK_SIZE", 200))
+"""Maximum number of expenses held in memory before they are written out to the archive"""
+ARCHIVE_SCAN_PAGE_SIZE = 100
+"""Number of expenses read from the table at a time while looking for those to archive"""
+
+db = storage.get_storage()
+
+_store: Optional[ObjectStore] = None
+
+
+def get_store() -> ObjectStore:
+    global _store
+    if _store is None:
+        if not ARCHIVE_URL:
+            raise Exception("No archive is configured. Set ARCHIVE_URL.")
+        _store = object_store_from_url(ARCHIVE_URL)
+    return _store
+
+
+@lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def _load_chunk(key: str) -> Dict[str, Dict]:
+    """
+    Reads an archive chunk, mapping expense ids to serialized expenses.
+    Chunks are never modified after they are written, so they are safe to cache.
+    """
+    return json.loads(gzip.decompress(get_store().get(key)))
+
+
+def resolve_expense(model: models.BaseModel) -> models.ExpenseModel:
+    """
+    Given a model read from an expense partition, returns the expense it represents,
+    reading it from the archive if `model` is a tombstone.
+    """
+    if isinstance(model, models.ArchivedExpenseModel):
+        chunk = _load_chunk(model.archive)
+        # Deserializing consumes the data it is given, so leave the cached chunk intact
+        return models.ExpenseModel.from_raw_data(copy.deepcopy(chunk[model.id]))
+    if isinstance(model, models.ExpenseModel):
+        return model
+    raise models.ExpenseModel.DoesNotExist()
+
+
+def resolve_expenses(items: Iterable[models.BaseModel]) -> List[models.ExpenseModel]:
+    return [resolve_expense(item) for item in items]
+
+
+def _write_chunk(month: str, expenses: List[models.ExpenseModel]) -> int:
+    """
+    Writes expenses of the same month to a new archive chunk, and replaces them with tombstones.
+    @returns: The number of expenses which were archived.
+    """
+    key = f"expenses/{month}/{uuid4()}.json.gz"
+    chunk = {expense.id: expense.serialize() for expense in expenses}
+    get_store().put(
+        key,
+        gzip.compress(json.dumps(chunk).encode()),
+        content_type="application/json",
+        content_encoding="gzip",
+    )
+
+    archived = 0
+    for expense in expenses:
+        tombstone = models.ArchivedExpenseModel(
+            expense.id, expense.sk, archive=key, version=expense.version
+        )
+        try:
+            # Only replace the expense if it hasn't been modified since it was read
+            db.save(tombstone, condition=models.ExpenseModel.version == expense.version)
+        except PutError:
+            continue
+        archived += 1
+    return archived
+
+
+def archive_expenses(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    out_of_time: Callable[[], bool] = lambda: False,
+    start: Optional[storage.Item] = None,
+) -> Tuple[int, Optional[storage.Item]]:
+    """
+    Moves settled expenses dated more than `older_than_days` ago into the archive.
+    An expense is settled once all of its users have paid.
+    The table is scanned a page at a time, and expenses are written out in chunks of at most
+    `ARCHIVE_CHUNK_SIZE` as they are found, so only one chunk's worth is held in memory.
+    @out_of_time: Called after each page is scanned. Once it returns `True`, the scan stops.
+    @start: Where to resume scanning from, as returned by a previous call.
+    @returns: The number of expenses which were archived, and where to resume scanning from,
+        or `None` if the whole table was scanned.
+    """
+    if not ARCHIVE_URL:
+        return 0, None
+
+    cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+    months: Dict[str, List[models.ExpenseModel]] = {}
+    buffered = 0
+    archived = 0
+    position = start
+    while True:
+        page = db.scan(
+            models.ExpenseModel,
+            models.ExpenseModel.date < cutoff,
+            limit=ARCHIVE_SCAN_PAGE_SIZE,
+            last_evaluated_key=position,
+        )
+        for expense in page:
+            if not all(user.paid for user in expense.users):
+                continue
+            months.setdefault(expense.date[:7], []).append(expense)
+            buffered += 1
+            if buffered >= ARCHIVE_CHUNK_SIZE:
+                archived += sum(_write_chunk(month, expenses) for month, expenses in months.items())
+                months, buffered = {}, 0
+        position = page.last_evaluated_key
+        if position is None or out_of_time():
+            break
+
+    archived += sum(_write_chunk(month, expenses) for month, expenses in months.items())
+    return archived, position
@@ -0,0 +1,146 @@
+"""
+Coalescing of identical reads, so that bursts of the same request are only handled once.
+
+Requests are identical if they are made by the same user to the same route with the same
+parameters. While one such request is being handled, identical requests wait for it and share
+its response. Responses are then reused for `COALESCE_TTL_SECONDS`, unless a write made by this
+process invalidates them first.
+
+Coalescing only spans requests handled by the same process. A Lambda execution environment
+handles one request at a time, so there it is the short-lived cache which absorbs bursts.
+"""
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+
+from flask import Response, current_app, request
+
+import metrics
+
+COALESCE_TTL_SECONDS = float(os.environ.get("COALESCE_TTL_SECONDS", 2))
+"""How long the response to a read is reused for. 0 only shares responses between concurrent reads"""
+COALESCE_MAX_ENTRIES = int(os.environ.get("COALESCE_MAX_ENTRIES", 256))
+"""Maximum number of responses kept for reuse"""
+COALESCE_METRICS = os.environ.get("COALESCE_METRICS", "true").lower() == "true"
+"""Whether to log each request which was coalesced"""
+
+Key = Tuple
+CachedResponse = Tuple[bytes, int, List[Tuple[str, str]]]
+
+
+class _Flight:
+    """
+    A read which is being handled, whose response identical reads wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[CachedResponse] = None
+
+
+_lock = threading.Lock()
+_generation = 0
+_flights: Dict[Key, _Flight] = {}
+_cache: "OrderedDict[Key, Tuple[float, CachedResponse]]" = OrderedDict()
+_coalesced = {"flight": 0, "cache": 0}
+
+
+def invalidate():
+    """
+    Forgets all reused responses. Called after every write, so that no read which follows it
+    sees what was read before it. Reads already being handled are no longer shared.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        _flights.clear()
+        _cache.clear()
+
+
+def coalesced_counts() -> Dict[str, int]:
+    """
+    Returns how many requests this process has answered with the response of a concurrent
+    identical request (`flight`), or with a recent one (`cache`).
+    """
+    with _lock:
+        return dict(_coalesced)
+
+
+def _key() -> Key:
+    event = request.environ.get("awsgi.event") or {}
+    claims = event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
+    return (
+        request.method,
+        request.url_rule.rule,
+        tuple(sorted(request.view_args.items())),
+        tuple(sorted(request.args.items(multi=True))),
+        claims.get("cognito:username"),
+    )
+
+
+def _log_metrics(route: str, source: str):
+    """
+    Logs a coalesced request.
+    """
+    metrics.log_metrics({"Route": route, "Source": source}, {"CoalescedRequests": (1, "Count")})
+
+
+def _reuse(cached: CachedResponse, source: str) -> Response:
+    with _lock:
+        _coalesced[source] += 1
+    if COALESCE_METRICS:
+        _log_metrics(f"{request.method} {request.url_rule.rule}", source)
+    # Every request gets its own response, since after-request hooks modify it
+    body, status, headers = cached
+    return Response(body, status=status, headers=headers)
+
+
+def coalesced(view: Callable) -> Callable:
+    """
+    Decorates a read-only route so that identical requests share one response.
+    Only successful responses are shared. If the request being waited for fails,
+    each waiting request is handled on its own.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = _key()
+        with _lock:
+            generation = _generation
+            cached = _cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                hit = cached[1]
+            else:
+                hit = None
+                flight = _flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _flights[key] = _Flight()
+        if hit is not None:
+            return _reuse(hit, "cache")
+
+        if not leader:
+            flight.done.wait()
+            if flight.response is not None:
+                return _reuse(flight.response, "flight")
+            return view(*args, **kwargs)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+            if 200 <= response.status_code < 300:
+                flight.response = (response.get_data(), response.status_code, list(response.headers))
+        finally:
+            with _lock:
+                if _flights.get(key) is flight:
+                    del _flights[key]
+                # A response read before a write must not be reused after it
+                if flight.response is not None and generation == _generation and COALESCE_TTL_SECONDS > 0:
+                    _cache[key] = (time.monotonic() + COALESCE_TTL_SECONDS, flight.response)
+                    _cache.move_to_end(key)
+                    while len(_cache) > COALESCE_MAX_ENTRIES:
+                        _cache.popitem(last=False)
+            flight.done.set()
+        return response
+
+    return wrapper
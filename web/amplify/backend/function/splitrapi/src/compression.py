@@ -0,0 +1,96 @@
+"""
+Compression of responses, negotiated from the client's Accept-Encoding header.
+
+Compressed bodies are binary, so they must be base64-encoded in the Lambda proxy response.
+API Gateway decodes them again before responding, since the API treats every media type as
+binary (see the API's override.ts). Otherwise clients would receive the base64 text, so
+COMPRESSION_ENABLED should be unset when serving the function from an API without that setting.
+"""
+from typing import Any, Dict, Optional
+import gzip
+import os
+import time
+
+import awsgi
+from flask import Flask, Response, request
+
+import metrics
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+"""Whether responses are compressed at all. Requires binary media types to be set on the API"""
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+"""Responses smaller than this many bytes are sent uncompressed"""
+COMPRESSION_METRICS = os.environ.get("COMPRESSION_METRICS", "true").lower() == "true"
+"""Whether to log bytes saved and CPU time spent on compression"""
+
+COMPRESSIBLE_MIMETYPES = {"application/json"}
+SUPPORTED_ENCODINGS = ["gzip"]
+"""Encodings responses may be compressed with, in order of preference"""
+
+
+def _log_metrics(route: str, encoding: str, original: int, compressed: int, cpu_seconds: float):
+    """
+    Logs compression metrics, aggregated per route.
+    """
+    metrics.log_metrics(
+        {"Route": route, "Encoding": encoding},
+        {
+            "CompressionBytesSaved": (original - compressed, "Bytes"),
+            "CompressionCpuTime": (cpu_seconds * 1000, "Milliseconds"),
+        },
+        OriginalBytes=original,
+        CompressedBytes=compressed,
+    )
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compresses a response with the best encoding the client accepts,
+    if it is large enough to be worth compressing.
+    """
+    if (
+        not COMPRESSION_ENABLED
+        or response.direct_passthrough
+        or not 200 <= response.status_code < 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding: Optional[str] = request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESSION_MIN_BYTES:
+        return response
+
+    start = time.process_time()
+    compressed = gzip.compress(data, compresslevel=6)
+    cpu_seconds = time.process_time() - start
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    if COMPRESSION_METRICS:
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        _log_metrics(route, encoding, len(data), len(compressed), cpu_seconds)
+    return response
+
+
+def init_app(app: Flask):
+    app.after_request(compress_response)
+
+
+def lambda_response(app: Flask, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Like `awsgi.response`, but base64-encodes any body with a Content-Encoding,
+    since compressed bodies are not valid UTF-8 text.
+    """
+    make_environ, StartResponse = awsgi.select_impl(event, context)
+
+    class EncodedStartResponse(StartResponse):
+        def use_binary_response(self, headers, body):
+            return "Content-Encoding" in headers or super().use_binary_response(headers, body)
+
+    start_response = EncodedStartResponse()
+    output = app(make_environ(event, context), start_response)
+    return start_response.response(output)
@@ -0,0 +1,316 @@
+"""
+Computation of expense totals and of each user's contribution towards expenses.
+
+`resolve_expense_total` and `resolve_expense_contribution` work on a single expense.
+`resolve_expense_batch` computes the same values for many expenses at once, flattening them
+into columnar arrays so that the arithmetic runs in a handful of vectorized NumPy operations.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import os
+
+import numpy as np
+
+VECTORIZE_MIN_EXPENSES = int(os.environ.get("VECTORIZE_MIN_EXPENSES", 32))
+"""Below this many expenses, the fixed overhead of NumPy outweighs its speedup"""
+
+
+def resolve_expense_total(expense: Dict[str, Any]) -> Tuple[float, float]:
+    """
+    Calculates the total value of an expense.
+    @expense: The encoded, un-transformed expense object.
+    @returns: A tuple whose first element is the expense subtotal and whose second element is the
+        expense grand total (after considering taxes/tips)
+    """
+    if expense["expenseType"] == "single":
+        return (expense["amount"], expense["amount"])
+    elif expense["expenseType"] == "multiple":
+
+        def resolve_percentage_amount(current_value: float, percentage_amount) -> float:
+            if "value" not in percentage_amount or percentage_amount["value"] is None:
+                return current_value
+            if percentage_amount["type"] == "percentage":
+                return current_value * (1 + percentage_amount["value"] / 100)
+            elif percentage_amount["type"] == "amount":
+                return current_value + percentage_amount["value"]
+            else:
+                raise Exception(
+                    f'Invalid percentage amount type: {percentage_amount["type"]}'
+                )
+
+        subtotal = sum(item["price"] * item["quantity"]
+                    for item in expense["items"])
+        total = resolve_percentage_amount(subtotal, expense["tax"])
+        total = resolve_percentage_amount(total, expense["tip"])
+        return (subtotal, total)
+    else:
+        raise Exception(f'Invalid expense type: {expense["expenseType"]}')
+
+
+def resolve_expense_contribution(
+    expense: Dict[str, Any], totals: Tuple[float, float], user_id: str
+) -> float:
+    """
+    Calculates the contribution of a user towards an expense.
+    @expense: The encoded, un-transformed expense object
+    @total: The subtotal/grand-total of the expense, as returned by `resolve_expense_total`
+    @user_id: The id of the user whose contribution towards this expense will be found.
+        Must match a user inside `expense['users']` or equal `expense['owner']`
+    @users: A mapping of user ids to info about those users.
+        Must map `user_id` and all users inside `expense['users']`
+    """
+    # If user not found in users array, contribution is necessarily 0
+    if user_id not in (user["user"] for user in expense["users"]): return 0
+    subtotal, total = totals
+
+    def remaining_contribution(total):
+        if expense["split"] == "individually":
+            return total
+        elif expense["split"] == "equally":
+            return total / len(expense["users"])
+        elif expense["split"] == "proportionally":
+            my_wage = next(user["wage"] for user in expense["users"] if user["user"] == user_id)
+            total_wages = sum(user["wage"] for user in expense["users"])
+            return (my_wage / total_wages) * total
+        elif expense["split"] == "custom":
+            my_weight = next(user["weight"] for user in expense["users"] if user["user"] == user_id)
+            total_weights = sum(user["weight"] for user in expense["users"])
+            return (my_weight / total_weights) * total
+        else:
+            raise Exception(f'Invalid expense split method: {expense["split"]}')
+
+    if expense["expenseType"] == "single": return remaining_contribution(total)
+
+    # For itemized expenses, contributions must be computed slightly differently.
+    # If every item is free, so is every item's share of taxes and tips.
+    personal_contribution = 0
+    tax_ratio = total / subtotal if subtotal else 1
+    for item in expense["items"]:
+        if 'users' in item:
+            # This item is being assigned to individual users, so should not count toward
+            # the remaining expense total
+            item_price = item["price"] * tax_ratio
+            total -= item_price
+            if user_id in item["users"]:
+                # Items assigned to multiple users are split equally among them
+                personal_contribution += item_price / len(item["users"])
+
+    return remaining_contribution(total) + personal_contribution
+
+
+_SPLITS = {"individually": 0, "equally": 1, "proportionally": 2, "custom": 3}
+_PERCENTAGE_AMOUNT_TYPES = {"percentage": 1, "amount": 2}
+
+
+class _ExpenseColumns:
+    """
+    A list of encoded expenses, flattened into columnar arrays.
+    """
+    def __init__(self, expenses: Sequence[Dict[str, Any]]):
+        self.count = len(expenses)
+        self.user_ids: List[str] = []
+        self.user_index: Dict[str, int] = {}
+
+        # One entry per expense
+        is_multiple: List[bool] = []
+        amount: List[float] = []
+        split: List[int] = []
+        adjustments: List[Tuple[int, float, int, float]] = []
+        # One entry per item
+        item_expense: List[int] = []
+        item_price: List[float] = []
+        item_quantity: List[float] = []
+        item_assigned: List[bool] = []
+        # One entry per user an item is assigned to
+        assignment_item: List[int] = []
+        assignment_user: List[int] = []
+        # One entry per user of each expense
+        pair_expense: List[int] = []
+        pair_user: List[int] = []
+        pair_wage: List[float] = []
+        pair_weight: List[float] = []
+
+        user_index = self.user_index
+        user_ids = self.user_ids
+
+        def index_of(user_id: str) -> int:
+            index = user_index.get(user_id)
+            if index is None:
+                index = user_index[user_id] = len(user_ids)
+                user_ids.append(user_id)
+            return index
+
+        def percentage_amount(percentage_amount) -> Tuple[int, float]:
+            value = percentage_amount.get("value")
+            if value is None:
+                return (0, 0)
+            if percentage_amount["type"] not in _PERCENTAGE_AMOUNT_TYPES:
+                raise Exception(
+                    f'Invalid percentage amount type: {percentage_amount["type"]}'
+                )
+            return (_PERCENTAGE_AMOUNT_TYPES[percentage_amount["type"]], value)
+
+        for e, expense in enumerate(expenses):
+            if expense["split"] not in _SPLITS:
+                raise Exception(f'Invalid expense split method: {expense["split"]}')
+            split.append(_SPLITS[expense["split"]])
+
+            users = expense["users"]
+            pair_expense.extend([e] * len(users))
+            pair_user.extend([index_of(user["user"]) for user in users])
+            pair_wage.extend([user.get("wage") or 0 for user in users])
+            pair_weight.extend([user.get("weight") or 0 for user in users])
+
+            if expense["expenseType"] == "single":
+                is_multiple.append(False)
+                amount.append(expense["amount"])
+                adjustments.append((0, 0, 0, 0))
+            elif expense["expenseType"] == "multiple":
+                is_multiple.append(True)
+                amount.append(0)
+                adjustments.append(percentage_amount(expense["tax"]) + percentage_amount(expense["tip"]))
+
+                items = expense["items"]
+                first_item = len(item_expense)
+                item_expense.extend([e] * len(items))
+                item_price.extend([item["price"] for item in items])
+                item_quantity.extend([item["quantity"] for item in items])
+                item_assigned.extend(["users" in item for item in items])
+                for i, item in enumerate(items):
+                    assigned_users = item.get("users")
+                    if assigned_users:
+                        assignment_item.extend([first_item + i] * len(assigned_users))
+                        assignment_user.extend([index_of(user_id) for user_id in assigned_users])
+            else:
+                raise Exception(f'Invalid expense type: {expense["expenseType"]}')
+
+        self.is_multiple = np.array(is_multiple, dtype=bool)
+        self.amount = np.array(amount, dtype=float)
+        self.split = np.array(split, dtype=np.int8)
+        adjustments_array = np.array(adjustments, dtype=float).reshape(-1, 4)
+        self.tax_type = adjustments_array[:, 0]
+        self.tax_value = adjustments_array[:, 1]
+        self.tip_type = adjustments_array[:, 2]
+        self.tip_value = adjustments_array[:, 3]
+        self.item_expense = np.array(item_expense, dtype=np.int64)
+        self.item_price = np.array(item_price, dtype=float)
+        self.item_quantity = np.array(item_quantity, dtype=float)
+        self.item_assigned = np.array(item_assigned, dtype=bool)
+        self.assignment_item = np.array(assignment_item, dtype=np.int64)
+        self.assignment_user = np.array(assignment_user, dtype=np.int64)
+        self.pair_expense = np.array(pair_expense, dtype=np.int64)
+        self.pair_user = np.array(pair_user, dtype=np.int64)
+        self.pair_wage = np.array(pair_wage, dtype=float)
+        self.pair_weight = np.array(pair_weight, dtype=float)
+
+
+def _apply_percentage_amount(values, types, amounts):
+    values = np.where(types == 1, values * (1 + amounts / 100), values)
+    return np.where(types == 2, values + amounts, values)
+
+
+def _resolve_columns(columns: _ExpenseColumns):
+    """
+    Computes totals of every expense and the contribution of every user of every expense.
+    @returns: A tuple of an array of (subtotal, total) rows, one per expense,
+        and an array of contributions, one per (expense, user) pair in `columns`.
+    """
+    count = columns.count
+    item_expense = columns.item_expense
+
+    # Totals
+    item_subtotals = np.bincount(
+        item_expense, weights=columns.item_price * columns.item_quantity, minlength=count
+    )
+    subtotal = np.where(columns.is_multiple, item_subtotals, columns.amount)
+    total = _apply_percentage_amount(subtotal, columns.tax_type, columns.tax_value)
+    total = _apply_percentage_amount(total, columns.tip_type, columns.tip_value)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Items assigned to individual users don't count toward the remaining expense total
+        tax_ratio = np.where(columns.is_multiple & (subtotal != 0), total / subtotal, 1)
+        item_taxed_price = columns.item_price * tax_ratio[item_expense]
+        assigned = columns.item_assigned
+        remaining = total - np.bincount(
+            item_expense[assigned], weights=item_taxed_price[assigned], minlength=count
+        )
+
+        # Each user's share of the remaining total, depending on how the expense is split
+        pair_expense = columns.pair_expense
+        split = columns.split[pair_expense]
+        user_counts = np.bincount(pair_expense, minlength=count)[pair_expense]
+        wage_sums = np.bincount(pair_expense, weights=columns.pair_wage, minlength=count)[pair_expense]
+        weight_sums = np.bincount(pair_expense, weights=columns.pair_weight, minlength=count)[pair_expense]
+        share = np.select(
+            [split == 0, split == 1, split == 2, split == 3],
+            [
+                np.ones(len(pair_expense)),
+                1 / user_counts,
+                columns.pair_wage / wage_sums,
+                columns.pair_weight / weight_sums,
+            ],
+        )
+        contribution = share * remaining[pair_expense]
+
+        # Items assigned to multiple users are split equally among them
+        assignment_item = columns.assignment_item
+        item_user_counts = np.bincount(assignment_item, minlength=len(item_expense))
+        personal = item_taxed_price[assignment_item] / item_user_counts[assignment_item]
+
+    # Add each assigned item's share to the matching (expense, user) pair.
+    # Users assigned to an item but not part of the expense contribute nothing.
+    width = max(len(columns.user_ids), 1)
+    pair_keys = pair_expense * width + columns.pair_user
+    assignment_keys = item_expense[assignment_item] * width + columns.assignment_user
+    if len(pair_keys) > 0:
+        order = np.argsort(pair_keys, kind="stable")
+        sorted_keys = pair_keys[order]
+        positions = np.minimum(np.searchsorted(sorted_keys, assignment_keys), len(sorted_keys) - 1)
+        matched = sorted_keys[positions] == assignment_keys
+        np.add.at(contribution, order[positions[matched]], personal[matched])
+
+    return np.stack([subtotal, total], axis=1), contribution
+
+
+def resolve_expense_batch(
+    expenses: Sequence[Dict[str, Any]], user_ids: Optional[Iterable[str]] = None
+) -> Tuple[List[Tuple[float, float]], Dict[str, List[float]]]:
+    """
+    Calculates the totals of many expenses, and the contributions of users towards them.
+    Equivalent to calling `resolve_expense_total` and `resolve_expense_contribution`
+    for every expense, but vectorized once there are at least `VECTORIZE_MIN_EXPENSES`.
+    @expenses: The encoded, un-transformed expense objects.
+    @user_ids: The users whose contributions are calculated.
+        If None, calculates the contributions of every user of any of the expenses.
+    @returns: A tuple whose first element lists the (subtotal, total) of each expense,
+        and whose second element maps each user id to their contribution towards each expense.
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    if len(expenses) < VECTORIZE_MIN_EXPENSES:
+        totals = [resolve_expense_total(expense) for expense in expenses]
+        if user_ids is None:
+            user_ids = set(user["user"] for expense in expenses for user in expense["users"])
+        contributions = {
+            user_id: [
+                resolve_expense_contribution(expense, expense_totals, user_id)
+                for expense, expense_totals in zip(expenses, totals)
+            ]
+            for user_id in user_ids
+        }
+        return totals, contributions
+
+    columns = _ExpenseColumns(expenses)
+    totals, pair_contributions = _resolve_columns(columns)
+
+    if user_ids is None:
+        user_ids = columns.user_ids
+    contributions = {}
+    for user_id in user_ids:
+        user_contributions = np.zeros(columns.count)
+        if user_id in columns.user_index:
+            pairs = columns.pair_user == columns.user_index[user_id]
+            user_contributions[columns.pair_expense[pairs]] = pair_contributions[pairs]
+        contributions[user_id] = user_contributions.tolist()
+
+    return [tuple(row) for row in totals.tolist()], contributions
+
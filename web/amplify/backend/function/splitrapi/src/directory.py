@@ -0,0 +1,122 @@
+"""
+Lookup of the users who have signed up, and of their profile attributes.
+
+Route handlers look users up through a `Directory` rather than calling Cognito directly,
+so that the API can run without network access. `CognitoDirectory` is used when deployed,
+while `LocalDirectory` keeps users in process, optionally loaded from a JSON file, for running
+the API on a laptop or in tests.
+
+Users are described by their Cognito attributes, e.g. `given_name` or `custom:hourlyWage`.
+"""
+from typing import Dict, Iterable, Optional
+import json
+import os
+
+import boto3
+
+USERS_URL = os.environ.get("USERS_URL", "cognito://")
+"""Where users are looked up. One of `cognito://`, `memory://`, or `file://<path to JSON>`"""
+USER_POOL_ID = os.environ.get("AUTH_SPLITR2AC25091_USERPOOLID")
+
+Attributes = Dict[str, str]
+"""A user's attributes, mapping attribute names to values"""
+
+
+class UserNotFound(Exception):
+    def __init__(self, user_id: str):
+        super().__init__(f"No user with id '{user_id}' exists")
+        self.user_id = user_id
+
+
+class Directory:
+    """
+    A minimal interface to the users who have signed up.
+    """
+    def get_user(self, user_id: str) -> Attributes:
+        """
+        Returns a user's attributes, raising `UserNotFound` if they don't exist.
+        """
+        raise NotImplementedError()
+
+    def list_user_ids(self) -> Iterable[str]:
+        raise NotImplementedError()
+
+
+class CognitoDirectory(Directory):
+    """
+    Looks users up in a Cognito user pool.
+    """
+    def __init__(self, user_pool_id: Optional[str]):
+        self.user_pool_id = user_pool_id
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use, so that importing the API needs no AWS configuration
+        if self._client is None:
+            self._client = boto3.client("cognito-idp")
+        return self._client
+
+    def get_user(self, user_id: str) -> Attributes:
+        # See docs: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/cognito-idp.html#CognitoIdentityProvider.Client.admin_get_user
+        try:
+            user = self.client.admin_get_user(UserPoolId=self.user_pool_id, Username=user_id)
+        except self.client.exceptions.UserNotFoundException:
+            raise UserNotFound(user_id)
+        return {attr["Name"]: attr["Value"] for attr in user["UserAttributes"]}
+
+    def list_user_ids(self) -> Iterable[str]:
+        paginator = self.client.get_paginator("list_users")
+        for page in paginator.paginate(UserPoolId=self.user_pool_id):
+            for user in page["Users"]:
+                yield user["Username"]
+
+
+class LocalDirectory(Directory):
+    """
+    Keeps users in process.
+    """
+    def __init__(self, users: Optional[Dict[str, Attributes]] = None):
+        self.users: Dict[str, Attributes] = dict(users or {})
+
+    @classmethod
+    def from_file(cls, path: str) -> "LocalDirectory":
+        """
+        Loads users from a JSON file mapping user ids to their attributes.
+        """
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def add_user(self, user_id: str, attributes: Attributes):
+        self.users[user_id] = dict(attributes)
+
+    def get_user(self, user_id: str) -> Attributes:
+        if user_id not in self.users:
+            raise UserNotFound(user_id)
+        return dict(self.users[user_id])
+
+    def list_user_ids(self) -> Iterable[str]:
+        return list(self.users)
+
+
+def directory_from_url(url: str) -> Directory:
+    """
+    Creates a directory from a URL of the form `cognito://`, `memory://`, or `file://<path>`.
+    """
+    if url.startswith("cognito://"):
+        return CognitoDirectory(USER_POOL_ID)
+    if url.startswith("memory://"):
+        return LocalDirectory()
+    if url.startswith("file://"):
+        return LocalDirectory.from_file(url[len("file://"):])
+    raise ValueError(f"Unsupported users URL: {url}")
+
+
+_directory: Optional[Directory] = None
+
+
+def get_directory() -> Directory:
+    global _directory
+    if _directory is None:
+        _directory = directory_from_url(USERS_URL)
+    return _directory
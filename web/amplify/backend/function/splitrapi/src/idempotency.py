@@ -0,0 +1,192 @@
+"""
+Support for the Idempotency-Key header, which lets clients safely retry requests.
+
+The first request with a given key claims it and does the work. Its response is recorded,
+ideally in the same transaction as the work itself, and returned as-is to any retries.
+Retries which arrive while the first request is still being handled wait for its response.
+"""
+from functools import wraps
+from typing import Any, Callable, Optional
+import hashlib
+import json
+import os
+import time
+
+from flask import Response, current_app, g, request
+from pynamodb.exceptions import DeleteError, DoesNotExist, PutError, UpdateError
+from werkzeug.exceptions import BadRequest, Conflict, UnprocessableEntity
+
+import models
+import storage
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 30))
+"""How long a request owns its key for before another request may take it over"""
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 10))
+"""How long a retry waits for the original request to respond"""
+
+db = storage.get_storage()
+
+
+class Claim:
+    """
+    Ownership of an idempotency key by the request currently being handled.
+    """
+    def __init__(self, record: models.IdempotencyModel):
+        self.record = record
+        self.completed = False
+
+    def _complete_actions(self, status_code: int, body: str):
+        return [
+            models.IdempotencyModel.status.set("complete"),
+            models.IdempotencyModel.statusCode.set(status_code),
+            models.IdempotencyModel.body.set(body),
+            models.IdempotencyModel.lease.remove(),
+        ]
+
+    def _owned_condition(self):
+        return (models.IdempotencyModel.status == "pending") & (
+            models.IdempotencyModel.lease == self.record.lease
+        )
+
+    def complete_in(self, transaction: storage.WriteTransaction, status_code: int, body: Any):
+        """
+        Records the response to this request as part of `transaction`.
+        @body: The JSON-serializable response body.
+        """
+        transaction.update(
+            self.record,
+            actions=self._complete_actions(status_code, json.dumps(body)),
+            condition=self._owned_condition(),
+        )
+        self.completed = True
+
+    def complete(self, response: Response):
+        """
+        Records the response to this request on its own.
+        """
+        try:
+            db.update(
+                self.record,
+                actions=self._complete_actions(response.status_code, response.get_data(as_text=True)),
+                condition=self._owned_condition(),
+            )
+        except UpdateError:
+            # Another request took over this key after our lease expired
+            pass
+        self.completed = True
+
+    def release(self):
+        """
+        Gives up the key without recording a response, so a retry will do the work again.
+        """
+        try:
+            db.delete(self.record, condition=self._owned_condition())
+        except DeleteError:
+            pass
+
+
+def current() -> Optional[Claim]:
+    """
+    Returns the claim on the current request's idempotency key, if it has one.
+    """
+    return g.get("idempotency_claim")
+
+
+def complete_in(transaction: storage.WriteTransaction, status_code: int, body: Any):
+    """
+    If the current request has an idempotency key, records its response as part of `transaction`.
+    """
+    claim = current()
+    if claim is not None:
+        claim.complete_in(transaction, status_code, body)
+
+
+def _fingerprint() -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _replay(record: models.IdempotencyModel, fingerprint: str) -> Response:
+    if record.fingerprint != fingerprint:
+        raise UnprocessableEntity(f"{IDEMPOTENCY_HEADER} was already used for a different request")
+    response = Response(record.body, status=int(record.statusCode), mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _claim_or_replay(user_id: str, key: str) -> Any:
+    """
+    Claims `key` for the current request, or returns the recorded response to the request
+    which claimed it first, waiting for that request to finish if necessary.
+    """
+    fingerprint = _fingerprint()
+    deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.05
+    while True:
+        now = time.time()
+        record = models.IdempotencyModel.new(
+            user_id, key,
+            fingerprint=fingerprint,
+            status="pending",
+            lease=int(now) + IDEMPOTENCY_LEASE_SECONDS,
+        )
+        try:
+            # Claim the key if it is unused, or if the request which claimed it has gone away
+            db.save(
+                record,
+                condition=models.IdempotencyModel.id.does_not_exist()
+                | ((models.IdempotencyModel.status == "pending") & (models.IdempotencyModel.lease < int(now)))
+            )
+            return Claim(record)
+        except PutError:
+            pass
+
+        try:
+            existing = db.get(models.IdempotencyModel, record.id, record.sk, consistent_read=True)
+        except DoesNotExist:
+            # The other request released the key, so try to claim it again
+            continue
+        if existing.status == "complete":
+            return _replay(existing, fingerprint)
+        if existing.fingerprint != fingerprint:
+            raise UnprocessableEntity(f"{IDEMPOTENCY_HEADER} was already used for a different request")
+
+        if now + delay > deadline:
+            raise Conflict(f"A request with this {IDEMPOTENCY_HEADER} is still in progress")
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+def idempotent(view: Callable) -> Callable:
+    """
+    Decorates a route so that requests made with an Idempotency-Key header are only handled once.
+    The route may record its response in the transaction that does its work using `complete_in`.
+    Otherwise, the response is recorded after the route returns.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            raise BadRequest(f"{IDEMPOTENCY_HEADER} must be at most 255 characters")
+
+        user_id = request.environ["awsgi.event"]["requestContext"]["authorizer"]["claims"]["cognito:username"]
+        claim = _claim_or_replay(user_id, key)
+        if isinstance(claim, Response):
+            return claim
+
+        g.idempotency_claim = claim
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            claim.release()
+            raise
+        if not claim.completed:
+            claim.complete(response)
+        return response
+
+    return wrapper
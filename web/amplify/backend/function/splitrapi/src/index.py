@@ -1,36 +1,104 @@
 from datetime import datetime
 from distutils.util import strtobool
 from pydoc import resolve
-from typing import Any, Dict, Iterable, Optional, Set, Tuple, TypedDict, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypedDict, Union
 
+import base64
 import json
-import awsgi
 import os
+import random
+import time
 import boto3
 from flask_cors import CORS
 from flask import Flask, Response, jsonify, request
-from werkzeug.exceptions import HTTPException, BadRequest, NotFound, Unauthorized
-
+from werkzeug.exceptions import (
+    HTTPException,
+    BadRequest,
+    Conflict,
+    Gone,
+    NotFound,
+    TooManyRequests,
+    Unauthorized,
+)
+
+import archive
+import coalescing
+import compression
+import directory
+import idempotency
+from contributions import resolve_expense_batch, resolve_expense_contribution, resolve_expense_total
 import models
-from validation import ExpenseValidator
-
-from pynamodb.transactions import TransactWrite, TransactGet
-from pynamodb.connection import Connection
-from pynamodb.exceptions import DoesNotExist
+import profiling
+import storage
+from validation import ExpenseValidator, GroupValidator, JoinGroupValidator
+
+from pynamodb.attributes import VersionAttribute
+from pynamodb.exceptions import (
+    DoesNotExist,
+    PynamoDBException,
+    TransactGetError,
+    TransactWriteError,
+)
+from pynamodb.expressions.update import Action
 import pynamodb_encoder.encoder as encoder
 
-cognito = boto3.client("cognito-idp")
-
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Next-Cursor", profiling.PROFILE_KEY_HEADER])
+compression.init_app(app)
+profiling.init_app(app)
 
 BASE_ROUTE = "/expenses"
-USER_POOL_ID = os.environ.get("AUTH_SPLITR2AC25091_USERPOOLID")
+GROUP_ROUTE = "/groups"
 
 ClientExpenseValidator = ExpenseValidator()
 Encoder = encoder.Encoder()
 
-connection = Connection(region=os.environ.get("REGION"))
+db = storage.get_storage()
+users_directory = directory.get_directory()
+
+TRANSACTION_MAX_ATTEMPTS = int(os.environ.get("TRANSACTION_MAX_ATTEMPTS", 5))
+"""Maximum number of times a conflicting transaction is attempted before giving up"""
+TRANSACTION_BACKOFF_BASE = float(os.environ.get("TRANSACTION_BACKOFF_BASE", 0.05))
+"""Base delay (in seconds) of the exponential backoff between transaction attempts"""
+TRANSACTION_BACKOFF_CAP = float(os.environ.get("TRANSACTION_BACKOFF_CAP", 1.0))
+"""Maximum delay (in seconds) between transaction attempts"""
+
+# Cancellation reasons which indicate that another writer got to the item first.
+# Re-reading the item and trying again will either succeed or surface a meaningful error.
+CONTENTION_CANCELLATION_CODES = {"ConditionalCheckFailed", "TransactionConflict"}
+# Cancellation reasons which indicate that DynamoDB is shedding load
+THROTTLING_CANCELLATION_CODES = {
+    "ThrottlingError",
+    "ProvisionedThroughputExceeded",
+    "RequestLimitExceeded",
+}
+
+CHANGES_PAGE_SIZE = 100
+"""Maximum number of change feed entries read per request to the changes endpoint"""
+CHANGE_SETTLE_SECONDS = float(os.environ.get("CHANGE_SETTLE_SECONDS", 5))
+"""How long after they are timestamped change feed entries are read. Entries are timestamped just
+before they are committed, so this leaves time for those still being committed to land first"""
+BATCH_LOOKUP_MAX_IDS = 100
+"""Maximum number of ids which can be looked up at once with the `ids` parameter"""
+PAST_PAGE_SIZE = int(os.environ.get("PAST_PAGE_SIZE", 50))
+"""Number of past expenses returned at a time if no `limit` is given"""
+PAST_PAGE_MAX = 200
+"""Maximum number of past expenses which can be returned at a time"""
+LEGACY_PAST_BUCKET = ""
+"""Stands in for the legacy `Past#<USER_ID>` partition among a user's buckets, after all the others"""
+
+LAMBDA_FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+"""The name of this function, set by Lambda, which user refreshes are queued on"""
+REFRESH_USER_ACTION = "refresh-user"
+REFRESH_TIME_MARGIN_MILLIS = 5000
+"""A queued user refresh stops updating expenses once its invocation has this little time left"""
+ARCHIVE_ACTION = "archive"
+ARCHIVE_TIME_MARGIN_MILLIS = 10000
+"""The archival job stops scanning once its invocation has this little time left, leaving time
+to write out the expenses it has already read"""
+
+_past_buckets_migrated = False
+_lambda_client = None
 
 
 @app.errorhandler(HTTPException)
@@ -59,120 +127,119 @@ class UserInfo(TypedDict):
     lastName: str
     wage: float
 
-def resolve_user_infos(user_ids: Optional[Iterable[str]] = None) -> Dict[str, UserInfo]:
+def resolve_user_infos(user_ids: Iterable[str], ignore_missing: bool = False) -> Dict[str, UserInfo]:
     """
     Given user IDs, populates a client-facing mapping of user IDs to user info.
-    @users: An iterable of user IDs. If None, gets information about all users.
+    @users: An iterable of user IDs.
+    @ignore_missing: Whether to leave out users who don't exist, rather than raising `UserNotFound`.
     """
-    def resolve_user_info(user) -> UserInfo:
+    def resolve_user_info(attrs: directory.Attributes) -> UserInfo:
         user_info: UserInfo = {}
-        attrs = user['UserAttributes'] if 'UserAttributes' in user else user['Attributes']
-        for attr in attrs:
-            if attr["Name"] == "given_name":
-                user_info["firstName"] = attr["Value"]
-            elif attr["Name"] == "family_name":
-                user_info["lastName"] = attr["Value"]
-            elif attr["Name"] == "custom:hourlyWage":
-                user_info["wage"] = float(attr["Value"])
-            elif attr["Name"] == "custom:venmo":
-                user_info["venmo"] = attr["Value"]
+        for name, value in attrs.items():
+            if name == "given_name":
+                user_info["firstName"] = value
+            elif name == "family_name":
+                user_info["lastName"] = value
+            elif name == "custom:hourlyWage":
+                user_info["wage"] = float(value)
+            elif name == "custom:venmo":
+                user_info["venmo"] = value
         return user_info
 
-    if user_ids is None:
-        cognito_response = cognito.list_users(UserPoolId=USER_POOL_ID)
-        users = cognito_response['Users']
-        return {user['Username']: resolve_user_info(user) for user in users}
-
     result = {}
     for user_id in user_ids:
-        # Lookup user with cognito
-        # See docs: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/cognito-idp.html#CognitoIdentityProvider.Client.admin_get_user
-        user = cognito.admin_get_user(UserPoolId=USER_POOL_ID, Username=user_id)
-        result[user_id] = resolve_user_info(user)
+        try:
+            attrs = users_directory.get_user(user_id)
+        except directory.UserNotFound:
+            if ignore_missing:
+                continue
+            raise
+        result[user_id] = resolve_user_info(attrs)
 
     return result
 
 
-def resolve_expense_total(expense: Dict[str, Any]) -> Tuple[float, float]:
+def snapshot_info(snapshot: Union[models.UserStatus, models.OwnerInfo]) -> UserInfo:
     """
-    Calculates the total value of an expense.
-    @expense: The encoded, un-transformed expense object.
-    @returns: A tuple whose first element is the expense subtotal and whose second element is the
-        expense grand total (after considering taxes/tips)
+    Returns the client-facing user info recorded in a user's snapshot on an expense.
     """
-    if expense["expenseType"] == "single":
-        return (expense["amount"], expense["amount"])
-    elif expense["expenseType"] == "multiple":
+    user_info: UserInfo = {
+        field: getattr(snapshot, field)
+        for field in models.DisplayInfo.DISPLAY_FIELDS
+        if getattr(snapshot, field) is not None
+    }
+    if snapshot.wage is not None:
+        user_info["wage"] = float(snapshot.wage)
+    return user_info
 
-        def resolve_percentage_amount(current_value: float, percentage_amount) -> float:
-            if "value" not in percentage_amount or percentage_amount["value"] is None:
-                return current_value
-            if percentage_amount["type"] == "percentage":
-                return current_value * (1 + percentage_amount["value"] / 100)
-            elif percentage_amount["type"] == "amount":
-                return current_value + percentage_amount["value"]
-            else:
-                raise Exception(
-                    f'Invalid percentage amount type: {percentage_amount["type"]}'
-                )
 
-        subtotal = sum(item["price"] * item["quantity"]
-                    for item in expense["items"])
-        total = resolve_percentage_amount(subtotal, expense["tax"])
-        total = resolve_percentage_amount(total, expense["tip"])
-        return (subtotal, total)
-    else:
-        raise Exception(f'Invalid expense type: {expense["expenseType"]}')
-
-
-def resolve_expense_contribution(
-    expense: Dict[str, Any], totals: Tuple[float, float], user_id: str
-) -> float:
-    """
-    Calculates the contribution of a user towards an expense.
-    @expense: The encoded, un-transformed expense object
-    @total: The subtotal/grand-total of the expense, as returned by `resolve_expense_total`
-    @user_id: The id of the user whose contribution towards this expense will be found.
-        Must match a user inside `expense['users']` or equal `expense['owner']`
-    @users: A mapping of user ids to info about those users.
-        Must map `user_id` and all users inside `expense['users']`
-    """
-    # If user not found in users array, contribution is necessarily 0
-    if user_id not in (user["user"] for user in expense["users"]): return 0
-    subtotal, total = totals
-
-    def remaining_contribution(total):
-        if expense["split"] == "individually":
-            return total
-        elif expense["split"] == "equally":
-            return total / len(expense["users"])
-        elif expense["split"] == "proportionally":
-            my_wage = next(user["wage"] for user in expense["users"] if user["user"] == user_id)
-            total_wages = sum(user["wage"] for user in expense["users"])
-            return (my_wage / total_wages) * total
-        elif expense["split"] == "custom":
-            my_weight = next(user["weight"] for user in expense["users"] if user["user"] == user_id)
-            total_weights = sum(user["weight"] for user in expense["users"])
-            return (my_weight / total_weights) * total
-        else:
-            raise Exception(f'Invalid expense split method: {expense["split"]}')
+def stale_user_ids(expenses: Iterable[models.ExpenseModel], fresh: bool = False) -> Set[str]:
+    """
+    Returns the ids of the users and owners of expenses who must be looked up to show them,
+    since they have no snapshot of their display info. If `fresh`, that is all of them.
+    """
+    user_ids = set()
+    for expense in expenses:
+        user_ids.update(user.user for user in expense.users if fresh or not user.has_snapshot)
+        if fresh or expense.ownerInfo is None or not expense.ownerInfo.has_snapshot:
+            user_ids.add(expense.owner)
+    return user_ids
+
 
-    if expense["expenseType"] == "single": return remaining_contribution(total)
+def show_user_infos(expense: Dict[str, Any], user_infos: Dict[str, UserInfo]):
+    """
+    Fills in the information shown about the users and owner of an encoded expense, as
+    snapshotted when it was written, or from `user_infos` for the users it holds.
+    @expense: The encoded expense object. **Will** be modified.
+    @user_infos: Information about (at least) the users returned by `stale_user_ids`.
+    """
+    for user in expense["users"]:
+        user.update(user_infos.get(user["user"], {}))
+    if expense["owner"] in user_infos:
+        expense["ownerInfo"] = user_infos[expense["owner"]]
 
-    # For itemized expenses, contributions must be computed slightly differently
-    personal_contribution = 0
-    tax_ratio = total / subtotal
-    for item in expense["items"]:
-        if 'users' in item:
-            # This item is being assigned to individual users, so should not count toward
-            # the remaining expense total
-            item_price = item["price"] * tax_ratio
-            total -= item_price
-            if user_id in item["users"]:
-                # Items assigned to multiple users are split equally among them
-                personal_contribution += item_price / len(item["users"])
 
-    return remaining_contribution(total) + personal_contribution
+def load_expense(pk: str) -> models.ExpenseModel:
+    """
+    Reads an expense, reading through to the archive if it has been archived.
+    Raises `DoesNotExist` if there is no such expense.
+    @pk: The id of the expense, including the 'Expense#' prefix.
+    """
+    return archive.resolve_expense(db.get(models.BaseModel, pk, pk))
+
+
+def load_expenses(pks: Iterable[str], consistent_read: bool = False) -> List[models.ExpenseModel]:
+    """
+    Reads many expenses at once, reading through to the archive for those which have been archived.
+    Expenses which don't exist are omitted.
+    @pks: The ids of the expenses, including the 'Expense#' prefix.
+    """
+    batch = db.batch_get(models.BaseModel, ((pk, pk) for pk in pks), consistent_read=consistent_read)
+    return archive.resolve_expenses(batch)
+
+
+def get_user_group_ids(user_id: str) -> List[str]:
+    """
+    Gets the groups a user is a member of.
+    @returns: The ids of the groups, including the 'Group#' prefix.
+    """
+    query = db.query(
+        models.GroupUserModel,
+        models.GroupUserModel.tag_for(user_id),
+        index=models.GroupUserModel.tag_date_index,
+    )
+    return [membership.id for membership in query]
+
+
+def get_group_member_ids(group_id: str) -> Set[str]:
+    """
+    Gets the ids of all members of a group.
+    @group_id: The id of the group, including the 'Group#' prefix.
+    """
+    query = db.query(
+        models.GroupUserModel, group_id, models.GroupUserModel.sk.startswith("User#")
+    )
+    return set(membership.sk.split("#")[1] for membership in query)
 
 
 class TransformExpenseArgs(TypedDict):
@@ -189,12 +256,13 @@ def transform_expense(
     Transforms an encoded expense model before it is returned to the client.
     @expense: The encoded expense object. **Will** be modified.
     """
-    # Add total and contribution fields
-    totals = kwargs.get("totals", resolve_expense_total(expense))
+    # Add total and contribution fields, computing them only if they weren't precomputed
+    totals = kwargs["totals"] if "totals" in kwargs else resolve_expense_total(expense)
     expense["total"] = totals[1]
-    expense["contribution"] = kwargs.get(
-        "contribution", resolve_expense_contribution(
-            expense, totals, user_id)
+    expense["contribution"] = (
+        kwargs["contribution"]
+        if "contribution" in kwargs
+        else resolve_expense_contribution(expense, totals, user_id)
     )
 
     # Remap 'expenseType' to 'type', and remove 'type'
@@ -204,8 +272,16 @@ def transform_expense(
     expense["id"] = expense["id"].split("#")[1]
     del expense["sk"]
 
-    # Remove expense version
-    del expense["version"]
+    # Remove expense version, and whether its users' display info was snapshotted
+    expense.pop("version", None)
+    for user in expense["users"]:
+        user.pop("snapshot", None)
+    if expense.get("ownerInfo"):
+        expense["ownerInfo"].pop("snapshot", None)
+
+    # Remove 'Group#' prefix from the group this expense belongs to
+    if expense.get("group"):
+        expense["group"] = expense["group"].split("#")[1]
 
     return expense
 
@@ -216,13 +292,266 @@ def parse_bool(value: Union[str, bool]) -> bool:
     return strtobool(value)
 
 
-def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any]):
+def parse_ids(value: str) -> List[str]:
+    """
+    Parses a comma separated list of ids, as passed in the `ids` parameter, removing duplicates.
+    """
+    ids = list(dict.fromkeys(id.strip() for id in value.split(",") if id.strip()))
+    if not ids:
+        raise BadRequest("'ids' must list at least one id")
+    if len(ids) > BATCH_LOOKUP_MAX_IDS:
+        raise BadRequest(f"At most {BATCH_LOOKUP_MAX_IDS} ids can be looked up at once")
+    return ids
+
+
+def parse_limit(value: str) -> int:
+    """
+    Parses the number of past expenses to return at a time, as passed in the `limit` parameter.
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest("'limit' must be an integer")
+    if not 1 <= limit <= PAST_PAGE_MAX:
+        raise BadRequest(f"'limit' must be between 1 and {PAST_PAGE_MAX}")
+    return limit
+
+
+def can_view_expense(expense: models.ExpenseModel, user_id: str) -> bool:
+    """
+    Users can only see expenses they are a part of.
+    """
+    return user_id == expense.owner or user_id in (user.user for user in expense.users)
+
+
+def transaction_cancellation_reasons(e: PynamoDBException) -> List[str]:
+    """
+    Decodes the reasons DynamoDB gave for cancelling a transaction.
+    @e: The error raised by a `TransactGet` or `TransactWrite`.
+    @returns: The cancellation code of each item, in the order DynamoDB reports them, which is
+        not the order the items were added in (see `storage.transaction_keys`).
+        Items which did not cause the cancellation have the code 'None'.
+        Empty if the error was not caused by a cancelled transaction.
+    """
+    if e.cause_response_code != "TransactionCanceledException":
+        return []
+    # Read the reasons off the underlying botocore error, which carries them in every version of PynamoDB
+    reasons = getattr(e.cause, "response", {}).get("CancellationReasons") or []
+    return [reason.get("Code", "None") for reason in reasons]
+
+
+def transaction_cancellation_codes(e: PynamoDBException) -> Set[str]:
+    """
+    Decodes the reasons DynamoDB gave for cancelling a transaction.
+    @e: The error raised by a `TransactGet` or `TransactWrite`.
+    @returns: The set of cancellation codes for the items which caused the cancellation.
+        Empty if the error was not caused by a cancelled transaction.
+    """
+    return set(code for code in transaction_cancellation_reasons(e) if code != "None")
+
+
+def transaction_item_reason(
+    e: PynamoDBException, transaction: storage.WriteTransaction, key: storage.Key
+) -> str:
+    """
+    Decodes the reason DynamoDB gave for cancelling a transaction because of one of its items.
+    @e: The error raised by `transaction`.
+    @key: The id and sk of the item.
+    @returns: The cancellation code of the item, or 'None' if it did not cause the cancellation.
+    """
+    reasons = transaction_cancellation_reasons(e)
+    for item_key, reason in zip(storage.transaction_keys(transaction), reasons):
+        if item_key == key:
+            return reason
+    return "None"
+
+
+def transaction_backoff(attempt: int):
+    """
+    Sleeps before retrying a cancelled transaction, using capped exponential backoff
+    with full jitter so that colliding writers spread out instead of colliding again.
+    @attempt: The zero-based index of the attempt which just failed.
+    """
+    delay = min(TRANSACTION_BACKOFF_CAP, TRANSACTION_BACKOFF_BASE * (2 ** attempt))
+    time.sleep(random.uniform(0, delay))
+
+
+def retry_transaction(attempt: Callable[[], None], expense_id: str):
+    """
+    Calls `attempt` until it succeeds, retrying whenever its transactions are cancelled because
+    other requests modified the same items at the same time.
+    @attempt: Performs the operation. Must re-read any state it depends on, since it may be
+        called several times.
+    @expense_id: The id of the expense being modified, used in error messages.
+    """
+    for attempt_index in range(TRANSACTION_MAX_ATTEMPTS):
+        try:
+            attempt()
+            return
+        except (TransactGetError, TransactWriteError) as e:
+            codes = transaction_cancellation_codes(e)
+            if not codes or not codes <= (CONTENTION_CANCELLATION_CODES | THROTTLING_CANCELLATION_CODES):
+                raise
+            if attempt_index + 1 < TRANSACTION_MAX_ATTEMPTS:
+                transaction_backoff(attempt_index)
+
+    if codes & THROTTLING_CANCELLATION_CODES:
+        raise TooManyRequests(
+            f"Too many requests to update expense '{expense_id}'. Try again later."
+        )
+    raise Conflict(
+        f"Expense '{expense_id}' is being modified by another request. Try again."
+    )
+
+
+def record_expense_changes(
+    transaction: storage.WriteTransaction, expense_id: str, changes: Dict[str, str]
+):
+    """
+    Appends entries to the change feeds of the users affected by a write to an expense.
+    The entries are written as part of `transaction`, so they are committed along with the write.
+    Entries are keyed by the time they are written at and the expense, so they never conflict
+    with entries for other expenses.
+    @expense_id: The id of the changed expense, including the 'Expense#' prefix.
+    @changes: A mapping of ids of affected users to the change they observe,
+        one of 'added', 'updated', or 'deleted'.
+    """
+    now = time.time_ns() // 1000
+    for user_id, action in changes.items():
+        transaction.save(models.ExpenseChangeModel.new(user_id, now, expense_id, action))
+
+
+def record_past_bucket(transaction: storage.WriteTransaction, expense_user: models.ExpenseUserModel):
+    """
+    If `expense_user` is tagged as past, adds its bucket to the user's set of past buckets
+    as part of `transaction`. Adding to a set is idempotent, so no condition is needed.
+    """
+    bucket = expense_user.past_bucket
+    if bucket is None:
+        return
+    transaction.update(
+        models.PastBucketsModel.new(expense_user.user_id),
+        actions=[models.PastBucketsModel.buckets.add({bucket})],
+    )
+
+
+def encode_cursor(cursor: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+    if not isinstance(decoded, dict):
+        raise BadRequest("Invalid cursor")
+    return decoded
+
+
+def past_buckets_migrated() -> bool:
+    """
+    Whether the `past-buckets` migration has moved every past expense out of the legacy
+    `Past#<USER_ID>` partitions. Once it has, this no longer reads the table.
+    """
+    global _past_buckets_migrated
+    if not _past_buckets_migrated:
+        key = models.MigrationModel.key("past-buckets")
+        try:
+            db.get(models.MigrationModel, key, key)
+            _past_buckets_migrated = True
+        except DoesNotExist:
+            pass
+    return _past_buckets_migrated
+
+
+def query_past_expense_users(
+    user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> Tuple[List[models.ExpenseUserModel], Optional[str]]:
+    """
+    Reads a user's past expense rows, walking their monthly buckets from newest to oldest
+    and stopping as soon as `limit` rows have been read. Until the `past-buckets` migration
+    has finished, rows which have yet to be moved into a bucket are read last.
+    @limit: The maximum number of rows to read. If `None`, all rows are read.
+    @cursor: The cursor returned by a previous call, to continue where it left off.
+    @returns: A tuple of the rows read and a cursor to pass in to read the next page,
+        or `None` if there are no more rows.
+    """
+    key = models.PastBucketsModel.new(user_id).id
+    try:
+        buckets = db.get(models.PastBucketsModel, key, key).buckets or set()
+    except DoesNotExist:
+        buckets = set()
+    buckets = sorted(buckets, reverse=True)
+    if not past_buckets_migrated():
+        buckets.append(LEGACY_PAST_BUCKET)
+
+    last_evaluated_key = None
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        buckets = [bucket for bucket in buckets if bucket <= position.get("bucket", "")]
+        last_evaluated_key = position.get("key")
+
+    rows: List[models.ExpenseUserModel] = []
+    for i, bucket in enumerate(buckets):
+        remaining = None if limit is None else limit - len(rows)
+        query = db.query(
+            models.ExpenseUserModel,
+            models.ExpenseUserModel.past_tag(user_id, bucket)
+            if bucket != LEGACY_PAST_BUCKET
+            else models.ExpenseUserModel.legacy_past_tag(user_id),
+            index=models.ExpenseUserModel.tag_date_index,
+            scan_index_forward=False,
+            limit=remaining,
+            last_evaluated_key=last_evaluated_key,
+        )
+        rows.extend(query)
+        last_evaluated_key = None
+
+        if limit is not None and len(rows) >= limit:
+            if query.last_evaluated_key is not None:
+                return rows, encode_cursor({"bucket": bucket, "key": query.last_evaluated_key})
+            if i + 1 < len(buckets):
+                return rows, encode_cursor({"bucket": buckets[i + 1]})
+            return rows, None
+
+    return rows, None
+
+
+def expense_update_actions(before: Dict[str, Any], after: Dict[str, Any]) -> List[Action]:
+    """
+    Returns the update actions which change the attributes of an expense serialized as `before`
+    into those of the same expense serialized as `after`, leaving unchanged attributes alone.
+    The version is left out, since updates bump it themselves.
+    """
+    actions = []
+    for attribute in models.ExpenseModel.get_attributes().values():
+        if attribute.is_hash_key or attribute.is_range_key or isinstance(attribute, VersionAttribute):
+            continue
+        old, new = before.get(attribute.attr_name), after.get(attribute.attr_name)
+        if old == new:
+            continue
+        actions.append(attribute.set(new) if new is not None else attribute.remove())
+    return actions
+
+
+def update_and_write_expense(
+    expense: models.ExpenseModel,
+    data: Dict[str, Any],
+    status_code: int = 200,
+    rewrite: bool = False,
+):
     """
     Validates client sent data, modifies the given expense, and writes it to the database.
+    Only the attributes and user entries which changed are written.
     Returns the encoded, transformed version of the expense.
     @expense: An existing or newly created expense model.
     @data: Data sent from the client which will be validated.
         If validation fails, `BadRequest` is raised.
+    @status_code: The status code the expense will be returned to the client with.
+        Recorded along with the expense if the request has an idempotency key.
+    @rewrite: Whether to write the whole expense, e.g. when restoring it from the archive.
+        New expenses are always written whole.
     """
     if not ClientExpenseValidator.validate(data):
         raise BadRequest(ClientExpenseValidator.errors)
@@ -231,6 +560,40 @@ def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any])
     user_info = get_user_details()
     user_id = user_info["cognito:username"]
 
+    # Expenses belong to a group, and may only be split among that group's members.
+    # If no group is given, the expense stays in its current group, or else goes in the
+    # owner's group if they only belong to one.
+    group_id = f'Group#{data["group"]}' if "group" in data else expense.group
+    if group_id is None:
+        group_ids = get_user_group_ids(user_id)
+        if len(group_ids) != 1:
+            raise BadRequest("Must specify the group this expense belongs to")
+        group_id = group_ids[0]
+    member_ids = get_group_member_ids(group_id)
+    if user_id not in member_ids:
+        raise BadRequest("Can only create expenses in groups you are a member of")
+
+    # Remember the expense as it is stored, so that only what changes is written
+    is_new = expense.users is None
+    rewrite = rewrite or is_new
+    before = {} if is_new else expense.serialize(null_check=False)
+    old_user_ids: Set[str] = set()
+    old_user_statuses: Dict[str, models.UserStatus] = {}
+    old_users: Dict[str, models.ExpenseUserModel] = {}
+    snapshots: Dict[str, UserInfo] = {}
+    if not is_new:
+        old_user_statuses = {user.user: user for user in expense.users}
+        old_user_ids = set(old_user_statuses)
+        old_user_ids.add(user_id)
+        old_users = {id: models.ExpenseUserModel.new(expense, id) for id in old_user_ids}
+        snapshots = {id: snapshot_info(user) for id, user in old_user_statuses.items() if user.has_snapshot}
+        if expense.ownerInfo is not None and expense.ownerInfo.has_snapshot:
+            snapshots.setdefault(expense.owner, snapshot_info(expense.ownerInfo))
+    # Unchanged items keep their ids, whether or not the client sent them back
+    old_items: Dict[str, models.Item] = {item.id: item for item in expense.items or []}
+
+    expense.group = group_id
+
     # Validation succeeded, create ExpenseModel from client input
     expense.name = data["name"]
     expense.owner = user_id
@@ -259,6 +622,11 @@ def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any])
                     user_ids.update(item['users'])
             data['users'] = [user for user in data['users'] if user['user'] in user_ids]
 
+        def item_contents(item: models.Item) -> Dict[str, Any]:
+            contents = item.as_dict()
+            del contents["id"]
+            return contents
+
         def get_item(data_item) -> models.Item:
             item = models.Item.new(
                 name=data_item["name"],
@@ -278,6 +646,15 @@ def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any])
 
                 item.users = item_user_ids
 
+            # Keep the id of the item this one replaces, so that unchanged items stay unchanged:
+            # the item with the id the client sent, or else an unclaimed one with the same contents
+            old_item = old_items.get(data_item.get("id")) or next(
+                (old for old in old_items.values() if item_contents(old) == item_contents(item)),
+                None,
+            )
+            if old_item is not None:
+                item.id = old_items.pop(old_item.id).id
+
             return item
 
         expense.items = [get_item(item) for item in data["items"]]
@@ -285,27 +662,48 @@ def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any])
         expense.tip = models.PercentageAmount(**data["tip"])
 
     # Get all users who are a part of this transaction to add into DynamoDB
-    user_ids: Set[str] = None
-    new_user_statuses: Iterable[models.UserStatus] = None
+    requested_ids: List[str] = None
+    wages: Dict[str, float] = None
     if expense.split == "individually":
         # If expense is split individually, we only need to include the owner
-        user_ids = set([user_id])
-        new_user_statuses = [models.UserStatus(user=user_id, paid=True, wage=float(user_info["custom:hourlyWage"]))]
+        requested_ids = [user_id]
+        wages = {user_id: float(user_info["custom:hourlyWage"])}
     else:
         # users array contains the users that should be added to the expense
         if not data["users"]: raise BadRequest("Non-individual expenses must have at least one user")
-
-        user_infos = resolve_user_infos(info["user"] for info in data["users"])
-        user_ids = set(user_infos.keys())
-        new_user_statuses = [models.UserStatus(user=id, paid=(id==user_id), wage=info["wage"]) for id, info in user_infos.items()]
-
-        # user provided custom weights: add these to the user statuses
-        if expense.split == "custom":
-            for user_status in new_user_statuses:
-                # Find the user with this id in the expense data
-                user_info = next(info for info in data["users"] if info["user"] == user_status.user)
-                if "weight" not in user_info: raise BadRequest(f'Weight missing for user {user_info["user"]} in expense with custom split')
-                user_status.weight = user_info["weight"]
+        if not set(info["user"] for info in data["users"]).issubset(member_ids):
+            raise BadRequest("Expenses can only be split among members of the expense's group")
+        requested_ids = list(dict.fromkeys(info["user"] for info in data["users"]))
+        wages = {id: old_user_statuses[id].wage for id in requested_ids if id in old_user_statuses}
+
+    # Wages and display info are recorded when users are added to an expense, so only users who
+    # weren't already a part of it need to be looked up, along with any who were added before
+    # display info was recorded
+    lookup_ids = [
+        id for id in dict.fromkeys(requested_ids + [user_id])
+        if id not in snapshots or (id in requested_ids and id not in wages)
+    ]
+    if lookup_ids:
+        for id, info in resolve_user_infos(lookup_ids).items():
+            wages.setdefault(id, info["wage"])
+            snapshots[id] = info
+
+    user_ids: Set[str] = set(requested_ids)
+    new_user_statuses: List[models.UserStatus] = []
+    for id in requested_ids:
+        user_status = models.UserStatus(user=id, paid=(id==user_id), wage=wages[id])
+        user_status.take_snapshot(snapshots[id])
+        new_user_statuses.append(user_status)
+    expense.ownerInfo = models.OwnerInfo(wage=wages.get(user_id, snapshots[user_id].get("wage")))
+    expense.ownerInfo.take_snapshot(snapshots[user_id])
+
+    # user provided custom weights: add these to the user statuses
+    if expense.split == "custom":
+        for user_status in new_user_statuses:
+            # Find the user with this id in the expense data
+            user_info = next(info for info in data["users"] if info["user"] == user_status.user)
+            if "weight" not in user_info: raise BadRequest(f'Weight missing for user {user_info["user"]} in expense with custom split')
+            user_status.weight = user_info["weight"]
 
     # Ensure that the owning user gets an ExpenseUserModel dedicated to them,
     # regardless of whether or not they were in the `expense["users"]` array passed by the client
@@ -313,22 +711,71 @@ def update_and_write_expense(expense: models.ExpenseModel, data: Dict[str, Any])
 
     # It is possible that some users have been removed from the expense
     # We must delete these users' database entries associated with the expense
-    user_models_to_delete = []
-    if expense.users is not None:
-        delete_user_ids = set(user.user for user in expense.users) - user_ids
-        user_models_to_delete = (models.ExpenseUserModel(expense.id, f'User#{id}') for id in delete_user_ids)
+    delete_user_ids = old_user_ids - user_ids
+    user_models_to_delete = [models.ExpenseUserModel(expense.id, f'User#{id}') for id in delete_user_ids]
 
     expense.users = new_user_statuses
-    users = [models.ExpenseUserModel.new(expense, id) for id in user_ids]
+
+    # Users' entries only need to be written if their tag or date changed
+    users = []
+    for id in user_ids:
+        user = models.ExpenseUserModel.new(expense, id)
+        old_user = old_users.get(id)
+        if old_user is None or (old_user.tag, old_user.date) != (user.tag, user.date):
+            users.append(user)
+
+    after = expense.serialize()
+    actions = [] if rewrite else expense_update_actions(before, after)
+    changed = rewrite or bool(actions or users or user_models_to_delete)
+
+    # Every user who is or was a part of this expense sees the change in their change feed
+    changes: Dict[str, str] = {}
+    if changed:
+        changes = {id: ("updated" if id in old_user_ids else "added") for id in user_ids}
+        changes.update((id, "deleted") for id in delete_user_ids)
 
     # When we write an expense to the database, we must write associated users as entries to the table as well
     # We will use a transaction to do this to ensure that all writes occur atomically
-    with TransactWrite(connection=connection) as transaction:
-        transaction.save(expense)
-        for user in users:
-            transaction.save(user)
-        for user in user_models_to_delete:
-            transaction.delete(user)
+    def write_expense(transaction: storage.WriteTransaction):
+        with transaction:
+            if rewrite:
+                transaction.save(expense)
+            elif actions:
+                transaction.update(expense, actions=list(actions))
+            else:
+                # Nothing about the expense itself changed, but what was written
+                # was computed from it, so it must not have changed in the meantime
+                transaction.condition_check(
+                    models.ExpenseModel, expense.id, expense.sk,
+                    condition=models.ExpenseModel.version == expense.version,
+                )
+            for user in users:
+                transaction.save(user)
+                record_past_bucket(transaction, user)
+            for user in user_models_to_delete:
+                transaction.delete(user)
+            record_expense_changes(transaction, expense.id, changes)
+            # Retries of this request get back the expense as it was written here
+            idempotency.complete_in(
+                transaction, status_code, transform_expense(Encoder.encode(expense), user_id)
+            )
+
+    def write():
+        transaction = db.transact_write()
+        try:
+            write_expense(transaction)
+        except TransactWriteError as e:
+            # The expense is written conditioned on the version it was read at. If that fails,
+            # another request modified it since, so retrying cannot succeed. Other items failing
+            # their conditions means a race with a request writing them, which retrying resolves.
+            if transaction_item_reason(e, transaction, (expense.id, expense.sk)) == "ConditionalCheckFailed":
+                raise Conflict(
+                    f"Expense '{expense.id.split('#')[1]}' was modified by another request. Reload it and try again."
+                )
+            raise
+
+    retry_transaction(write, expense.id.split("#")[1])
+    coalescing.invalidate()
 
     return transform_expense(Encoder.encode(expense), user_id)
 
@@ -343,57 +790,291 @@ def verify_expense_modification(expense: models.ExpenseModel, user_id: str):
         raise BadRequest("Can't delete/modify an expense with confirmed users.")
 
 
+def refresh_user_snapshots(user_id: str, out_of_time: Callable[[], bool] = lambda: False) -> Tuple[int, bool]:
+    """
+    Updates the snapshot of a user's display info on every expense they are a part of,
+    e.g. after they change their name or link a Venmo account.
+    Archived expenses keep the snapshot they were archived with.
+    @out_of_time: Called before each expense is updated. Once it returns `True`, no more are updated.
+        Expenses which are already up to date are skipped, so calling this again picks up where it left off.
+    @returns: The number of expenses which were updated, and whether all of them were.
+    """
+    info = resolve_user_infos([user_id])[user_id]
+
+    rows: List[models.ExpenseUserModel] = []
+    for group in ("Owner", "Payer"):
+        rows.extend(
+            db.query(models.ExpenseUserModel, f"{group}#{user_id}", index=models.ExpenseUserModel.tag_date_index)
+        )
+    rows.extend(query_past_expense_users(user_id)[0])
+
+    refreshed = 0
+    for expense_id in sorted(set(row.id for row in rows)):
+        if out_of_time():
+            return refreshed, False
+
+        def write():
+            nonlocal refreshed
+            try:
+                expense = db.get(models.BaseModel, expense_id, expense_id, consistent_read=True)
+            except DoesNotExist:
+                return
+            if not isinstance(expense, models.ExpenseModel):
+                return
+
+            before = expense.serialize(null_check=False)
+            for user in expense.users:
+                if user.user == user_id:
+                    user.take_snapshot(info)
+            if expense.owner == user_id:
+                if expense.ownerInfo is None:
+                    expense.ownerInfo = models.OwnerInfo(wage=info.get("wage"))
+                expense.ownerInfo.take_snapshot(info)
+            actions = expense_update_actions(before, expense.serialize())
+            if not actions:
+                return
+
+            participant_ids = set(user.user for user in expense.users)
+            participant_ids.add(expense.owner)
+            with db.transact_write() as transaction:
+                transaction.update(expense, actions=actions)
+                record_expense_changes(transaction, expense.id, {id: "updated" for id in participant_ids})
+            refreshed += 1
+
+        retry_transaction(write, expense_id.split("#")[1])
+        coalescing.invalidate()
+
+    return refreshed, True
+
+
+def get_lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        _lambda_client = boto3.client("lambda")
+    return _lambda_client
+
+
+def queue_user_refresh(user_id: str):
+    """
+    Refreshes a user's snapshots in a separate, asynchronous invocation of this function,
+    since a user may be part of more expenses than can be updated within API Gateway's timeout.
+    """
+    get_lambda_client().invoke(
+        FunctionName=LAMBDA_FUNCTION_NAME,
+        InvocationType="Event",
+        Payload=json.dumps({"action": REFRESH_USER_ACTION, "user": user_id}).encode(),
+    )
+
+
+def handle_user_refresh(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Handles an invocation queued by `queue_user_refresh`. If the refresh can't be finished
+    before the invocation times out, the rest of it is queued again.
+    """
+    user_id = event["user"]
+    refreshed, done = refresh_user_snapshots(
+        user_id,
+        out_of_time=lambda: context.get_remaining_time_in_millis() < REFRESH_TIME_MARGIN_MILLIS,
+    )
+    if not done:
+        queue_user_refresh(user_id)
+    return {"refreshed": refreshed, "done": done}
+
+
+@app.route('/users/refresh', methods=['POST'])
+def refresh_user():
+    """
+    Refreshes how this user is shown on the expenses they are a part of, after they change their profile.
+    """
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    # Outside of Lambda, e.g. when running locally, there is nothing to queue the refresh on
+    if not LAMBDA_FUNCTION_NAME:
+        refreshed, _ = refresh_user_snapshots(user_id)
+        return jsonify({"refreshed": refreshed})
+
+    queue_user_refresh(user_id)
+    return jsonify({}), 202
+
+
 @app.route('/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     try:
         users = [{'user': id, **info} for id, info in resolve_user_infos([user_id]).items()]
         return jsonify(users[0])
-    except cognito.exceptions.UserNotFoundException:
+    except directory.UserNotFound:
         raise NotFound(f"No user with id '{user_id}' could be found.")
 
 
 @app.route('/users', methods=['GET'])
+@coalescing.coalesced
 def get_users():
-    users = [{'user': user_id, **info} for user_id, info in resolve_user_infos().items()]
+    """
+    Gets information about every user who shares a group with this user,
+    or about the users with the given `ids`.
+    """
+    # Specific users may be looked up all at once, in the same way as `GET /users/<id>`.
+    # Users who don't exist are left out.
+    if "ids" in request.args:
+        ids = parse_ids(request.args["ids"])
+        user_infos = resolve_user_infos(ids, ignore_missing=True)
+        return jsonify([{'user': id, **user_infos[id]} for id in ids if id in user_infos])
+
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    member_ids = set()
+    for group_id in get_user_group_ids(user_id):
+        member_ids.update(get_group_member_ids(group_id))
+
+    users = [{'user': id, **info} for id, info in resolve_user_infos(member_ids).items()]
+    return jsonify(users)
+
+
+def transform_group(group: models.GroupModel) -> Dict[str, Any]:
+    return {"id": group.id.split("#")[1], "name": group.name}
+
+
+@app.route(GROUP_ROUTE, methods=['GET'])
+def get_groups():
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    group_ids = get_user_group_ids(user_id)
+    groups = db.batch_get(models.GroupModel, ((id, id) for id in group_ids))
+    return jsonify([transform_group(group) for group in groups])
+
+
+@app.route(GROUP_ROUTE, methods=['POST'])
+def create_group():
+    """
+    Creates a new group with the given access key, and adds this user to it.
+    """
+    data = request.get_json()
+    if not GroupValidator.validate(data):
+        raise BadRequest(GroupValidator.errors)
+    data = GroupValidator.document
+
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    group = models.GroupModel.new(name=data["name"])
+    access_key = models.GroupAccessKeyModel.new(data["accessKey"], group.id)
+    try:
+        with db.transact_write() as transaction:
+            transaction.save(group)
+            transaction.save(
+                access_key,
+                condition=models.GroupAccessKeyModel.id.does_not_exist(),
+            )
+            transaction.save(models.GroupUserModel.new(group.id, user_id))
+    except TransactWriteError as e:
+        if "ConditionalCheckFailed" in transaction_cancellation_codes(e):
+            raise Conflict("That access key is already in use")
+        raise
+    coalescing.invalidate()
+
+    return jsonify(transform_group(group)), 201
+
+
+@app.route(f"{GROUP_ROUTE}/join", methods=['POST'])
+def join_group():
+    """
+    Adds this user to the group with the given access key.
+    """
+    data = request.get_json()
+    if not JoinGroupValidator.validate(data):
+        raise BadRequest(JoinGroupValidator.errors)
+    data = JoinGroupValidator.document
+
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    key = models.GroupAccessKeyModel.key(data["accessKey"])
+    try:
+        access_key = db.get(models.GroupAccessKeyModel, key, key)
+        group = db.get(models.GroupModel, access_key.group, access_key.group)
+    except DoesNotExist:
+        raise NotFound("No group with that access key could be found.")
+
+    db.save(models.GroupUserModel.new(group.id, user_id))
+    coalescing.invalidate()
+    return jsonify(transform_group(group))
+
+
+@app.route(f"{GROUP_ROUTE}/<group_id>/users", methods=['GET'])
+def get_group_users(group_id):
+    """
+    Gets information about the members of a group. Only members can see a group.
+    """
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    member_ids = get_group_member_ids(f"Group#{group_id}")
+    if user_id not in member_ids:
+        raise NotFound(f"No group with id '{group_id}' could be found.")
+
+    users = [{'user': id, **info} for id, info in resolve_user_infos(member_ids).items()]
     return jsonify(users)
 
 
 @app.route(BASE_ROUTE, methods=["POST"])
+@idempotency.idempotent
 def create_expense():
     expense = models.ExpenseModel.new()
     data = request.get_json()
-    transformed = update_and_write_expense(expense, data)
+    transformed = update_and_write_expense(expense, data, status_code=201)
     return jsonify(transformed), 201
 
 
 @app.route(BASE_ROUTE, methods=["GET"])
+@coalescing.coalesced
 def get_expenses():
     # Amplify front-end GET requests use query params, NOT a JSON body... weird
     own = parse_bool(request.args.get("own", True))
     past = parse_bool(request.args.get("past", False))
     group_expenses = parse_bool(request.args.get("group", False))
+    fresh = parse_bool(request.args.get("fresh", False))
+    limit = parse_limit(request.args.get("limit", PAST_PAGE_SIZE))
+    cursor = request.args.get("cursor", None)
     user_info = get_user_details()
     user_id = user_info["cognito:username"]
 
-    group = "Past" if past else ("Owner" if own else "Payer")
-    partition = f"{group}#{user_id}"
-    query = models.ExpenseUserModel.tag_date_index.query(partition)
-    batch = models.ExpenseModel.batch_get((item.id, item.id) for item in query)
-    expenses = [Encoder.encode(item) for item in batch]
+    # Specific expenses may be looked up all at once, in the same way as `GET /expenses/<id>`
+    if "ids" in request.args:
+        return get_expenses_by_id(parse_ids(request.args["ids"]), user_id, fresh)
+
+    # Past expenses are spread across monthly buckets, and may be paged through
+    # using `limit` and the cursor returned in the 'X-Next-Cursor' header
+    next_cursor = None
+    if past:
+        query, next_cursor = query_past_expense_users(user_id, limit, cursor)
+    else:
+        group = "Owner" if own else "Payer"
+        partition = f"{group}#{user_id}"
+        query = db.query(
+            models.ExpenseUserModel, partition, index=models.ExpenseUserModel.tag_date_index
+        )
+    batch = load_expenses(item.id for item in query)
 
     # Sort items in reverse chronological order
-    expenses.sort(key=lambda item: item["date"], reverse=True)
+    batch.sort(key=lambda item: item.date, reverse=True)
+    expenses = [Encoder.encode(item) for item in batch]
 
-    # Get ids of all associated users
-    user_ids = set(
-        user_info["user"] for item in expenses for user_info in item["users"]
-    )
-    user_ids.update(item["owner"] for item in expenses)
-    users = resolve_user_infos(user_ids)
+    # Users are shown as they were when each expense was written, so only those
+    # without a snapshot need to be looked up, unless fresh information is requested
+    users = resolve_user_infos(stale_user_ids(batch, fresh))
+    for expense in expenses:
+        show_user_infos(expense, users)
 
     # Transform each expense in place, adding info like contribution and total cost
+    # Totals and contributions are computed for all expenses at once
+    totals, contributions = resolve_expense_batch(expenses, [user_id])
     for i in range(len(expenses)):
-        transform_expense(expenses[i], user_id)
+        transform_expense(
+            expenses[i], user_id, totals=totals[i], contribution=contributions[user_id][i]
+        )
 
     # If group is true, group expenses by users and add in user info
     if group_expenses:
@@ -405,58 +1086,177 @@ def get_expenses():
                 groups[owner]["expenses"] = []
             groups[owner]["expenses"].append(expense)
 
-        users = resolve_user_infos(groups.keys())
+        # Owners are shown as of their most recent expense
         for owner, group in groups.items():
-            group["owner"] = users[owner]
+            group["owner"] = group["expenses"][0]["ownerInfo"]
+
+        response = jsonify(groups)
+    else:
+        response = jsonify(expenses)
+
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
-        return jsonify(groups)
 
-    return jsonify(expenses)
+@app.route(f"{BASE_ROUTE}/changes", methods=["GET"])
+def get_expense_changes():
+    """
+    Returns the expenses this user is a part of which were added, updated, or deleted since
+    the given cursor. Clients pass the returned `cursor` to the next call to stay in sync.
+    Without a cursor, only the latest cursor is returned, to follow on from freshly read lists.
+    """
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    # Only entries which have settled are read, so that one committed late with an earlier
+    # timestamp than those already read isn't skipped
+    now = time.time_ns() // 1000
+    settled = models.ExpenseChangeModel.sort_key(now - int(CHANGE_SETTLE_SECONDS * 1e6) + 1)
+    if "since" not in request.args:
+        return jsonify({
+            "cursor": encode_cursor({"after": settled}), "more": False, "added": [], "updated": [], "deleted": []
+        })
+
+    after = decode_cursor(request.args["since"]).get("after")
+    try:
+        after_time = models.ExpenseChangeModel.time_of(after)
+    except (AttributeError, IndexError, ValueError):
+        raise BadRequest("Invalid cursor")
+    if after_time < now - models.CHANGE_RETENTION_DAYS * 24 * 3600 * 10 ** 6:
+        raise Gone("Cursor has expired")
+
+    entries: List[models.ExpenseChangeModel] = []
+    if after < settled:
+        entries = [
+            entry for entry in db.query(
+                models.ExpenseChangeModel,
+                models.ExpenseChangeModel.key(user_id),
+                models.ExpenseChangeModel.sk.between(after, settled),
+                consistent_read=True,
+                limit=CHANGES_PAGE_SIZE + 1,
+            )
+            if entry.sk != after
+        ]
+    more = len(entries) > CHANGES_PAGE_SIZE
+    entries = entries[:CHANGES_PAGE_SIZE]
+
+    # Collapse entries so each expense is reported once, with its latest state
+    actions: Dict[str, str] = {}
+    for entry in entries:
+        if entry.action == "updated" and actions.get(entry.expense) == "added":
+            continue
+        actions[entry.expense] = entry.action
+
+    result = {
+        "cursor": encode_cursor({"after": entries[-1].sk if more else max(after, settled)}),
+        "more": more,
+        "added": [],
+        "updated": [],
+        "deleted": [],
+    }
+
+    live_ids = [id for id, action in actions.items() if action != "deleted"]
+    found_ids = set()
+    for model in load_expenses(live_ids, consistent_read=True):
+        if not can_view_expense(model, user_id):
+            continue
+        found_ids.add(model.id)
+        expense = transform_expense(Encoder.encode(model), user_id)
+        # Let clients know which list (Owner, Payer, or Past) this expense belongs in
+        expense["list"] = models.ExpenseUserModel.new(model, user_id).tag.split("#")[0]
+        result[actions[model.id]].append(expense)
+
+    result["deleted"] = [
+        id.split("#")[1] for id, action in actions.items()
+        if action == "deleted" or id not in found_ids
+    ]
+
+    return jsonify(result)
+
+
+def transform_expense_details(
+    encoded: Dict[str, Any],
+    user_id: str,
+    user_infos: Dict[str, UserInfo],
+    totals: Optional[Tuple[float, float]] = None,
+    contributions: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """
+    Transforms an encoded expense along with the details shown when viewing it:
+    information about, and the contribution of, each of its users and its owner.
+    @encoded: The encoded expense object. **Will** be modified.
+    @user_infos: Information about (at least) the users of the expense returned by `stale_user_ids`.
+    @totals: The expense's totals, if already computed by `resolve_expense_batch`.
+    @contributions: Each user's contribution towards the expense, if already computed along with `totals`.
+    """
+    # Populate result's user field with information about all associated users
+    if totals is None:
+        totals = resolve_expense_total(encoded)
+    if contributions is None:
+        contributions = {
+            id: resolve_expense_contribution(encoded, totals, id)
+            for id in set(user["user"] for user in encoded["users"]) | {user_id}
+        }
+    contribution = contributions.get(user_id, 0)  # This user's contribution
+    # Populate fields such as first name, last name, wage, etc.
+    show_user_infos(encoded, user_infos)
+    for user in encoded["users"]:
+        user["contribution"] = contributions[user["user"]]
+
+        # Add proportional contribution
+        user["proportion"] = user["contribution"] / totals[1]
+
+    return transform_expense(encoded, user_id, totals=totals, contribution=contribution)
+
+
+def get_expenses_by_id(expense_ids: List[str], user_id: str, fresh: bool = False) -> Response:
+    """
+    Looks up many expenses at once, with the same details and visibility as `GET /expenses/<id>`.
+    Expenses which don't exist or which this user can't see are left out.
+    @expense_ids: The ids of the expenses, without the 'Expense#' prefix.
+    @fresh: Whether to look up the current information of users, rather than showing their snapshots.
+    """
+    found = {
+        model.id: model
+        for model in load_expenses(f"Expense#{id}" for id in expense_ids)
+        if can_view_expense(model, user_id)
+    }
+    expenses = [found[f"Expense#{id}"] for id in expense_ids if f"Expense#{id}" in found]
+
+    # Users are resolved once, however many of the expenses they are a part of
+    user_infos = resolve_user_infos(stale_user_ids(expenses, fresh))
+
+    # Every user's contribution towards every expense is shown, so compute them all at once
+    encoded = [Encoder.encode(expense) for expense in expenses]
+    totals, contributions = resolve_expense_batch(encoded)
+    return jsonify([
+        transform_expense_details(
+            expense, user_id, user_infos,
+            totals=totals[i],
+            contributions={
+                user["user"]: contributions[user["user"]][i] for user in expense["users"]
+            },
+        )
+        for i, expense in enumerate(encoded)
+    ])
 
 
 @app.route(f"{BASE_ROUTE}/<expense_id>", methods=["GET"])
 def get_expense(expense_id):
     try:
         pk = f"Expense#{expense_id}"
-        model = models.ExpenseModel.get(pk, pk)
+        model = load_expense(pk)
 
         # Users can only see expenses they are a part of
         user_info = get_user_details()
         user_id = user_info["cognito:username"]
-        if user_id != model.owner and user_id not in (user.user for user in model.users):
+        if not can_view_expense(model, user_id):
             raise NotFound()
 
-        encoded = Encoder.encode(model)
-
-        # Populate result's user field with information about all associated users
-        totals = resolve_expense_total(encoded)
-        contribution = resolve_expense_contribution(
-            encoded, totals, user_id
-        )  # This user's contribution
-        user_infos = resolve_user_infos(
-            user["user"] for user in encoded["users"])
-        for user in encoded["users"]:
-            # Populate fields such as first name, last name, wage, etc.
-            user.update(user_infos[user["user"]])
-
-            # Add contribution. This check prevents computing this user's contribution twice
-            if user["user"] == user_id:
-                user["contribution"] = contribution
-            else:
-                user["contribution"] = resolve_expense_contribution(
-                    encoded, totals, user["user"]
-                )
-
-            # Add proportional contribution
-            user["proportion"] = user["contribution"] / totals[1]
-
-        # Add information about the owner of the expense
-        encoded["ownerInfo"] = next(iter(resolve_user_infos([encoded["owner"]]).values()))
-
-        return jsonify(
-            transform_expense(encoded, user_id, totals=totals,
-                              contribution=contribution)
-        )
+        fresh = parse_bool(request.args.get("fresh", False))
+        user_infos = resolve_user_infos(stale_user_ids([model], fresh))
+        return jsonify(transform_expense_details(Encoder.encode(model), user_id, user_infos))
     except DoesNotExist:
         raise NotFound()
 
@@ -465,7 +1265,8 @@ def get_expense(expense_id):
 def put_expense(expense_id):
     pk = f"Expense#{expense_id}"
     try:
-        expense = models.ExpenseModel.get(pk, pk)
+        stored = db.get(models.BaseModel, pk, pk)
+        expense = archive.resolve_expense(stored)
     except DoesNotExist:
         raise NotFound("No expense with that id found")
 
@@ -475,102 +1276,152 @@ def put_expense(expense_id):
     # Only users can update their own expenses
     verify_expense_modification(expense, user_id)
 
+    # Archived expenses are written back whole, over their tombstone
     data = request.get_json()
-    transformed = update_and_write_expense(expense, data)
+    transformed = update_and_write_expense(
+        expense, data, rewrite=isinstance(stored, models.ArchivedExpenseModel)
+    )
     return jsonify(transformed)
 
 
-def confirm_or_rescind_expenses(confirm: bool, expense_ids: Iterable[str]) -> Response:
-    user_info = get_user_details()
-    user_id = user_info["cognito:username"]
+def confirm_or_rescind_expense(
+    confirm: bool, expense_id: str, user_id: str, record_response: bool = False
+):
+    """
+    Makes a single attempt at confirming or rescinding a user's payment towards an expense.
+    The read state is asserted as a precondition of the write, so if another user modifies
+    the expense in between, the write is cancelled rather than overwriting their change.
+    @confirm: Whether to confirm (`True`) or rescind (`False`) payment.
+    @expense_id: The id of the expense, without the 'Expense#' prefix.
+    @user_id: The id of the user confirming or rescinding payment.
+    @record_response: Whether to record the response to an idempotent request in the same write.
+    """
+    pk = f"Expense#{expense_id}"
+    with db.transact_get() as transaction:
+        expense_future = transaction.get(models.BaseModel, pk, pk)
+        user_future = transaction.get(models.ExpenseUserModel, pk, f"User#{user_id}")
 
-    for expense_id in expense_ids:
-        # Get expense model and corresponding user model
-        # If this fails, either:
-        #   1) The expense doesn't exist
-        #   2) This user is not a part of this expense
-        #   3) The transaction failed due to concurrency
-        # @todo: find a way to distinguish between these states and communicate this to the client
-        pk = f"Expense#{expense_id}"
-        with TransactGet(connection=connection) as transaction:
-            expense_future = transaction.get(models.ExpenseModel, pk, pk)
-            user_future = transaction.get(
-                models.ExpenseUserModel, pk, f"User#{user_id}"
-            )
+    try:
+        stored = expense_future.get()
+        expense: models.ExpenseModel = archive.resolve_expense(stored)
+    except DoesNotExist:
+        raise NotFound(f"No expense with id '{expense_id}' could be found.")
 
-        expense: models.ExpenseModel = expense_future.get()
-        expense_user: models.ExpenseUserModel = user_future.get()
+    # Owners cannot confirm/rescind their own expenses
+    if expense.owner == user_id:
+        raise BadRequest(f'Cannot {"confirm" if confirm else "rescind"} own request')
 
-        # Owners cannot confirm/rescind their own expenses
-        if expense.owner == user_id:
-            raise BadRequest(f'Cannot {"confirm" if confirm else "rescind"} own request')
+    # Users can only confirm/rescind expenses they are a part of
+    user_index = next(
+        (i for i, user in enumerate(expense.users) if user.user == user_id), None
+    )
+    try:
+        expense_user: models.ExpenseUserModel = user_future.get()
+    except DoesNotExist:
+        user_index = None
+    if user_index is None:
+        raise NotFound(f"No expense with id '{expense_id}' could be found.")
+
+    user_status = expense.users[user_index]
+    participant_ids = set(user.user for user in expense.users)
+    participant_ids.add(expense.owner)
+    if user_status.paid == confirm:
+        raise BadRequest(
+            f'Expense already {"confirmed" if confirm else "rescinded"}'
+        )
 
-        # Update expense users to indicate that this user has or hasn't paid
-        all_were_paid = all(user.paid for user in expense.users)
-        for user in expense.users:
-            if user.user == user_id and user.paid != confirm:
-                user.paid = confirm
-                break
+    # Update expense users to indicate that this user has or hasn't paid
+    all_were_paid = all(user.paid for user in expense.users)
+    user_status.paid = confirm
+    user_status.paid_time = datetime.now() if confirm else None
+    all_paid = all(user.paid for user in expense.users)
+
+    with db.transact_write() as write_transaction:
+        if isinstance(stored, models.ArchivedExpenseModel):
+            # Archived expenses are moved back into the table as they are updated, by writing the
+            # whole expense over its tombstone. This passes the version check, since they share a version.
+            write_transaction.save(expense)
         else:
-            raise BadRequest(
-                f'Expense already {"confirmed" if confirm else "rescinded"}'
-            )
-        all_paid = all(user.paid for user in expense.users)
-
-        # If this confirmation/rescission will ultimately change whether or not all the users had confirmed,
-        # this will necessitate writing to the owner's own row
-        owner_needs_update = all_paid != all_were_paid
-        owner_expense_user: Optional[models.ExpenseUserModel] = None
-        if owner_needs_update:
-            with TransactGet(connection=connection) as transaction:
-                owner_user_future = transaction.get(
-                    models.ExpenseUserModel, pk, f"User#{expense.owner}"
-                )
-            owner_expense_user = owner_user_future.get()
-
-        user_index = next(i for i in range(len(expense.users)) if expense.users[i].user == user_id)
-
-        with TransactWrite(connection=connection) as write_transaction:
-            # Update expense model
+            # Update expense model. The condition asserts the state this update was computed from:
+            # the user is still at the same index and hasn't been confirmed/rescinded by another request.
+            # The expense version is checked as well, so a concurrent edit cancels this transaction.
+            paid_path = models.ExpenseModel.users[user_index].paid
+            paid_time_path = models.ExpenseModel.users[user_index].paid_time
             write_transaction.update(
                 expense,
                 actions=[
-                    models.ExpenseModel.users[user_index].paid.set(confirm),
-                    models.ExpenseModel.users[user_index].paid_time.set(
-                        datetime.now() if confirm else None
-                    ),
+                    paid_path.set(confirm),
+                    paid_time_path.set(user_status.paid_time) if confirm else paid_time_path.remove(),
                 ],
+                condition=(models.ExpenseModel.users[user_index].user == user_id)
+                & (paid_path == (not confirm)),
             )
 
-            # Update user's tag
-            expense_user.update_from_expense(expense, user_id)
+        # Update user's tag
+        expense_user.update_from_expense(expense, user_id)
+        write_transaction.update(
+            expense_user,
+            actions=[models.ExpenseUserModel.tag.set(expense_user.tag)],
+        )
+        record_past_bucket(write_transaction, expense_user)
+
+        # If this confirmation/rescission changes whether or not all the users have confirmed,
+        # the owner's tag must be updated as well. The owner's row need not be read first,
+        # since its tag is derived entirely from the expense.
+        if all_paid != all_were_paid:
+            owner_expense_user = models.ExpenseUserModel.new(expense, expense.owner)
             write_transaction.update(
-                expense_user,
-                actions=[models.ExpenseUserModel.tag.set(expense_user.tag)],
+                owner_expense_user,
+                actions=[models.ExpenseUserModel.tag.set(owner_expense_user.tag)],
+                condition=models.ExpenseUserModel.id.exists(),
             )
+            record_past_bucket(write_transaction, owner_expense_user)
 
-            # Update owner's tag if necessary
-            if owner_needs_update:
-                owner_expense_user.update_from_expense(expense, expense.owner)
-                write_transaction.update(
-                    owner_expense_user,
-                    actions=[models.ExpenseUserModel.tag.set(owner_expense_user.tag)],
-                )
+        # Paid flags are part of the expense seen by every participant
+        record_expense_changes(
+            write_transaction, expense.id, {id: "updated" for id in participant_ids}
+        )
+
+        if record_response:
+            idempotency.complete_in(write_transaction, 200, "Success")
+
+
+def confirm_or_rescind_expenses(confirm: bool, expense_ids: Iterable[str]) -> Response:
+    user_info = get_user_details()
+    user_id = user_info["cognito:username"]
+
+    expense_ids = list(expense_ids)
+    try:
+        for i, expense_id in enumerate(expense_ids):
+            # Transactions are cancelled when other users confirm the same expense at the same time.
+            # Each attempt re-reads the expense, so retrying applies this change on top of theirs.
+            # The response to an idempotent request is recorded along with the last expense.
+            is_last = i + 1 == len(expense_ids)
+            retry_transaction(
+                lambda: confirm_or_rescind_expense(confirm, expense_id, user_id, is_last),
+                expense_id,
+            )
+    finally:
+        # Expenses confirmed before one fails stay confirmed
+        coalescing.invalidate()
 
     return jsonify("Success")
 
 
 @app.route(f"{BASE_ROUTE}/<expense_id>/confirm", methods=["POST"])
+@idempotency.idempotent
 def confirm_expense(expense_id):
     return confirm_or_rescind_expenses(True, [expense_id])
 
 
 @app.route(f"{BASE_ROUTE}/<expense_id>/rescind", methods=["POST"])
+@idempotency.idempotent
 def rescind_expense(expense_id):
     return confirm_or_rescind_expenses(False, [expense_id])
 
 
 @app.route(f"{BASE_ROUTE}/confirm", methods=["POST"])
+@idempotency.idempotent
 def confirm_all():
     expense_ids = request.get_json()
     return confirm_or_rescind_expenses(True, expense_ids)
@@ -580,7 +1431,7 @@ def confirm_all():
 def delete_expense(expense_id):
     pk = f"Expense#{expense_id}"
     try:
-        expense = models.ExpenseModel.get(pk, pk)
+        expense = load_expense(pk)
     except DoesNotExist:
         return jsonify("Success")
 
@@ -591,12 +1442,45 @@ def delete_expense(expense_id):
     verify_expense_modification(expense, user_id)
 
     # OK to delete, delete all items with the primary key from the database
-    with TransactWrite(connection=connection) as transaction:
-        for model in models.BaseModel.query(pk):
-            transaction.delete(model)
+    def write():
+        with db.transact_write() as transaction:
+            deleted_user_ids = []
+            for model in db.query(models.BaseModel, pk):
+                transaction.delete(model)
+                if isinstance(model, models.ExpenseUserModel):
+                    deleted_user_ids.append(model.sk.split("#")[1])
+            record_expense_changes(
+                transaction, pk, {id: "deleted" for id in deleted_user_ids}
+            )
+
+    retry_transaction(write, expense_id)
+    coalescing.invalidate()
 
     return jsonify("Success")
 
 
+def handle_archive(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Runs the archival job, starting from where the invocation which queued this one left off.
+    If the job can't be finished before the invocation times out, the rest of it is queued again.
+    """
+    archived, position = archive.archive_expenses(
+        out_of_time=lambda: context.get_remaining_time_in_millis() < ARCHIVE_TIME_MARGIN_MILLIS,
+        start=event.get("start"),
+    )
+    if position is not None:
+        get_lambda_client().invoke(
+            FunctionName=LAMBDA_FUNCTION_NAME,
+            InvocationType="Event",
+            Payload=json.dumps({"action": ARCHIVE_ACTION, "start": position}).encode(),
+        )
+    return {"archived": archived, "done": position is None}
+
+
 def handler(event, context):
-    return awsgi.response(app, event, context)
+    # Scheduled invocations (see the CloudWatchRule function parameter) run the archival job
+    if event.get("source") == "aws.events" or event.get("action") == ARCHIVE_ACTION:
+        return handle_archive(event, context)
+    if event.get("action") == REFRESH_USER_ACTION:
+        return handle_user_refresh(event, context)
+    return compression.lambda_response(app, event, context)
@@ -0,0 +1,67 @@
+"""
+Runs the API locally, without network access, e.g.
+
+    STORAGE_URL=sqlite://splitr.db USERS_URL=file://users.json python local.py --port 5000
+
+`users.json` maps user ids to their Cognito attributes, e.g.
+`{"alice": {"given_name": "Alice", "family_name": "Smith", "custom:hourlyWage": "20"}}`.
+
+When deployed, API Gateway's Cognito authorizer passes the claims of the caller's ID token to the
+API in the `awsgi.event`. Locally, requests name their user with the `X-Local-User` header instead,
+or else are made as LOCAL_USER, and that user's attributes in the directory become their claims.
+"""
+from typing import Any, Callable, Dict, Optional
+import argparse
+import os
+
+import directory
+
+LOCAL_USER_HEADER = "X-Local-User"
+LOCAL_USER = os.environ.get("LOCAL_USER")
+"""The user requests are made as if they don't have an X-Local-User header"""
+
+
+def local_event(user_id: str) -> Dict[str, Any]:
+    """
+    Returns the parts of an API Gateway event which the API reads, for a request made by `user_id`.
+    """
+    claims = {**directory.get_directory().get_user(user_id), "cognito:username": user_id}
+    return {"requestContext": {"authorizer": {"claims": claims}}}
+
+
+class LocalAuthorizer:
+    """
+    WSGI middleware which stands in for API Gateway's Cognito authorizer.
+    """
+    def __init__(self, app: Callable):
+        self.app = app
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable):
+        header = "HTTP_" + LOCAL_USER_HEADER.upper().replace("-", "_")
+        user_id: Optional[str] = environ.get(header) or LOCAL_USER
+        if user_id and "awsgi.event" not in environ:
+            try:
+                environ["awsgi.event"] = local_event(user_id)
+            except directory.UserNotFound:
+                start_response("401 UNAUTHORIZED", [("Content-Type", "text/plain")])
+                return [f"Unknown local user '{user_id}'".encode()]
+        return self.app(environ, start_response)
+
+
+def create_app():
+    """
+    Returns the API's app, with requests authorized by `LocalAuthorizer`.
+    """
+    from index import app
+
+    if not isinstance(app.wsgi_app, LocalAuthorizer):
+        app.wsgi_app = LocalAuthorizer(app.wsgi_app)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the API locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    create_app().run(host=args.host, port=args.port)
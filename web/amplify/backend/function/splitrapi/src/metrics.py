@@ -0,0 +1,45 @@
+"""
+Logging of metrics in CloudWatch embedded metric format.
+
+Metrics are logged as JSON documents, which CloudWatch extracts metrics from as the function's
+logs are ingested, so recording them needs no API calls. CloudWatch only reads documents which
+make up a whole log line, so metrics are logged without the level, time, or request id the
+Lambda runtime prefixes other log lines with.
+"""
+from typing import Any, Dict, Tuple
+import json
+import logging
+import sys
+import time
+
+NAMESPACE = "splitr"
+
+logger = logging.getLogger("splitr.metrics")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+
+
+def log_metrics(dimensions: Dict[str, str], metrics: Dict[str, Tuple[float, str]], **properties: Any):
+    """
+    Logs metrics in CloudWatch embedded metric format.
+    @dimensions: The dimensions the metrics are aggregated by, mapped to their values.
+    @metrics: Metric names mapped to their value and unit, e.g. `(512, "Bytes")`.
+    @properties: Further values to log alongside the metrics, which are not aggregated.
+    """
+    logger.info(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        **dimensions,
+        **{name: value for name, (value, _) in metrics.items()},
+        **properties,
+    }))
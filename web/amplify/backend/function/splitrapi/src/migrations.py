@@ -0,0 +1,130 @@
+"""
+One-off data migrations. Run from this directory with the same environment as the API, e.g.
+
+    STORAGE_SPLITR_NAME=<table> REGION=<region> python migrations.py past-buckets
+
+Until `past-buckets` has finished without failures, the API also reads past expenses from their
+legacy partitions, so it can be run at any time after deploying and re-run until it finishes.
+
+`default-group` also lists every user in the user directory (see USERS_URL in directory.py),
+so needs AUTH_SPLITR2AC25091_USERPOOLID to be set when users are kept in Cognito, and
+DEFAULT_ACCESS_KEY to be set to the access code users signed up with before groups existed.
+It must be run when groups are first deployed, since until then no existing user belongs to one.
+"""
+from typing import Optional
+import argparse
+import os
+
+from pynamodb.exceptions import DoesNotExist, PutError, TransactWriteError, UpdateError
+
+import directory
+import models
+import storage
+
+DEFAULT_GROUP_NAME = os.environ.get("DEFAULT_GROUP_NAME", "Household")
+"""Name of the group which users from before groups existed are moved into"""
+DEFAULT_ACCESS_KEY = os.environ.get("DEFAULT_ACCESS_KEY")
+"""The access code every user signed up with before groups existed, which joins the default group"""
+
+db = storage.get_storage()
+
+
+def backfill_past_buckets() -> int:
+    """
+    Moves past expense rows tagged with the legacy `Past#<USER_ID>` scheme into monthly buckets,
+    and records each bucket in the user's `PastBucketsModel`. Safe to run more than once.
+    @returns: The number of rows which were moved.
+    """
+    moved = 0
+    failed = 0
+    legacy_rows = db.scan(models.ExpenseUserModel, models.ExpenseUserModel.tag.startswith("Past#"))
+    for expense_user in legacy_rows:
+        if expense_user.past_bucket is not None:
+            continue
+
+        user_id = expense_user.user_id
+        bucket = models.ExpenseUserModel.past_bucket_for(expense_user.date)
+        try:
+            with db.transact_write() as transaction:
+                # If the row was re-tagged since it was scanned, it already uses the new scheme
+                transaction.update(
+                    expense_user,
+                    actions=[models.ExpenseUserModel.tag.set(models.ExpenseUserModel.past_tag(user_id, bucket))],
+                    condition=models.ExpenseUserModel.tag == expense_user.tag,
+                )
+                transaction.update(
+                    models.PastBucketsModel.new(user_id),
+                    actions=[models.PastBucketsModel.buckets.add({bucket})],
+                )
+        except TransactWriteError:
+            failed += 1
+            continue
+        moved += 1
+
+    # Until every row has been moved, the API reads the legacy partitions as well
+    if not failed:
+        db.save(models.MigrationModel.new("past-buckets"))
+    return moved
+
+
+def create_default_group(access_key: Optional[str] = None) -> int:
+    """
+    Moves the users and expenses from before groups existed into a single group, which can be
+    joined with the access code everyone signed up with: creates the group unless that code
+    already belongs to one, adds every user in the user pool to it, and puts every expense
+    without a group in it. Safe to run more than once.
+    @access_key: The access code which joins the group. Defaults to DEFAULT_ACCESS_KEY.
+    @returns: The number of memberships and expenses which were added.
+    """
+    access_key = access_key or DEFAULT_ACCESS_KEY
+    if not access_key:
+        raise ValueError("DEFAULT_ACCESS_KEY must be set to the access code users signed up with")
+
+    key = models.GroupAccessKeyModel.key(access_key)
+    try:
+        group_id = db.get(models.GroupAccessKeyModel, key, key, consistent_read=True).group
+    except DoesNotExist:
+        group = models.GroupModel.new(name=DEFAULT_GROUP_NAME)
+        with db.transact_write() as transaction:
+            transaction.save(group)
+            transaction.save(
+                models.GroupAccessKeyModel.new(access_key, group.id),
+                condition=models.GroupAccessKeyModel.id.does_not_exist(),
+            )
+        group_id = group.id
+
+    added = 0
+    for user_id in directory.get_directory().list_user_ids():
+        try:
+            db.save(
+                models.GroupUserModel.new(group_id, user_id),
+                condition=models.GroupUserModel.id.does_not_exist(),
+            )
+        except PutError:
+            continue
+        added += 1
+
+    for expense in db.scan(models.ExpenseModel, models.ExpenseModel.group.does_not_exist()):
+        try:
+            db.update(
+                expense,
+                actions=[models.ExpenseModel.group.set(group_id)],
+                condition=models.ExpenseModel.group.does_not_exist(),
+            )
+        except UpdateError:
+            continue
+        added += 1
+
+    return added
+
+
+MIGRATIONS = {
+    "past-buckets": backfill_past_buckets,
+    "default-group": create_default_group,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a data migration against the splitr table.")
+    parser.add_argument("migration", choices=MIGRATIONS.keys())
+    args = parser.parse_args()
+    print(f"{args.migration}: {MIGRATIONS[args.migration]()} items migrated")
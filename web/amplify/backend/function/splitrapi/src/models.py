@@ -1,5 +1,5 @@
-from typing import Any, Optional
-from datetime import date, datetime
+from typing import Any, Dict, Optional
+from datetime import date, datetime, timedelta
 from uuid import uuid4
 import os
 
@@ -13,10 +13,17 @@ from pynamodb.attributes import (
     ListAttribute,
     BooleanAttribute,
     VersionAttribute,
-    UTCDateTimeAttribute
+    UTCDateTimeAttribute,
+    TTLAttribute,
+    UnicodeSetAttribute
 )
 from pynamodb.constants import STRING
 
+CHANGE_RETENTION_DAYS = int(os.environ.get('CHANGE_RETENTION_DAYS', 30))
+"""Number of days entries in a user's change feed are kept for"""
+IDEMPOTENCY_RETENTION_HOURS = int(os.environ.get('IDEMPOTENCY_RETENTION_HOURS', 24))
+"""Number of hours the response to a request with an idempotency key is kept for"""
+
 def _id() -> str:
     """
     Randomly generates and returns a unique id.
@@ -58,7 +65,33 @@ class Item(MapAttribute):
     def new(cls, **attr: Any) -> 'Item':
         return cls(id=_id(), **attr)
 
-class UserStatus(MapAttribute):
+class DisplayInfo(MapAttribute):
+    """
+    A snapshot of how a user is shown to others, taken when the expense it belongs to is written,
+    so that expenses can be read without looking their users up.
+    Expenses written before snapshots were taken have none, and neither may archived expenses.
+    """
+    firstName = UnicodeAttribute(null=True)
+    lastName = UnicodeAttribute(null=True)
+    venmo = UnicodeAttribute(null=True)
+    snapshot = BooleanAttribute(null=True)
+
+    DISPLAY_FIELDS = ('firstName', 'lastName', 'venmo')
+
+    @property
+    def has_snapshot(self) -> bool:
+        # Any of the display fields may be missing from a snapshot, so it is recorded separately
+        return bool(self.snapshot)
+
+    def take_snapshot(self, info: Dict[str, Any]):
+        """
+        Records the display fields of client-facing user info.
+        """
+        for field in self.DISPLAY_FIELDS:
+            setattr(self, field, info.get(field))
+        self.snapshot = True
+
+class UserStatus(DisplayInfo):
     """
     Represents information about whether or not a user has paid for an expense.
     """
@@ -68,6 +101,12 @@ class UserStatus(MapAttribute):
     wage = NumberAttribute()
     weight = NumberAttribute(null=True)
 
+class OwnerInfo(DisplayInfo):
+    """
+    A snapshot of the owner of an expense, including their current wage.
+    """
+    wage = NumberAttribute(null=True)
+
 class ExpenseModel(BaseModel, discriminator='Expense'):
     """
     Models metadata about an expense.
@@ -76,6 +115,7 @@ class ExpenseModel(BaseModel, discriminator='Expense'):
     """
     name = UnicodeAttribute()
     owner = UnicodeAttribute()
+    ownerInfo = OwnerInfo(null=True)
     date = UnicodeAttribute()
     users = ListAttribute(of=UserStatus)
     split = UnicodeAttribute()
@@ -86,6 +126,7 @@ class ExpenseModel(BaseModel, discriminator='Expense'):
     tip = PercentageAmount(null=True)
     notes = UnicodeAttribute(null=True)
     images = ListAttribute(of=UnicodeAttribute)
+    group = UnicodeAttribute(null=True)
     version = VersionAttribute()
 
     @classmethod
@@ -93,6 +134,19 @@ class ExpenseModel(BaseModel, discriminator='Expense'):
         pk = f'Expense#{_id()}'
         return cls(pk, pk, **attr)
 
+class ArchivedExpenseModel(BaseModel, discriminator='ArchivedExpense'):
+    """
+    Stands in for an `ExpenseModel` which has been moved to the archive.
+
+    PK/SK:  Expense#<EXPENSE_ID>
+
+    `archive` is the key of the archive chunk holding the expense. `version` is the version
+    of the archived expense, so that writing the expense back over this row passes its
+    version check.
+    """
+    archive = UnicodeAttribute()
+    version = NumberAttribute()
+
 class TagDateIndex(GlobalSecondaryIndex):
     """
     Represents an inverted index whose partition key is the expense user tag (tag)
@@ -116,13 +170,14 @@ class ExpenseUserModel(BaseModel, discriminator='ExpenseUser'):
 
     PK:     Expense#<EXPENSE_ID>
     SK:     User#<USER_ID>
-    tag:    {Owner|Payer|Past}#<USER_ID>
+    tag:    {Owner|Payer}#<USER_ID> or Past#<USER_ID>#<YYYY-MM>
 
     Active expenses will have a tag prefixed with "Owner" or "Payer" if the user in question
     created or owes money towards the expense, respectively.
 
     Expenses that have been completed (i.e. all users have paid) will have the tag prefix "Past".
-    This allows easy paging through all passed expenses.
+    Past tags are additionally bucketed by the month of the expense, so that no single partition
+    grows without bound. The buckets in use by each user are tracked by `PastBucketsModel`.
     To determine if a user created a past expense, one can look at the corresponding ExpenseModel's 'owner' field. 
     """
     tag = UnicodeAttribute()
@@ -140,6 +195,38 @@ class ExpenseUserModel(BaseModel, discriminator='ExpenseUser'):
         instance.update_from_expense(expense, user_id)
         return instance
 
+    @staticmethod
+    def past_bucket_for(date: str) -> str:
+        """
+        Returns the bucket (YYYY-MM) that a past expense with the given ISO date belongs to.
+        """
+        return date[:7]
+
+    @classmethod
+    def past_tag(cls, user_id: str, bucket: str) -> str:
+        return f'Past#{user_id}#{bucket}'
+
+    @classmethod
+    def legacy_past_tag(cls, user_id: str) -> str:
+        """
+        The tag past expenses had before they were bucketed. See the `past-buckets` migration.
+        """
+        return f'Past#{user_id}'
+
+    @property
+    def user_id(self) -> str:
+        return self.sk.split('#')[1]
+
+    @property
+    def past_bucket(self) -> Optional[str]:
+        """
+        The bucket this row's tag belongs to if the expense is past, otherwise `None`.
+        """
+        parts = self.tag.split('#')
+        if parts[0] != 'Past' or len(parts) < 3:
+            return None
+        return parts[2]
+
     def update_from_expense(self, expense: ExpenseModel, user_id: str):
         self.id = expense.id
         self.sk = f'User#{user_id}'
@@ -152,5 +239,176 @@ class ExpenseUserModel(BaseModel, discriminator='ExpenseUser'):
             return next(user.paid for user in expense.users if user.user == user_id)
 
         is_owner = expense.owner == user_id
-        self.tag = f'{"Past" if is_expense_past() else ("Owner" if is_owner else "Payer")}#{user_id}'
+        if is_expense_past():
+            self.tag = self.past_tag(user_id, self.past_bucket_for(expense.date))
+        else:
+            self.tag = f'{"Owner" if is_owner else "Payer"}#{user_id}'
         self.date = expense.date
+
+class PastBucketsModel(BaseModel, discriminator='PastBuckets'):
+    """
+    Tracks the buckets a user's past expenses have been written to.
+
+    PK/SK:  PastBuckets#<USER_ID>
+
+    Buckets are only ever added, so a bucket may have since been emptied.
+    """
+    buckets = UnicodeSetAttribute(null=True)
+
+    @classmethod
+    def new(cls, user_id: str) -> 'PastBucketsModel':
+        key = f'PastBuckets#{user_id}'
+        return cls(key, key)
+
+class GroupModel(BaseModel, discriminator='Group'):
+    """
+    Models a household of users who split expenses with each other.
+
+    PK/SK:  Group#<GROUP_ID>
+    """
+    name = UnicodeAttribute()
+
+    @classmethod
+    def new(cls, **attr: Any) -> 'GroupModel':
+        pk = f'Group#{_id()}'
+        return cls(pk, pk, **attr)
+
+class GroupAccessKeyModel(BaseModel, discriminator='GroupAccessKey'):
+    """
+    Maps the access key users present when signing up to the group they join.
+
+    PK/SK:  AccessKey#<ACCESS_KEY>
+    """
+    group = UnicodeAttribute()
+
+    @staticmethod
+    def key(access_key: str) -> str:
+        return f'AccessKey#{access_key}'
+
+    @classmethod
+    def new(cls, access_key: str, group_id: str) -> 'GroupAccessKeyModel':
+        key = cls.key(access_key)
+        return cls(key, key, group=group_id)
+
+class GroupUserModel(BaseModel, discriminator='GroupUser'):
+    """
+    Models a user's membership in a group.
+
+    PK:     Group#<GROUP_ID>
+    SK:     User#<USER_ID>
+    tag:    Member#<USER_ID>
+
+    Querying a group's partition lists its members, while querying `tag-date-index`
+    for a member tag lists the groups that user is a member of.
+    """
+    tag = UnicodeAttribute()
+    date = UnicodeAttribute()
+    tag_date_index = TagDateIndex()
+
+    @staticmethod
+    def tag_for(user_id: str) -> str:
+        return f'Member#{user_id}'
+
+    @classmethod
+    def new(cls, group_id: str, user_id: str) -> 'GroupUserModel':
+        """
+        Creates a new `GroupUserModel`.
+        @group_id: The id of the group, including the 'Group#' prefix.
+        @user_id: The id of the user joining the group.
+        """
+        return cls(
+            group_id,
+            f'User#{user_id}',
+            tag=cls.tag_for(user_id),
+            date=date.today().isoformat()
+        )
+
+class ExpenseChangeModel(BaseModel, discriminator='ExpenseChange'):
+    """
+    Records that an expense a user is a part of was added, updated, or deleted.
+
+    PK:     Changes#<USER_ID>
+    SK:     Change#<TIME>#<EXPENSE_ID>
+
+    The time is when the entry was written, in zero-padded microseconds since the epoch, so that
+    entries sort in the order they were made. Entries are written without reading the rest of the
+    feed, so writes to different expenses which share a user don't contend with each other.
+    Entries expire after `CHANGE_RETENTION_DAYS`.
+    """
+    expense = UnicodeAttribute()
+    action = UnicodeAttribute()
+    expires = TTLAttribute(null=True)
+
+    TIME_DIGITS = 16
+
+    @staticmethod
+    def key(user_id: str) -> str:
+        return f'Changes#{user_id}'
+
+    @classmethod
+    def sort_key(cls, time: int, expense_id: str = '') -> str:
+        """
+        @time: Microseconds since the epoch.
+        @expense_id: The id of the changed expense, without the 'Expense#' prefix. Without it,
+            the sort key comes before those of every entry made at `time`.
+        """
+        return f'Change#{time:0{cls.TIME_DIGITS}d}#{expense_id}'
+
+    @staticmethod
+    def time_of(sort_key: str) -> int:
+        return int(sort_key.split('#')[1])
+
+    @classmethod
+    def new(cls, user_id: str, time: int, expense_id: str, action: str) -> 'ExpenseChangeModel':
+        """
+        Creates a new `ExpenseChangeModel`.
+        @user_id: The id of the user whose change feed this entry belongs to.
+        @time: When the change was made, in microseconds since the epoch.
+        @expense_id: The id of the changed expense, including the 'Expense#' prefix.
+        @action: One of 'added', 'updated', or 'deleted'.
+        """
+        return cls(
+            cls.key(user_id),
+            cls.sort_key(time, expense_id.split('#')[1]),
+            expense=expense_id,
+            action=action,
+            expires=timedelta(days=CHANGE_RETENTION_DAYS)
+        )
+
+class IdempotencyModel(BaseModel, discriminator='Idempotency'):
+    """
+    Records the handling of a request made with an idempotency key.
+
+    PK/SK:  Idempotency#<USER_ID>#<KEY>
+
+    While a request is being handled, `status` is 'pending' and `lease` holds the time (in epoch
+    seconds) until which the handling request owns the record. Once handled, `status` is
+    'complete' and the response is stored, so that retries of the request can be answered with it.
+    `fingerprint` identifies the request the key was first used with.
+    """
+    fingerprint = UnicodeAttribute()
+    status = UnicodeAttribute()
+    lease = NumberAttribute(null=True)
+    statusCode = NumberAttribute(null=True)
+    body = UnicodeAttribute(null=True)
+    expires = TTLAttribute()
+
+    @classmethod
+    def new(cls, user_id: str, key: str, **attr: Any) -> 'IdempotencyModel':
+        pk = f'Idempotency#{user_id}#{key}'
+        return cls(pk, pk, expires=timedelta(hours=IDEMPOTENCY_RETENTION_HOURS), **attr)
+
+class MigrationModel(BaseModel, discriminator='Migration'):
+    """
+    Records that a data migration (see migrations.py) has finished.
+
+    PK/SK:  Migration#<NAME>
+    """
+    @staticmethod
+    def key(name: str) -> str:
+        return f'Migration#{name}'
+
+    @classmethod
+    def new(cls, name: str) -> 'MigrationModel':
+        key = cls.key(name)
+        return cls(key, key)
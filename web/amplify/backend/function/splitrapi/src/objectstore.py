@@ -0,0 +1,87 @@
+"""
+Stores of binary objects, such as the expense archive and request profiles.
+
+`S3ObjectStore` is used when deployed, while `LocalObjectStore` keeps objects in a local
+directory, for running the API on a laptop. Stores are created from URLs with
+`object_store_from_url`, so that which one is used can be configured through the environment.
+"""
+from abc import ABC, abstractmethod
+from typing import Optional
+import os
+
+import boto3
+
+
+class ObjectStore(ABC):
+    """
+    A minimal interface to a store of binary objects, addressed by key.
+    """
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream", content_encoding: Optional[str] = None):
+        """
+        Stores an object. The content type and encoding describe the data to clients of the store.
+        """
+        raise NotImplementedError()
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Stores objects as files inside a local directory.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split("/"))
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream", content_encoding: Optional[str] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    Stores objects in an S3 bucket, under an optional prefix.
+    """
+    def __init__(self, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream", content_encoding: Optional[str] = None):
+        extra = {"ContentEncoding": content_encoding} if content_encoding else {}
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=data,
+            ContentType=content_type,
+            **extra,
+        )
+
+
+def object_store_from_url(url: str) -> ObjectStore:
+    """
+    Creates an object store from a URL of the form `s3://<bucket>/<prefix>` or `file://<directory>`.
+    """
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3ObjectStore(bucket, prefix)
+    if url.startswith("file://"):
+        return LocalObjectStore(url[len("file://"):])
+    raise ValueError(f"Unsupported object store URL: {url}")
@@ -0,0 +1,208 @@
+"""
+Opt-in profiling of individual requests, to find where the time goes in slow requests.
+
+A request is profiled if it is sampled (see `PROFILING_SAMPLE_RATE`), or if it is made by one of
+`PROFILING_USERS` with the `X-Profile` header. Each profile is written to the object store at
+`PROFILING_URL`, along with a JSON document describing the request it was taken of.
+
+Profiles are taken in one of two modes:
+* `deterministic` traces every call with cProfile, and is written in pstats format (`.prof`),
+  to be read with `pstats` or a viewer such as snakeviz.
+* `sampling` periodically records the request's stack, and is written as collapsed stacks
+  (`.folded`), to be rendered with flamegraph.pl or speedscope. It has much lower overhead.
+
+If `PROFILING_URL` is not set, no hooks are installed at all.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from uuid import uuid4
+import cProfile
+import json
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import Flask, Response, g, request
+
+import objectstore
+
+PROFILING_URL = os.environ.get("PROFILING_URL")
+"""Where profiles are written. Either `s3://<bucket>/<prefix>` or `file://<directory>`"""
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+"""Fraction of all requests which are profiled. Set to 1 to profile every request"""
+PROFILING_USERS = set(user for user in os.environ.get("PROFILING_USERS", "").split(",") if user)
+"""Users who may request that their requests be profiled with the `X-Profile` header"""
+PROFILING_MODE = os.environ.get("PROFILING_MODE", "sampling")
+"""How requests are profiled by default. Either `sampling` or `deterministic`"""
+PROFILING_INTERVAL = float(os.environ.get("PROFILING_INTERVAL", 0.005))
+"""Seconds between the stack samples taken in sampling mode"""
+
+PROFILING_HEADER = "X-Profile"
+PROFILE_KEY_HEADER = "X-Profile-Key"
+MODES = {"sampling", "deterministic"}
+
+_store: Optional[objectstore.ObjectStore] = None
+
+
+def get_store() -> objectstore.ObjectStore:
+    global _store
+    if _store is None:
+        _store = objectstore.object_store_from_url(PROFILING_URL)
+    return _store
+
+
+class SamplingProfiler:
+    """
+    Records the stack of a thread at a fixed interval from a background thread,
+    counting how often each distinct stack was seen.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self) -> bytes:
+        """
+        Returns the samples as collapsed stacks, one `frame;frame;... count` line per stack.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()).encode()
+
+
+class DeterministicProfiler:
+    """
+    Traces every call made by the current thread with cProfile.
+    """
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def enable(self):
+        self._profile.enable()
+
+    def disable(self):
+        self._profile.disable()
+
+    def dump(self) -> bytes:
+        """
+        Returns the profile in the format written by `pstats.Stats.dump_stats`.
+        """
+        self._profile.create_stats()
+        return marshal.dumps(self._profile.stats)
+
+
+def _user_id() -> Optional[str]:
+    event = request.environ.get("awsgi.event") or {}
+    claims = event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
+    return claims.get("cognito:username")
+
+
+def _profile_reason() -> Optional[str]:
+    """
+    Returns why the current request should be profiled, or `None` if it shouldn't be.
+    """
+    if PROFILING_HEADER in request.headers and _user_id() in PROFILING_USERS:
+        return "requested"
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def start_profile():
+    reason = _profile_reason()
+    if reason is None:
+        return
+
+    # Users requesting a profile may choose its mode with the header's value
+    mode = request.headers.get(PROFILING_HEADER, "").lower()
+    if reason != "requested" or mode not in MODES:
+        mode = PROFILING_MODE
+    profiler = SamplingProfiler(PROFILING_INTERVAL) if mode == "sampling" else DeterministicProfiler()
+
+    now = datetime.now(timezone.utc)
+    g.profile = {
+        "profiler": profiler,
+        "mode": mode,
+        "reason": reason,
+        "key": f"profiles/{now:%Y-%m-%d}/{now:%H%M%S}-{uuid4()}",
+        "started": now,
+        "wall": time.perf_counter(),
+        "cpu": time.process_time(),
+    }
+    profiler.enable()
+
+
+def record_status(response: Response) -> Response:
+    profile = g.get("profile")
+    if profile is not None:
+        profile["status"] = response.status_code
+        if profile["reason"] == "requested":
+            response.headers[PROFILE_KEY_HEADER] = profile["key"]
+    return response
+
+
+def finish_profile(error: Optional[BaseException] = None):
+    profile: Optional[Dict[str, Any]] = g.pop("profile", None)
+    if profile is None:
+        return
+    profile["profiler"].disable()
+    wall_seconds = time.perf_counter() - profile["wall"]
+    cpu_seconds = time.process_time() - profile["cpu"]
+
+    extension = "folded" if profile["mode"] == "sampling" else "prof"
+    metadata = {
+        "route": f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+        "path": request.path,
+        "query": request.args.to_dict(flat=False),
+        "user": _user_id(),
+        "status": profile.get("status", 500),
+        "error": repr(error) if error is not None else None,
+        "mode": profile["mode"],
+        "reason": profile["reason"],
+        "profile": f"{profile['key']}.{extension}",
+        "time": profile["started"].isoformat(),
+        "wallMs": wall_seconds * 1000,
+        "cpuMs": cpu_seconds * 1000,
+    }
+    try:
+        store = get_store()
+        store.put(metadata["profile"], profile["profiler"].dump())
+        store.put(f"{profile['key']}.json", json.dumps(metadata).encode(), content_type="application/json")
+    except Exception as e:
+        # Profiling must never fail the request being profiled
+        print(f"Failed to write profile {profile['key']}: {e!r}")
+        return
+    print(json.dumps({"profile": metadata}))
+
+
+def init_app(app: Flask):
+    if not PROFILING_URL:
+        return
+    if PROFILING_MODE not in MODES:
+        raise ValueError(f"PROFILING_MODE must be one of {', '.join(sorted(MODES))}")
+    # The profile covers the route and the after-request hooks (such as compression) registered before this
+    app.before_request(start_profile)
+    app.after_request(record_status)
+    app.teardown_request(finish_profile)
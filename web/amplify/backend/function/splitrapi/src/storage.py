@@ -0,0 +1,1104 @@
+"""
+Access to the table the API keeps its data in.
+
+Route handlers read and write models through a `Storage` rather than calling PynamoDB directly,
+so that the API can run against something other than DynamoDB. `DynamoStorage` is used when
+deployed, while `MemoryStorage` and `SqliteStorage` keep the table locally, for running the API
+on a laptop or in-process for benchmarks and load tests.
+
+The local backends evaluate PynamoDB conditions and update actions the way DynamoDB does, check
+and increment version attributes, apply transactions all-or-nothing, and raise the same PynamoDB
+exceptions on failure, so that conflict handling and retries behave the same in every backend.
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar, Union
+)
+import bisect
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from botocore.exceptions import ClientError
+from pynamodb.attributes import DiscriminatorAttribute, VersionAttribute
+from pynamodb.connection import Connection
+from pynamodb.exceptions import (
+    DeleteError,
+    PutError,
+    TransactGetError,
+    TransactWriteError,
+    UpdateError,
+)
+from pynamodb.expressions.condition import (
+    And,
+    Between,
+    BeginsWith,
+    Comparison,
+    Condition,
+    Contains,
+    Exists,
+    In,
+    IsType,
+    Not,
+    NotExists,
+    Or,
+)
+from pynamodb.expressions.operand import (
+    Path,
+    Value,
+    _Decrement,
+    _IfNotExists,
+    _Increment,
+    _ListAppend,
+    _Size,
+)
+from pynamodb.expressions.update import Action, AddAction, DeleteAction, RemoveAction, SetAction
+from pynamodb.indexes import Index
+from pynamodb.models import Model
+from pynamodb.transactions import TransactGet, TransactWrite
+
+import models
+
+STORAGE_URL = os.environ.get("STORAGE_URL", "dynamodb://")
+"""Where the table is kept. One of `dynamodb://`, `memory://`, or `sqlite://<path>`"""
+
+_M = TypeVar("_M", bound=Model)
+
+Item = Dict[str, Dict[str, Any]]
+"""An item as DynamoDB represents it, mapping attribute names to typed attribute values"""
+Key = Tuple[str, str]
+
+HASH_KEY = models.BaseModel.id.attr_name
+RANGE_KEY = models.BaseModel.sk.attr_name
+INDEXES: List[Type[Index]] = [models.TagDateIndex]
+"""The secondary indexes of the table, which the local backends maintain"""
+
+
+class Storage(ABC):
+    """
+    Reads and writes models to the table. Arguments mirror those of the PynamoDB operations
+    of the same name.
+    """
+    @abstractmethod
+    def get(self, model_cls: Type[_M], hash_key: str, range_key: str, consistent_read: bool = False) -> _M:
+        """
+        Reads a single item. Raises `model_cls.DoesNotExist` if there is no such item.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def batch_get(
+        self, model_cls: Type[_M], keys: Iterable[Key], consistent_read: bool = False
+    ) -> Iterator[_M]:
+        """
+        Reads many items at once, in no particular order. Items which don't exist are omitted.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query(
+        self,
+        model_cls: Type[_M],
+        hash_key: str,
+        range_key_condition: Optional[Condition] = None,
+        filter_condition: Optional[Condition] = None,
+        index: Optional[Index] = None,
+        scan_index_forward: Optional[bool] = None,
+        limit: Optional[int] = None,
+        last_evaluated_key: Optional[Item] = None,
+        consistent_read: bool = False,
+    ) -> Iterable[_M]:
+        """
+        Reads the items of a partition in order of their range key.
+        @index: The secondary index to query, if not the table itself.
+        @returns: An iterable of the items read. Once iterated, its `last_evaluated_key` is the key
+            to pass in to continue reading after `limit` items, or `None` if there are no more.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def scan(
+        self,
+        model_cls: Type[_M],
+        filter_condition: Optional[Condition] = None,
+        limit: Optional[int] = None,
+        last_evaluated_key: Optional[Item] = None,
+    ) -> Iterable[_M]:
+        """
+        Reads the items of the whole table, in no particular order.
+        @returns: An iterable of the items read, with a `last_evaluated_key` as returned by `query`.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def save(self, model: Model, condition: Optional[Condition] = None):
+        """
+        Writes a whole item. Raises `PutError` if `condition` fails.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def update(self, model: Model, actions: List[Action], condition: Optional[Condition] = None):
+        """
+        Applies update actions to an item, creating it if needed, and refreshes `model` with the
+        updated item. Raises `UpdateError` if `condition` fails.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete(self, model: Model, condition: Optional[Condition] = None):
+        """
+        Deletes an item. Raises `DeleteError` if `condition` fails.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def transact_write(self) -> "WriteTransaction":
+        """
+        Starts a transaction of writes, which are made all at once when its context exits.
+        Raises `TransactWriteError` if any of their conditions fail.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def transact_get(self) -> "GetTransaction":
+        """
+        Starts a transaction of reads, which are made all at once when its context exits.
+        """
+        raise NotImplementedError()
+
+
+class DynamoStorage(Storage):
+    """
+    Keeps the table in DynamoDB, as configured by `models.BaseModel.Meta`.
+    """
+    def __init__(self, region: Optional[str] = None):
+        self.connection = Connection(region=region)
+
+    def get(self, model_cls, hash_key, range_key, consistent_read=False):
+        return model_cls.get(hash_key, range_key, consistent_read=consistent_read)
+
+    def batch_get(self, model_cls, keys, consistent_read=False):
+        return model_cls.batch_get(keys, consistent_read=consistent_read)
+
+    def query(
+        self,
+        model_cls,
+        hash_key,
+        range_key_condition=None,
+        filter_condition=None,
+        index=None,
+        scan_index_forward=None,
+        limit=None,
+        last_evaluated_key=None,
+        consistent_read=False,
+    ):
+        return model_cls.query(
+            hash_key,
+            range_key_condition,
+            filter_condition,
+            consistent_read=consistent_read,
+            index_name=index.Meta.index_name if index is not None else None,
+            scan_index_forward=scan_index_forward,
+            limit=limit,
+            last_evaluated_key=last_evaluated_key,
+        )
+
+    def scan(self, model_cls, filter_condition=None, limit=None, last_evaluated_key=None):
+        return model_cls.scan(filter_condition, limit=limit, last_evaluated_key=last_evaluated_key)
+
+    def save(self, model, condition=None):
+        model.save(condition=condition)
+
+    def update(self, model, actions, condition=None):
+        model.update(actions=actions, condition=condition)
+
+    def delete(self, model, condition=None):
+        model.delete(condition=condition)
+
+    def transact_write(self):
+        return TransactWrite(connection=self.connection)
+
+    def transact_get(self):
+        return TransactGet(connection=self.connection)
+
+
+class _OperationFailed(Exception):
+    """
+    Raised by the local backends where DynamoDB would reject an operation.
+    """
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def client_error(self, operation: str, **response: Any) -> ClientError:
+        return ClientError({"Error": {"Code": self.code, "Message": self.message}, **response}, operation)
+
+
+class _ConditionFailed(_OperationFailed):
+    def __init__(self):
+        super().__init__("ConditionalCheckFailedException", "The conditional request failed")
+
+
+# Expressions
+
+_SEGMENT = re.compile(r"^(.*?)((?:\[\d+\])*)$")
+
+
+def _parse_segment(segment: str) -> Tuple[str, List[int]]:
+    name, indexes = _SEGMENT.match(segment).groups()
+    return name, [int(index) for index in re.findall(r"\d+", indexes)]
+
+
+def _resolve(item: Item, path: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """
+    Returns the typed value at a document path of an item, or `None` if there is none.
+    """
+    value: Optional[Dict[str, Any]] = {"M": item}
+    for segment in path:
+        name, indexes = _parse_segment(segment)
+        if "M" not in value or name not in value["M"]:
+            return None
+        value = value["M"][name]
+        for index in indexes:
+            if "L" not in value or index >= len(value["L"]):
+                return None
+            value = value["L"][index]
+    return value
+
+
+def _parent(item: Item, path: Sequence[str]) -> Tuple[Union[Dict, List], Union[str, int]]:
+    """
+    Returns the container holding the value at a document path, and the key of the value in it.
+    """
+    steps: List[Union[str, int]] = []
+    for segment in path:
+        name, indexes = _parse_segment(segment)
+        steps.append(name)
+        steps.extend(indexes)
+
+    container: Union[Dict, List] = item
+    for step in steps[:-1]:
+        if isinstance(container, dict):
+            value = container.get(step)
+        else:
+            value = container[step] if step < len(container) else None
+        if value is None or ("M" not in value and "L" not in value):
+            raise _OperationFailed(
+                "ValidationException",
+                "The document path provided in the update expression is invalid for update",
+            )
+        container = value["M"] if "M" in value else value["L"]
+    return container, steps[-1]
+
+
+def _assign(item: Item, path: Sequence[str], value: Dict[str, Any]):
+    container, key = _parent(item, path)
+    if isinstance(container, list) and key >= len(container):
+        container.append(value)
+    else:
+        container[key] = value
+
+
+def _unassign(item: Item, path: Sequence[str]):
+    try:
+        container, key = _parent(item, path)
+    except _OperationFailed:
+        return
+    if isinstance(container, list):
+        if key < len(container):
+            del container[key]
+    else:
+        container.pop(key, None)
+
+
+def _normalize(value: Dict[str, Any]) -> Any:
+    """
+    Converts a typed value into a comparable, hashable Python value.
+    """
+    (attr_type, raw), = value.items()
+    if attr_type == "N":
+        return Decimal(raw)
+    if attr_type == "NS":
+        return frozenset(Decimal(n) for n in raw)
+    if attr_type in ("SS", "BS"):
+        return frozenset(raw)
+    if attr_type == "L":
+        return tuple((next(iter(v)), _normalize(v)) for v in raw)
+    if attr_type == "M":
+        return frozenset((k, next(iter(v)), _normalize(v)) for k, v in raw.items())
+    return raw
+
+
+def _size(value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    (attr_type, raw), = value.items()
+    if attr_type in ("BOOL", "NULL", "N"):
+        return None
+    return {"N": str(len(raw))}
+
+
+def _operand(item: Item, operand: Any) -> Optional[Dict[str, Any]]:
+    """
+    Evaluates an operand of a condition or update action against an item.
+    """
+    if isinstance(operand, Path):
+        return _resolve(item, operand.path)
+    if isinstance(operand, Value):
+        return copy.deepcopy(operand.value)
+    if isinstance(operand, _Size):
+        return _size(_operand(item, operand.values[0]))
+    if isinstance(operand, (_Increment, _Decrement)):
+        lhs, rhs = (_operand(item, value) for value in operand.values)
+        if lhs is None or rhs is None or "N" not in lhs or "N" not in rhs:
+            raise _OperationFailed(
+                "ValidationException",
+                "An operand in the update expression has an incorrect data type",
+            )
+        sign = 1 if isinstance(operand, _Increment) else -1
+        return {"N": str(Decimal(lhs["N"]) + sign * Decimal(rhs["N"]))}
+    if isinstance(operand, _ListAppend):
+        lhs, rhs = (_operand(item, value) for value in operand.values)
+        if lhs is None or rhs is None or "L" not in lhs or "L" not in rhs:
+            raise _OperationFailed(
+                "ValidationException",
+                "An operand in the update expression has an incorrect data type",
+            )
+        return {"L": copy.deepcopy(lhs["L"]) + copy.deepcopy(rhs["L"])}
+    if isinstance(operand, _IfNotExists):
+        existing = _operand(item, operand.values[0])
+        return copy.deepcopy(existing) if existing is not None else _operand(item, operand.values[1])
+    raise ValueError(f"Unsupported operand: {operand!r}")
+
+
+_ORDERED_TYPES = {"N", "S", "B"}
+
+
+def _compare(operator: str, lhs: Optional[Dict[str, Any]], rhs: Optional[Dict[str, Any]]) -> bool:
+    if lhs is None or rhs is None or next(iter(lhs)) != next(iter(rhs)):
+        # Missing values and values of different types are never equal, nor ordered
+        return operator == "<>"
+    a, b = _normalize(lhs), _normalize(rhs)
+    if operator == "=":
+        return a == b
+    if operator == "<>":
+        return a != b
+    if next(iter(lhs)) not in _ORDERED_TYPES:
+        return False
+    return {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[operator]
+
+
+def _all_of(*conditions: Optional[Condition]) -> Optional[Condition]:
+    """
+    Combines conditions with AND, ignoring those which are `None`.
+    """
+    result = None
+    for condition in conditions:
+        if condition is not None:
+            result = condition if result is None else result & condition
+    return result
+
+
+def _matches(item: Item, condition: Optional[Condition]) -> bool:
+    """
+    Evaluates a condition against an item. Missing items are represented by an empty item.
+    """
+    if condition is None:
+        return True
+    values = condition.values
+    if isinstance(condition, And):
+        return _matches(item, values[0]) and _matches(item, values[1])
+    if isinstance(condition, Or):
+        return _matches(item, values[0]) or _matches(item, values[1])
+    if isinstance(condition, Not):
+        return not _matches(item, values[0])
+    if isinstance(condition, Exists):
+        return _operand(item, values[0]) is not None
+    if isinstance(condition, NotExists):
+        return _operand(item, values[0]) is None
+    if isinstance(condition, Comparison):
+        return _compare(condition.operator, _operand(item, values[0]), _operand(item, values[1]))
+    if isinstance(condition, Between):
+        value, lower, upper = (_operand(item, value) for value in values)
+        return _compare(">=", value, lower) and _compare("<=", value, upper)
+    if isinstance(condition, In):
+        value = _operand(item, values[0])
+        return any(_compare("=", value, _operand(item, option)) for option in values[1:])
+    if isinstance(condition, IsType):
+        value = _operand(item, values[0])
+        return value is not None and next(iter(value)) == _operand(item, values[1])["S"]
+    if isinstance(condition, BeginsWith):
+        value, prefix = (_operand(item, value) for value in values)
+        if value is None or prefix is None or next(iter(value)) not in ("S", "B"):
+            return False
+        return next(iter(value.values())).startswith(next(iter(prefix.values())))
+    if isinstance(condition, Contains):
+        value, member = (_operand(item, value) for value in values)
+        if value is None or member is None:
+            return False
+        (attr_type, raw), = value.items()
+        if attr_type == "S" and "S" in member:
+            return member["S"] in raw
+        if attr_type in ("SS", "NS", "BS"):
+            return any(_compare("=", {attr_type[0]: element}, member) for element in raw)
+        if attr_type == "L":
+            return any(_compare("=", element, member) for element in raw)
+        return False
+    raise ValueError(f"Unsupported condition: {condition!r}")
+
+
+def _apply(item: Item, actions: Iterable[Action]):
+    """
+    Applies update actions to an item in place. All operands are evaluated against the item
+    as it was before the update, as they are in DynamoDB.
+    """
+    original = copy.deepcopy(item)
+    for action in actions:
+        path = action.values[0].path
+        if isinstance(action, SetAction):
+            _assign(item, path, _operand(original, action.values[1]))
+        elif isinstance(action, RemoveAction):
+            _unassign(item, path)
+        elif isinstance(action, AddAction):
+            existing = _resolve(original, path)
+            value = _operand(original, action.values[1])
+            if existing is None:
+                _assign(item, path, value)
+            elif "N" in existing and "N" in value:
+                _assign(item, path, {"N": str(Decimal(existing["N"]) + Decimal(value["N"]))})
+            elif next(iter(existing)) == next(iter(value)):
+                (attr_type, elements), = existing.items()
+                added = [element for element in value[attr_type] if element not in elements]
+                _assign(item, path, {attr_type: elements + added})
+            else:
+                raise _OperationFailed(
+                    "ValidationException",
+                    "An operand in the update expression has an incorrect data type",
+                )
+        elif isinstance(action, DeleteAction):
+            existing = _resolve(original, path)
+            if existing is None:
+                continue
+            (attr_type, elements), = existing.items()
+            removed = _operand(original, action.values[1]).get(attr_type, [])
+            remaining = [element for element in elements if element not in removed]
+            if remaining:
+                _assign(item, path, {attr_type: remaining})
+            else:
+                _unassign(item, path)
+        else:
+            raise ValueError(f"Unsupported action: {action!r}")
+
+
+# Models
+
+def _version_attribute(model: Model) -> Optional[Tuple[str, VersionAttribute]]:
+    for name, attribute in model.get_attributes().items():
+        if isinstance(attribute, VersionAttribute):
+            return name, attribute
+    return None
+
+
+def _version_condition(
+    model: Model, item: Optional[Item] = None, actions: Optional[List[Action]] = None
+) -> Optional[Condition]:
+    """
+    Returns the condition that the stored version of `model` is its current version, and bumps
+    the version in `item` or `actions`, as PynamoDB does when writing models with a version.
+    """
+    version = _version_attribute(model)
+    if version is None:
+        return None
+    name, attribute = version
+    value = getattr(model, name)
+    next_value = 1 if value is None else value + 1
+    if item is not None:
+        item[attribute.attr_name] = {"N": str(next_value)}
+    if actions is not None:
+        actions.append(attribute.set(1) if value is None else attribute.add(1))
+    return attribute.does_not_exist() if value is None else attribute == value
+
+
+def _class_condition(model_cls: Type[Model]) -> Optional[Condition]:
+    """
+    Returns the condition that an item is an instance of `model_cls`, as PynamoDB adds to queries.
+    """
+    for attribute in model_cls.get_attributes().values():
+        if isinstance(attribute, DiscriminatorAttribute):
+            subclasses = attribute.get_registered_subclasses(model_cls)
+            return attribute.is_in(*subclasses)
+    return None
+
+
+def _model_key(model: Model) -> Key:
+    return getattr(model, models.BaseModel.id.attr_name), getattr(model, models.BaseModel.sk.attr_name)
+
+
+def _item_key(item: Item) -> Key:
+    return item[HASH_KEY]["S"], item[RANGE_KEY]["S"]
+
+
+def _key_item(key: Key) -> Item:
+    return {HASH_KEY: {"S": key[0]}, RANGE_KEY: {"S": key[1]}}
+
+
+def _index_keys(index: Type[Index]) -> Tuple[str, str]:
+    """
+    Returns the names of the hash and range key attributes of an index.
+    """
+    hash_key = next(a.attr_name for a in index.Meta.attributes.values() if a.is_hash_key)
+    range_key = next(a.attr_name for a in index.Meta.attributes.values() if a.is_range_key)
+    return hash_key, range_key
+
+
+class QueryResult(list):
+    """
+    The items read by a query on a local backend, along with where to continue reading from.
+    """
+    def __init__(self, items: Iterable[Model], last_evaluated_key: Optional[Item] = None):
+        super().__init__(items)
+        self.last_evaluated_key = last_evaluated_key
+
+
+class _Operation:
+    """
+    A single write, prepared to be checked and applied by a local backend.
+    """
+    def __init__(
+        self,
+        key: Key,
+        condition: Optional[Condition],
+        apply: Callable[[Optional[Item]], Optional[Item]],
+        on_success: Optional[Callable[[Optional[Item]], None]] = None,
+    ):
+        self.key = key
+        self.condition = condition
+        self.apply = apply
+        """Given the stored item, returns the item to store, or `None` to delete it"""
+        self.on_success = on_success
+
+
+def _put_operation(model: Model, condition: Optional[Condition]) -> _Operation:
+    item = model.serialize()
+    condition = _all_of(condition, _version_condition(model, item=item))
+    return _Operation(
+        _model_key(model), condition, lambda _: item,
+        lambda _: model.update_local_version_attribute(),
+    )
+
+
+def _update_operation(
+    model: Model, actions: List[Action], condition: Optional[Condition], refresh: bool
+) -> _Operation:
+    key = _model_key(model)
+    actions = list(actions)
+    condition = _all_of(condition, _version_condition(model, actions=actions))
+
+    def apply(stored: Optional[Item]) -> Item:
+        item = stored if stored is not None else _key_item(key)
+        _apply(item, actions)
+        return item
+
+    def on_success(item: Optional[Item]):
+        # Updates on their own return the updated item, while those in a transaction don't
+        if refresh:
+            model.deserialize(copy.deepcopy(item))
+        else:
+            model.update_local_version_attribute()
+
+    return _Operation(key, condition, apply, on_success)
+
+
+def _delete_operation(model: Model, condition: Optional[Condition]) -> _Operation:
+    condition = _all_of(condition, _version_condition(model))
+    return _Operation(_model_key(model), condition, lambda _: None)
+
+
+class LocalStorage(Storage):
+    """
+    Base class for backends which keep the table locally. Items are stored as JSON, and
+    subclasses only need to implement storing, removing, and iterating over them.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    # Storage primitives
+
+    @contextmanager
+    def _atomic(self):
+        """
+        Holds exclusive access to the table for a group of reads and writes.
+        """
+        with self._lock:
+            yield
+
+    @abstractmethod
+    def _read(self, key: Key) -> Optional[Item]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _write(self, key: Key, item: Item):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _remove(self, key: Key):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _partition(
+        self, hash_key: str, forward: bool, start: Optional[str]
+    ) -> Iterator[Item]:
+        """
+        Iterates over the items of a partition in order of range key, starting after `start`.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _index(
+        self, index: Type[Index], hash_key: str, forward: bool, start: Optional[Tuple[str, str, str]]
+    ) -> Iterator[Item]:
+        """
+        Iterates over the items with the given index hash key, ordered by index range key and then
+        primary key, starting after `start`, a tuple of index range key and primary key.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _items(self) -> Iterator[Item]:
+        """
+        Iterates over every item in the table, in order of primary key.
+        """
+        raise NotImplementedError()
+
+    # Operations
+
+    def get(self, model_cls, hash_key, range_key, consistent_read=False):
+        item = self._read((hash_key, range_key))
+        if item is None:
+            raise model_cls.DoesNotExist()
+        return model_cls.from_raw_data(item)
+
+    def batch_get(self, model_cls, keys, consistent_read=False):
+        for key in set(tuple(key) for key in keys):
+            item = self._read(key)
+            if item is not None:
+                yield model_cls.from_raw_data(item)
+
+    def query(
+        self,
+        model_cls,
+        hash_key,
+        range_key_condition=None,
+        filter_condition=None,
+        index=None,
+        scan_index_forward=None,
+        limit=None,
+        last_evaluated_key=None,
+        consistent_read=False,
+    ):
+        forward = scan_index_forward is not False
+        condition = _all_of(range_key_condition, filter_condition, _class_condition(model_cls))
+        if index is None:
+            start = last_evaluated_key[RANGE_KEY]["S"] if last_evaluated_key else None
+            items = self._partition(hash_key, forward, start)
+        else:
+            index_range_key = _index_keys(index)[1]
+            start = None
+            if last_evaluated_key:
+                start = (last_evaluated_key[index_range_key]["S"], *_item_key(last_evaluated_key))
+            items = self._index(index, hash_key, forward, start)
+
+        results: List[Model] = []
+        last_key: Optional[Item] = None
+        for item in items:
+            if not _matches(item, condition):
+                continue
+            if limit is not None and len(results) >= limit:
+                # There are more items to read after the last one returned
+                last_key = _key_item(_model_key(results[-1]))
+                if index is not None:
+                    for name in _index_keys(index):
+                        last_key[name] = {"S": getattr(results[-1], name)}
+                break
+            results.append(model_cls.from_raw_data(item))
+        return QueryResult(results, last_key)
+
+    def scan(self, model_cls, filter_condition=None, limit=None, last_evaluated_key=None):
+        condition = _all_of(filter_condition, _class_condition(model_cls))
+        start = _item_key(last_evaluated_key) if last_evaluated_key else None
+        with self._atomic():
+            items = [
+                item for item in self._items()
+                if (start is None or _item_key(item) > start) and _matches(item, condition)
+            ]
+        last_key = None
+        if limit is not None and len(items) > limit:
+            items = items[:limit]
+            last_key = _key_item(_item_key(items[-1]))
+        return QueryResult([model_cls.from_raw_data(item) for item in items], last_key)
+
+    def _commit(self, operations: List[_Operation]) -> List[Optional[str]]:
+        """
+        Checks the conditions of all operations, then applies them only if all conditions pass.
+        @returns: For each operation, `None` if its condition passed, else the reason it failed.
+        """
+        if len(set(operation.key for operation in operations)) != len(operations):
+            raise _OperationFailed(
+                "ValidationException",
+                "Transaction request cannot include multiple operations on one item",
+            )
+        with self._atomic():
+            stored = [self._read(operation.key) for operation in operations]
+            reasons = [
+                None if _matches(item or {}, operation.condition) else "ConditionalCheckFailed"
+                for item, operation in zip(stored, operations)
+            ]
+            if any(reasons):
+                return reasons
+
+            written = [operation.apply(item) for item, operation in zip(stored, operations)]
+            for item, operation in zip(written, operations):
+                if item is None:
+                    self._remove(operation.key)
+                else:
+                    self._write(operation.key, item)
+
+        for item, operation in zip(written, operations):
+            if operation.on_success is not None:
+                operation.on_success(item)
+        return reasons
+
+    def _commit_one(self, operation: _Operation, error: Type[Exception], name: str):
+        try:
+            if self._commit([operation])[0] is not None:
+                raise _ConditionFailed()
+        except _OperationFailed as e:
+            raise error(f"Failed to {name} item", e.client_error(name))
+
+    def save(self, model, condition=None):
+        self._commit_one(_put_operation(model, condition), PutError, "PutItem")
+
+    def update(self, model, actions, condition=None):
+        if not isinstance(actions, list) or len(actions) == 0:
+            raise TypeError("the value of `actions` is expected to be a non-empty list")
+        self._commit_one(_update_operation(model, actions, condition, refresh=True), UpdateError, "UpdateItem")
+
+    def delete(self, model, condition=None):
+        self._commit_one(_delete_operation(model, condition), DeleteError, "DeleteItem")
+
+    def transact_write(self):
+        return LocalTransactWrite(self)
+
+    def transact_get(self):
+        return LocalTransactGet(self)
+
+
+class LocalTransactWrite:
+    """
+    A transaction of writes to a local backend, with the same interface as `TransactWrite`.
+    Like `TransactWrite`, it makes condition checks, then deletes, then puts, then updates,
+    and reports the reasons a transaction was cancelled in that order.
+    """
+    def __init__(self, storage: LocalStorage):
+        self._storage = storage
+        self._condition_checks: List[_Operation] = []
+        self._deletes: List[_Operation] = []
+        self._puts: List[_Operation] = []
+        self._updates: List[_Operation] = []
+
+    def __enter__(self) -> "LocalTransactWrite":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self._commit()
+
+    @property
+    def _operations(self) -> List[_Operation]:
+        return self._condition_checks + self._deletes + self._puts + self._updates
+
+    def condition_check(self, model_cls: Type[Model], hash_key: str, range_key: str, condition: Condition):
+        if condition is None:
+            raise TypeError("`condition` cannot be None")
+        self._condition_checks.append(_Operation((hash_key, range_key), condition, lambda stored: stored))
+
+    def save(self, model: Model, condition: Optional[Condition] = None):
+        self._puts.append(_put_operation(model, condition))
+
+    def update(self, model: Model, actions: List[Action], condition: Optional[Condition] = None):
+        self._updates.append(_update_operation(model, actions, condition, refresh=False))
+
+    def delete(self, model: Model, condition: Optional[Condition] = None):
+        self._deletes.append(_delete_operation(model, condition))
+
+    def _commit(self):
+        operations = self._operations
+        if not operations:
+            return
+        try:
+            reasons = self._storage._commit(operations)
+        except _OperationFailed as e:
+            raise TransactWriteError("Failed to write transaction items", e.client_error("TransactWriteItems"))
+        if any(reasons):
+            codes = [reason or "None" for reason in reasons]
+            error = _OperationFailed(
+                "TransactionCanceledException",
+                f"Transaction cancelled, please refer cancellation reasons for specific reasons [{', '.join(codes)}]",
+            )
+            raise TransactWriteError(
+                "Failed to write transaction items",
+                error.client_error("TransactWriteItems", CancellationReasons=[{"Code": code} for code in codes]),
+            )
+
+
+def transaction_keys(transaction: "WriteTransaction") -> List[Key]:
+    """
+    Returns the keys of the items written by a transaction, in the order DynamoDB reports the
+    reasons it was cancelled: condition checks, then deletes, then puts, then updates.
+    """
+    if isinstance(transaction, LocalTransactWrite):
+        return [operation.key for operation in transaction._operations]
+    items = (
+        transaction._condition_check_items + transaction._delete_items
+        + transaction._put_items + transaction._update_items
+    )
+    return [_item_key(item.get("Key") or item["Item"]) for item in items]
+
+
+class _LocalFuture:
+    """
+    Stands in for a model read by a `LocalTransactGet` until the transaction is made.
+    """
+    def __init__(self, model_cls: Type[Model]):
+        self._model_cls = model_cls
+        self._item: Optional[Item] = None
+        self._resolved = False
+
+    def get(self) -> Model:
+        if not self._resolved:
+            raise TransactGetError("The transaction has not been made yet")
+        if self._item is None:
+            raise self._model_cls.DoesNotExist()
+        return self._model_cls.from_raw_data(self._item)
+
+
+class LocalTransactGet:
+    """
+    A transaction of reads from a local backend, with the same interface as `TransactGet`.
+    """
+    def __init__(self, storage: LocalStorage):
+        self._storage = storage
+        self._reads: List[Tuple[Key, _LocalFuture]] = []
+
+    def __enter__(self) -> "LocalTransactGet":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            with self._storage._atomic():
+                for key, future in self._reads:
+                    future._item = self._storage._read(key)
+                    future._resolved = True
+
+    def get(self, model_cls: Type[Model], hash_key: str, range_key: str) -> _LocalFuture:
+        future = _LocalFuture(model_cls)
+        self._reads.append(((hash_key, range_key), future))
+        return future
+
+
+WriteTransaction = Union[TransactWrite, LocalTransactWrite]
+GetTransaction = Union[TransactGet, LocalTransactGet]
+
+
+class MemoryStorage(LocalStorage):
+    """
+    Keeps the table in memory, for the lifetime of the process.
+    """
+    def __init__(self):
+        super().__init__()
+        self._data: Dict[Key, str] = {}
+        # Sorted range keys of each partition
+        self._partitions: Dict[str, List[str]] = {}
+        # Sorted (index range key, hash key, range key) entries for each index hash key
+        self._indexes: Dict[str, Dict[str, List[Tuple[str, str, str]]]] = {
+            index.Meta.index_name: {} for index in INDEXES
+        }
+
+    def _index_entry(self, index: Type[Index], item: Item) -> Optional[Tuple[str, Tuple[str, str, str]]]:
+        hash_name, range_name = _index_keys(index)
+        if hash_name not in item or range_name not in item:
+            return None
+        return item[hash_name]["S"], (item[range_name]["S"], *_item_key(item))
+
+    def _read(self, key):
+        data = self._data.get(key)
+        return json.loads(data) if data is not None else None
+
+    def _write(self, key, item):
+        with self._lock:
+            self._remove(key)
+            self._data[key] = json.dumps(item)
+            bisect.insort(self._partitions.setdefault(key[0], []), key[1])
+            for index in INDEXES:
+                entry = self._index_entry(index, item)
+                if entry is not None:
+                    hash_key, sort_key = entry
+                    bisect.insort(self._indexes[index.Meta.index_name].setdefault(hash_key, []), sort_key)
+
+    def _remove(self, key):
+        with self._lock:
+            data = self._data.pop(key, None)
+            if data is None:
+                return
+            item = json.loads(data)
+            sort_keys = self._partitions[key[0]]
+            del sort_keys[bisect.bisect_left(sort_keys, key[1])]
+            for index in INDEXES:
+                entry = self._index_entry(index, item)
+                if entry is not None:
+                    hash_key, sort_key = entry
+                    entries = self._indexes[index.Meta.index_name][hash_key]
+                    del entries[bisect.bisect_left(entries, sort_key)]
+
+    @staticmethod
+    def _after(entries: List, forward: bool, start: Any) -> List:
+        """
+        Returns a snapshot of the sorted `entries` which come after `start` in the direction read.
+        """
+        if forward:
+            return entries[bisect.bisect_right(entries, start):] if start is not None else list(entries)
+        end = bisect.bisect_left(entries, start) if start is not None else len(entries)
+        return entries[:end][::-1]
+
+    def _partition(self, hash_key, forward, start):
+        with self._lock:
+            sort_keys = self._after(self._partitions.get(hash_key, []), forward, start)
+        for sort_key in sort_keys:
+            item = self._read((hash_key, sort_key))
+            if item is not None:
+                yield item
+
+    def _index(self, index, hash_key, forward, start):
+        with self._lock:
+            entries = self._after(self._indexes[index.Meta.index_name].get(hash_key, []), forward, start)
+        for _, *key in entries:
+            item = self._read(tuple(key))
+            if item is not None:
+                yield item
+
+    def _items(self):
+        for key in sorted(self._data):
+            yield self._read(key)
+
+
+class SqliteStorage(LocalStorage):
+    """
+    Keeps the table in a SQLite database, which may be shared by several processes.
+    Each index is kept as a SQLite index over columns holding its keys.
+    """
+    def __init__(self, path: str):
+        super().__init__()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._columns = sorted(set(name for index in INDEXES for name in _index_keys(index)))
+        with self._lock:
+            columns = "".join(f', "{column}" TEXT' for column in self._columns)
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS items (id TEXT NOT NULL, sk TEXT NOT NULL{columns}, '
+                'data TEXT NOT NULL, PRIMARY KEY (id, sk)) WITHOUT ROWID'
+            )
+            for index in INDEXES:
+                hash_name, range_name = _index_keys(index)
+                self._connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{index.Meta.index_name}" '
+                    f'ON items ("{hash_name}", "{range_name}", id, sk) WHERE "{hash_name}" IS NOT NULL'
+                )
+
+    @contextmanager
+    def _atomic(self):
+        with self._lock:
+            # Take the write lock up front, so no other process writes between our reads and writes
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _select(self, sql: str, parameters: Sequence[Any]) -> List[Tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _read(self, key):
+        rows = self._select("SELECT data FROM items WHERE id = ? AND sk = ?", key)
+        return json.loads(rows[0][0]) if rows else None
+
+    def _write(self, key, item):
+        values = [item[column]["S"] if "S" in item.get(column, {}) else None for column in self._columns]
+        columns = "".join(f', "{column}"' for column in self._columns)
+        placeholders = ", ?" * len(self._columns)
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO items (id, sk{columns}, data) VALUES (?, ?{placeholders}, ?)",
+                (*key, *values, json.dumps(item)),
+            )
+
+    def _remove(self, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM items WHERE id = ? AND sk = ?", key)
+
+    def _partition(self, hash_key, forward, start):
+        order = "ASC" if forward else "DESC"
+        where, parameters = "id = ?", [hash_key]
+        if start is not None:
+            where += f" AND sk {'>' if forward else '<'} ?"
+            parameters.append(start)
+        rows = self._select(f"SELECT data FROM items WHERE {where} ORDER BY sk {order}", parameters)
+        return (json.loads(data) for data, in rows)
+
+    def _index(self, index, hash_key, forward, start):
+        hash_name, range_name = _index_keys(index)
+        order = "ASC" if forward else "DESC"
+        where, parameters = f'"{hash_name}" = ?', [hash_key]
+        if start is not None:
+            where += f' AND ("{range_name}", id, sk) {">" if forward else "<"} (?, ?, ?)'
+            parameters.extend(start)
+        rows = self._select(
+            f'SELECT data FROM items WHERE {where} ORDER BY "{range_name}" {order}, id {order}, sk {order}',
+            parameters,
+        )
+        return (json.loads(data) for data, in rows)
+
+    def _items(self):
+        rows = self._select("SELECT data FROM items ORDER BY id, sk", [])
+        return (json.loads(data) for data, in rows)
+
+
+def storage_from_url(url: str) -> Storage:
+    """
+    Creates a storage backend from a URL of the form `dynamodb://`, `memory://`, or `sqlite://<path>`.
+    """
+    if url.startswith("dynamodb://"):
+        return DynamoStorage(region=os.environ.get("REGION"))
+    if url.startswith("memory://"):
+        return MemoryStorage()
+    if url.startswith("sqlite://"):
+        return SqliteStorage(url[len("sqlite://"):])
+    raise ValueError(f"Unsupported storage URL: {url}")
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        _storage = storage_from_url(STORAGE_URL)
+    return _storage
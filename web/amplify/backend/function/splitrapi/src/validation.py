@@ -42,6 +42,11 @@ _PercentageAmountSchema = {
 }
 
 _ItemSchema = {
+    'id': {
+        'type': 'string',
+        'empty': False,
+        'required': False
+    },
     'name': {
         'type': 'string',
         'empty': False
@@ -110,6 +115,11 @@ _ExpenseSchemaBase = {
             'type': 'string',
             'empty': False
         },
+    },
+    'group': {
+        'type': 'string',
+        'empty': False,
+        'required': False
     }
 }
 """
@@ -148,6 +158,30 @@ _ExpenseSchemaMultiple = {
 Schema common to expenses containing multiple items (payments)
 """
 
+_GroupSchema = {
+    'name': {
+        'type': 'string',
+        'empty': False
+    },
+    'accessKey': {
+        'type': 'string',
+        'minlength': 6
+    }
+}
+"""
+Schema for creating a group
+"""
+
+_JoinGroupSchema = {
+    'accessKey': {
+        'type': 'string',
+        'empty': False
+    }
+}
+"""
+Schema for joining a group
+"""
+
 def _create_validator(schema) -> Validator:
     v = Validator(schema)
     v.purge_unknown = True
@@ -191,4 +225,6 @@ class ExpenseValidator:
         doc.update(self._BaseValidator.document)
         doc.update(self._PolymorphicValidators[doc['type']].document)
         return doc
-        
+
+GroupValidator = _create_validator(_GroupSchema)
+JoinGroupValidator = _create_validator(_JoinGroupSchema)
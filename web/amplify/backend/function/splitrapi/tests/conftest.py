@@ -0,0 +1,36 @@
+"""
+Runs the API in-process against the in-memory storage backend and user directory,
+so tests need no AWS resources.
+"""
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("STORAGE_URL", "memory://")
+os.environ.setdefault("USERS_URL", "memory://")
+os.environ.setdefault("STORAGE_SPLITR_NAME", "splitr-test")
+os.environ.setdefault("REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import directory  # noqa: E402
+
+
+@pytest.fixture
+def add_user():
+    """
+    Adds users to the in-memory directory users are looked up in, removing them after the test.
+    """
+    users = directory.get_directory()
+
+    def add(user_id: str, wage: float = 20.0):
+        users.add_user(user_id, {
+            "given_name": user_id.title(),
+            "family_name": "Test",
+            "custom:hourlyWage": str(wage),
+        })
+
+    yield add
+    users.users.clear()
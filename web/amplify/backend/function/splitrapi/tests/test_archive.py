@@ -0,0 +1,149 @@
+"""
+Tests archiving settled expenses to a local object store, and reading and updating them afterwards.
+"""
+import os
+
+import pytest
+
+import archive
+import index
+import models
+import objectstore
+import storage
+
+USERS = ["owner", "payer"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    # The archival job scans the whole table, so give it a table of its own
+    db = storage.MemoryStorage()
+    monkeypatch.setattr(index, "db", db)
+    monkeypatch.setattr(archive, "db", db)
+    return db
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_URL", f"file://{tmp_path}")
+    monkeypatch.setattr(archive, "_store", objectstore.LocalObjectStore(str(tmp_path)))
+    archive._load_chunk.cache_clear()
+    yield tmp_path
+    archive._load_chunk.cache_clear()
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def create_expense(db, name, date="2020-01-15", paid=True):
+    expense = models.ExpenseModel.new(
+        name=name,
+        owner="owner",
+        date=date,
+        users=[models.UserStatus(user="payer", paid=paid, wage=20.0)],
+        split="equally",
+        expenseType="single",
+        amount=30,
+        images=[],
+    )
+    db.save(expense)
+    for id in USERS:
+        db.save(models.ExpenseUserModel.new(expense, id))
+    return expense
+
+
+def stored(db, expense):
+    return db.get(models.BaseModel, expense.id, expense.sk)
+
+
+def chunk_files(store):
+    return [name for _, _, names in os.walk(store) for name in names]
+
+
+def test_archives_old_settled_expenses(db, store):
+    old = create_expense(db, "Old")
+    unpaid = create_expense(db, "Unpaid", paid=False)
+    recent = create_expense(db, "Recent", date="2026-10-01")
+
+    assert archive.archive_expenses(older_than_days=365) == (1, None)
+
+    tombstone = stored(db, old)
+    assert isinstance(tombstone, models.ArchivedExpenseModel)
+    assert tombstone.version == old.version
+    assert tombstone.archive.startswith("expenses/2020-01/")
+    assert len(chunk_files(store)) == 1
+    assert isinstance(stored(db, unpaid), models.ExpenseModel)
+    assert isinstance(stored(db, recent), models.ExpenseModel)
+
+
+def test_expense_modified_while_archiving_is_left_in_place(db, monkeypatch):
+    expense = create_expense(db, "Old")
+    write_chunk = archive._write_chunk
+
+    def racing_write_chunk(month, expenses):
+        # Another request writes the expense after the job read it
+        db.save(db.get(models.ExpenseModel, expense.id, expense.sk))
+        return write_chunk(month, expenses)
+    monkeypatch.setattr(archive, "_write_chunk", racing_write_chunk)
+
+    assert archive.archive_expenses(older_than_days=365) == (0, None)
+    assert isinstance(stored(db, expense), models.ExpenseModel)
+
+
+def test_archival_is_chunked_and_resumes_where_it_stopped(db, store, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_SCAN_PAGE_SIZE", 2)
+    monkeypatch.setattr(archive, "ARCHIVE_CHUNK_SIZE", 2)
+    expenses = [create_expense(db, f"Old {i}") for i in range(5)]
+
+    archived, position = archive.archive_expenses(older_than_days=365, out_of_time=lambda: True)
+    assert (archived, len(chunk_files(store))) == (2, 1)
+    assert position is not None
+
+    archived, position = archive.archive_expenses(older_than_days=365, start=position)
+    assert (archived, position) == (3, None)
+    assert len(chunk_files(store)) == 3
+    assert all(isinstance(stored(db, expense), models.ArchivedExpenseModel) for expense in expenses)
+
+
+def test_archived_expenses_are_read_through(db):
+    archived = create_expense(db, "Archived")
+    live = create_expense(db, "Live", paid=False)
+    archive.archive_expenses(older_than_days=365)
+
+    assert index.load_expense(archived.id).name == "Archived"
+    names = sorted(expense.name for expense in index.load_expenses([archived.id, live.id]))
+    assert names == ["Archived", "Live"]
+
+    response = index.app.test_client().get(
+        f"/expenses/{archived.id.split('#')[1]}", environ_base=environ("payer")
+    )
+    assert response.status_code == 200
+    assert response.get_json()["name"] == "Archived"
+
+
+def test_rescinding_archived_expense_restores_it(db, monkeypatch):
+    monkeypatch.setattr(index, "CHANGE_SETTLE_SECONDS", 0)
+    expense = create_expense(db, "Archived")
+    archive.archive_expenses(older_than_days=365)
+    client = index.app.test_client()
+    cursor = client.get("/expenses/changes", environ_base=environ("owner")).get_json()["cursor"]
+
+    response = client.post(f"/expenses/{expense.id.split('#')[1]}/rescind", environ_base=environ("payer"))
+    assert response.status_code == 200
+
+    restored = stored(db, expense)
+    assert isinstance(restored, models.ExpenseModel)
+    assert restored.version == expense.version + 1
+    assert not restored.users[0].paid
+    changes = client.get(
+        "/expenses/changes", query_string={"since": cursor}, environ_base=environ("owner")
+    ).get_json()
+    assert [updated["id"] for updated in changes["updated"]] == [expense.id.split("#")[1]]
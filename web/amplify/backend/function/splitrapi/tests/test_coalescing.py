@@ -0,0 +1,94 @@
+"""
+Tests that identical reads share one response, and that writes stop them being shared.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from flask import Flask, jsonify
+import pytest
+
+import coalescing
+
+READERS = 4
+
+
+class Reads:
+    """
+    A coalesced route, which counts how often it is actually handled.
+    """
+    def __init__(self):
+        self.count = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.app = Flask(__name__)
+
+        @self.app.route("/items")
+        @coalescing.coalesced
+        def items():
+            self.count += 1
+            self.entered.set()
+            self.release.wait()
+            return jsonify({"count": self.count})
+
+    def get(self, user_id="alice", **query):
+        event = {"requestContext": {"authorizer": {"claims": {"cognito:username": user_id}}}}
+        response = self.app.test_client().get("/items", query_string=query, environ_base={"awsgi.event": event})
+        assert response.status_code == 200
+        return response.get_json()["count"]
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_METRICS", False)
+    coalescing.invalidate()
+    yield Reads()
+    coalescing.invalidate()
+
+
+def test_concurrent_identical_reads_are_handled_once(reads):
+    reads.release.clear()
+    before = coalescing.coalesced_counts()["flight"]
+    with ThreadPoolExecutor(max_workers=READERS) as executor:
+        leader = executor.submit(reads.get)
+        reads.entered.wait()
+        followers = [executor.submit(reads.get) for _ in range(READERS - 1)]
+        # Give the followers time to start waiting on the leader
+        time.sleep(0.1)
+        reads.release.set()
+        results = [leader.result()] + [follower.result() for follower in followers]
+
+    assert results == [1] * READERS
+    assert reads.count == 1
+    assert coalescing.coalesced_counts()["flight"] - before == READERS - 1
+
+
+def test_responses_are_reused_until_they_expire(reads, monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_TTL_SECONDS", 0.05)
+    assert reads.get() == 1
+    assert reads.get() == 1
+    # Reads by other users, or with other parameters, are not identical
+    assert reads.get(user_id="bob") == 2
+    assert reads.get(page="2") == 3
+
+    time.sleep(0.1)
+    assert reads.get() == 4
+
+
+def test_reads_after_a_write_are_handled_again(reads):
+    assert reads.get() == 1
+    coalescing.invalidate()
+    assert reads.get() == 2
+    assert reads.get() == 2
+
+
+def test_reads_which_began_before_a_write_are_not_reused(reads):
+    reads.release.clear()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        before_write = executor.submit(reads.get)
+        reads.entered.wait()
+        coalescing.invalidate()
+        reads.release.set()
+        assert before_write.result() == 1
+    assert reads.get() == 2
@@ -0,0 +1,58 @@
+"""
+Tests that responses are compressed unless compression is disabled, and that metrics are logged.
+"""
+import gzip
+import json
+import logging
+
+from flask import Flask, jsonify
+import pytest
+
+import compression
+import metrics
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    compression.init_app(app)
+
+    @app.route("/items")
+    def items():
+        return jsonify([{"name": f"Item {i}"} for i in range(500)])
+
+    return app.test_client()
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def records():
+    handler = Records()
+    metrics.logger.addHandler(handler)
+    yield handler.messages
+    metrics.logger.removeHandler(handler)
+
+
+def test_responses_are_not_compressed_when_disabled(client, monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESSION_ENABLED", False)
+    response = client.get("/items", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert len(response.get_json()) == 500
+
+
+def test_responses_are_compressed(client, records):
+    response = client.get("/items", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()).startswith(b"[")
+
+    logged = json.loads(records[-1])
+    assert (logged["Route"], logged["Encoding"]) == ("GET /items", "gzip")
+    assert logged["CompressionBytesSaved"] == logged["OriginalBytes"] - logged["CompressedBytes"] > 0
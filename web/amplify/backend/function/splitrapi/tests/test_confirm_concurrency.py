@@ -0,0 +1,117 @@
+"""
+Stress tests concurrent confirmation and rescission of payments towards the same expense.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+
+import pytest
+
+import index
+import models
+
+USER_COUNT = 8
+
+
+@pytest.fixture(autouse=True)
+def patient_retries(monkeypatch):
+    # Every request must eventually get through, however often it collides with the others
+    monkeypatch.setattr(index, "TRANSACTION_MAX_ATTEMPTS", 100)
+    monkeypatch.setattr(index, "TRANSACTION_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(index, "TRANSACTION_BACKOFF_CAP", 0.01)
+
+
+@pytest.fixture(autouse=True)
+def frequent_thread_switches():
+    # Switch threads often enough that requests interleave between their reads and writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def create_expense(user_ids):
+    expense = models.ExpenseModel.new(
+        name="Dinner",
+        owner="owner",
+        date="2026-10-01",
+        users=[models.UserStatus(user=id, paid=False, wage=20.0) for id in user_ids],
+        split="equally",
+        expenseType="single",
+        amount=100,
+        images=[],
+    )
+    index.db.save(expense)
+    for id in ["owner", *user_ids]:
+        index.db.save(models.ExpenseUserModel.new(expense, id))
+    return expense
+
+
+def confirm_or_rescind(confirm, expense_id, user_id, start=None):
+    event = {"requestContext": {"authorizer": {"claims": {"cognito:username": user_id}}}}
+    with index.app.test_request_context(environ_base={"awsgi.event": event}):
+        if start is not None:
+            # Line requests up so that they all read the expense before any of them writes it
+            start.wait()
+        index.confirm_or_rescind_expenses(confirm, [expense_id])
+
+
+def run_concurrently(requests):
+    """
+    Makes `(confirm, expense_id, user_id)` requests all at once, raising the first error.
+    """
+    start = threading.Barrier(len(requests))
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        futures = [executor.submit(confirm_or_rescind, *request, start) for request in requests]
+        for future in futures:
+            future.result()
+
+
+def load(expense):
+    return index.db.get(models.ExpenseModel, expense.id, expense.sk, consistent_read=True)
+
+
+def tag(expense, user_id):
+    return index.db.get(models.ExpenseUserModel, expense.id, f"User#{user_id}", consistent_read=True).tag
+
+
+def change_count(user_id):
+    key = models.ExpenseChangeModel.key(user_id)
+    return len(list(index.db.query(models.ExpenseChangeModel, key, consistent_read=True)))
+
+
+def test_concurrent_confirmations_are_not_lost():
+    user_ids = [f"user{i}" for i in range(USER_COUNT)]
+    expense = create_expense(user_ids)
+
+    run_concurrently([(True, expense.id.split("#")[1], id) for id in user_ids])
+
+    stored = load(expense)
+    assert all(user.paid for user in stored.users)
+    assert stored.version == expense.version + USER_COUNT
+    assert all(tag(expense, id).startswith("Past#") for id in user_ids)
+    # The last confirmation moves the expense into the owner's past expenses
+    assert tag(expense, "owner").startswith("Past#")
+    assert change_count("owner") == USER_COUNT
+
+
+def test_concurrent_confirmations_and_rescissions_are_not_lost():
+    user_ids = [f"mixed{i}" for i in range(USER_COUNT)]
+    expense = create_expense(user_ids)
+    confirmed, rescinded = user_ids[::2], user_ids[1::2]
+    expense_id = expense.id.split("#")[1]
+    run_concurrently([(True, expense_id, id) for id in rescinded])
+
+    run_concurrently(
+        [(True, expense_id, id) for id in confirmed] + [(False, expense_id, id) for id in rescinded]
+    )
+
+    stored = load(expense)
+    assert {user.user: user.paid for user in stored.users} == {
+        **{id: True for id in confirmed},
+        **{id: False for id in rescinded},
+    }
+    assert stored.version == expense.version + len(rescinded) + USER_COUNT
+    assert all(tag(expense, id).startswith("Past#") for id in confirmed)
+    assert all(tag(expense, id).startswith("Payer#") for id in rescinded)
+    assert tag(expense, "owner").startswith("Owner#")
@@ -0,0 +1,149 @@
+"""
+Tests that the vectorized batch computation of totals and contributions matches the scalar one.
+"""
+from typing import Any, Dict, List
+import random
+import timeit
+
+import numpy as np
+import pytest
+
+import contributions
+import index
+import models
+from contributions import resolve_expense_batch, resolve_expense_contribution, resolve_expense_total
+
+USERS = [f"user-{i}" for i in range(8)]
+
+
+def random_expense(rng: random.Random, users: List[str]) -> Dict[str, Any]:
+    participants = rng.sample(users, rng.randint(1, len(users)))
+    split = rng.choice(["individually", "equally", "proportionally", "custom"])
+    if split == "individually":
+        participants = participants[:1]
+    expense = {
+        "split": split,
+        "users": [
+            {"user": user, "wage": rng.uniform(10, 50), "weight": rng.uniform(0.5, 3)}
+            for user in participants
+        ],
+    }
+    if rng.random() < 0.3:
+        expense.update(expenseType="single", amount=rng.uniform(1, 200))
+        return expense
+
+    def percentage_amount():
+        kind = rng.choice(["percentage", "amount"])
+        return {"type": kind, "value": rng.choice([None, rng.uniform(0, 20)])}
+
+    items = []
+    for _ in range(rng.randint(1, 20)):
+        item = {"price": rng.uniform(0.5, 30), "quantity": rng.randint(1, 4)}
+        if split != "individually" and rng.random() < 0.3:
+            item["users"] = rng.sample(participants, rng.randint(1, len(participants)))
+        items.append(item)
+    expense.update(expenseType="multiple", items=items, tax=percentage_amount(), tip=percentage_amount())
+    return expense
+
+
+@pytest.fixture
+def expenses():
+    rng = random.Random(0)
+    return [random_expense(rng, USERS) for _ in range(1000)]
+
+
+def scalar(expenses, users):
+    totals = [resolve_expense_total(expense) for expense in expenses]
+    return totals, {
+        user: [resolve_expense_contribution(expense, t, user) for expense, t in zip(expenses, totals)]
+        for user in users
+    }
+
+
+@pytest.mark.parametrize("user_ids", [None, USERS, USERS[:1], ["nobody"]])
+def test_batch_matches_scalar(expenses, user_ids):
+    scalar_totals, scalar_contributions = scalar(expenses, user_ids or USERS)
+    batch_totals, batch_contributions = resolve_expense_batch(expenses, user_ids)
+
+    assert np.allclose(scalar_totals, batch_totals)
+    assert set(batch_contributions) == set(user_ids or USERS)
+    for user in batch_contributions:
+        assert np.allclose(scalar_contributions[user], batch_contributions[user])
+
+
+def test_batch_is_vectorized(expenses, monkeypatch):
+    # Fails if the batch falls back to the scalar implementation
+    def unexpected(*args):
+        raise AssertionError("Expected the vectorized implementation to be used")
+    monkeypatch.setattr(contributions, "resolve_expense_total", unexpected)
+    monkeypatch.setattr(contributions, "resolve_expense_contribution", unexpected)
+
+    totals, _ = resolve_expense_batch(expenses)
+    assert len(totals) == len(expenses)
+
+
+def test_zero_subtotal_is_handled_alike(expenses):
+    # Free items with a tip: the whole tip is split, as if nothing were assigned
+    free = {
+        "expenseType": "multiple",
+        "split": "equally",
+        "users": [{"user": user, "wage": 20, "weight": 1} for user in USERS[:2]],
+        "items": [{"price": 0, "quantity": 1, "users": USERS[:1]}, {"price": 0, "quantity": 2}],
+        "tax": {"type": "percentage", "value": 10},
+        "tip": {"type": "amount", "value": 5},
+    }
+    assert resolve_expense_total(free) == (0, 5)
+    assert resolve_expense_contribution(free, (0, 5), USERS[0]) == 2.5
+
+    batch = [free] * contributions.VECTORIZE_MIN_EXPENSES
+    totals, batch_contributions = resolve_expense_batch(batch, USERS[:2])
+    assert totals[0] == (0, 5)
+    assert batch_contributions[USERS[0]][0] == 2.5
+    assert batch_contributions[USERS[1]][0] == 2.5
+
+
+def test_batch_is_faster_than_scalar():
+    # 10,000 expenses between 8 users, as when benchmarking the vectorized implementation
+    rng = random.Random(1)
+    expenses = [random_expense(rng, USERS) for _ in range(10000)]
+
+    scalar_seconds = min(timeit.repeat(lambda: scalar(expenses, USERS), number=1, repeat=3))
+    batch_seconds = min(timeit.repeat(lambda: resolve_expense_batch(expenses), number=1, repeat=3))
+    assert batch_seconds < scalar_seconds, (
+        f"batch: {batch_seconds * 1000:.1f} ms, scalar: {scalar_seconds * 1000:.1f} ms"
+    )
+
+
+def test_expenses_looked_up_by_id_show_every_users_contribution(expenses, add_user):
+    for id in ["owner", *USERS]:
+        add_user(id)
+    ids = []
+    for i, expense in enumerate(expenses[:contributions.VECTORIZE_MIN_EXPENSES]):
+        model = models.ExpenseModel.new(
+            name=f"Expense {i}",
+            owner="owner",
+            date="2026-10-01",
+            users=[
+                models.UserStatus(user=user["user"], paid=False, wage=user["wage"], weight=user["weight"])
+                for user in expense["users"]
+            ],
+            split=expense["split"],
+            expenseType=expense["expenseType"],
+            amount=expense.get("amount"),
+            items=[models.Item.new(name="Item", **item) for item in expense.get("items", [])] or None,
+            tax=models.PercentageAmount(**expense["tax"]) if "tax" in expense else None,
+            tip=models.PercentageAmount(**expense["tip"]) if "tip" in expense else None,
+            images=[],
+        )
+        index.db.save(model)
+        ids.append(model.id.split("#")[1])
+
+    event = {"requestContext": {"authorizer": {"claims": {"cognito:username": "owner"}}}}
+    client = index.app.test_client()
+    batch = client.get("/expenses", query_string={"ids": ",".join(ids)}, environ_base={"awsgi.event": event})
+    assert batch.status_code == 200
+    for expense in batch.get_json():
+        single = client.get(f"/expenses/{expense['id']}", environ_base={"awsgi.event": event}).get_json()
+        assert expense["total"] == pytest.approx(single["total"])
+        for batch_user, single_user in zip(expense["users"], single["users"]):
+            assert batch_user["contribution"] == pytest.approx(single_user["contribution"])
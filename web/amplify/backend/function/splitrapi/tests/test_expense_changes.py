@@ -0,0 +1,151 @@
+"""
+Tests reading the change feed, and that writes to different expenses don't contend on it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+
+import pytest
+
+import index
+import models
+
+USERS = ["owner", "payer"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+@pytest.fixture(autouse=True)
+def settled(monkeypatch):
+    # Read entries as soon as they are written
+    monkeypatch.setattr(index, "CHANGE_SETTLE_SECONDS", 0)
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def create_expense(client, group_id, name):
+    response = client.post("/expenses", environ_base=environ("owner"), json={
+        "name": name,
+        "date": "2026-10-01",
+        "split": "equally",
+        "type": "single",
+        "amount": 30,
+        "notes": "",
+        "images": [],
+        "group": group_id.split("#")[1],
+        "users": [{"user": id} for id in USERS],
+    })
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def get_changes(client, cursor=None):
+    query = {"since": cursor} if cursor is not None else {}
+    response = client.get("/expenses/changes", query_string=query, environ_base=environ("payer"))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.fixture
+def group():
+    group = models.GroupModel.new(name="Household")
+    index.db.save(group)
+    for id in USERS:
+        index.db.save(models.GroupUserModel.new(group.id, id))
+    return group
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+def test_changes_follow_on_from_cursor(client, group):
+    cursor = get_changes(client)["cursor"]
+    expense_id = create_expense(client, group.id, "Dinner")
+
+    changes = get_changes(client, cursor)
+    assert [expense["id"] for expense in changes["added"]] == [expense_id]
+    assert changes["added"][0]["list"] == "Payer"
+    assert not changes["more"]
+
+    response = client.post(f"/expenses/{expense_id}/confirm", environ_base=environ("payer"))
+    assert response.status_code == 200
+    changes = get_changes(client, changes["cursor"])
+    assert [(expense["id"], expense["list"]) for expense in changes["updated"]] == [(expense_id, "Past")]
+
+    changes = get_changes(client, changes["cursor"])
+    assert (changes["added"], changes["updated"], changes["deleted"]) == ([], [], [])
+
+
+def test_changes_are_paged(client, group, monkeypatch):
+    monkeypatch.setattr(index, "CHANGES_PAGE_SIZE", 2)
+    cursor = get_changes(client)["cursor"]
+    expense_ids = [create_expense(client, group.id, f"Expense {i}") for i in range(3)]
+
+    first = get_changes(client, cursor)
+    assert first["more"] and len(first["added"]) == 2
+    second = get_changes(client, first["cursor"])
+    assert not second["more"]
+    assert sorted(expense["id"] for expense in first["added"] + second["added"]) == sorted(expense_ids)
+
+
+def test_unsettled_changes_are_not_read(client, group, monkeypatch):
+    cursor = get_changes(client)["cursor"]
+    create_expense(client, group.id, "Dinner")
+
+    monkeypatch.setattr(index, "CHANGE_SETTLE_SECONDS", 60)
+    changes = get_changes(client, cursor)
+    assert changes["added"] == []
+    assert changes["cursor"] == cursor
+
+
+def test_invalid_and_expired_cursors(client):
+    response = client.get("/expenses/changes", query_string={"since": "5"}, environ_base=environ("payer"))
+    assert response.status_code == 400
+
+    retention = models.CHANGE_RETENTION_DAYS * 86400 * 10 ** 6
+    expired = models.ExpenseChangeModel.sort_key(time.time_ns() // 1000 - retention - 1)
+    response = client.get(
+        "/expenses/changes",
+        query_string={"since": index.encode_cursor({"after": expired})},
+        environ_base=environ("payer"),
+    )
+    assert response.status_code == 410
+
+
+def test_writes_to_different_expenses_sharing_a_user_do_not_contend(client, group, monkeypatch):
+    expense_ids = [create_expense(client, group.id, f"Expense {i}") for i in range(8)]
+    cursor = get_changes(client)["cursor"]
+
+    def backoff(attempt):
+        raise AssertionError("Writes to different expenses must not be retried")
+    monkeypatch.setattr(index, "transaction_backoff", backoff)
+
+    # Line requests up so that they all read their expense before any of them writes
+    start = threading.Barrier(len(expense_ids))
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def confirm(expense_id):
+        with index.app.test_request_context(environ_base=environ("payer")):
+            start.wait()
+            index.confirm_or_rescind_expenses(True, [expense_id])
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(expense_ids)) as executor:
+            for future in [executor.submit(confirm, id) for id in expense_ids]:
+                future.result()
+    finally:
+        sys.setswitchinterval(interval)
+
+    changes = get_changes(client, cursor)
+    assert sorted(expense["id"] for expense in changes["updated"]) == sorted(expense_ids)
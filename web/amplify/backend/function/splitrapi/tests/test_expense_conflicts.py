@@ -0,0 +1,97 @@
+"""
+Tests that edits made from a stale copy of an expense are rejected rather than retried,
+while edits which race with writes to other items are retried.
+"""
+import pytest
+from werkzeug.exceptions import Conflict
+
+import index
+import models
+
+USERS = ["owner", "payer"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def expense_data(group_id, name):
+    return {
+        "name": name,
+        "date": "2026-10-01",
+        "split": "equally",
+        "type": "single",
+        "amount": 30,
+        "notes": "",
+        "images": [],
+        "group": group_id.split("#")[1],
+        "users": [{"user": "owner"}, {"user": "payer"}],
+    }
+
+
+def test_edit_of_stale_expense_conflicts_without_retrying(monkeypatch):
+    group = models.GroupModel.new(name="Household")
+    index.db.save(group)
+    for id in USERS:
+        index.db.save(models.GroupUserModel.new(group.id, id))
+    client = index.app.test_client()
+
+    response = client.post("/expenses", json=expense_data(group.id, "Dinner"), environ_base=environ("owner"))
+    assert response.status_code == 201
+    expense_id = response.get_json()["id"]
+    stale = index.load_expense(f"Expense#{expense_id}")
+
+    response = client.put(
+        f"/expenses/{expense_id}", json=expense_data(group.id, "Lunch"), environ_base=environ("owner")
+    )
+    assert response.status_code == 200
+
+    def backoff(attempt):
+        raise AssertionError("A stale expense must not be retried")
+    monkeypatch.setattr(index, "transaction_backoff", backoff)
+
+    with index.app.test_request_context(environ_base=environ("owner")):
+        with pytest.raises(Conflict):
+            index.update_and_write_expense(stale, expense_data(group.id, "Breakfast"))
+    assert index.load_expense(f"Expense#{expense_id}").name == "Lunch"
+
+
+def test_edit_racing_on_another_item_is_retried(monkeypatch):
+    group = models.GroupModel.new(name="Household")
+    index.db.save(group)
+    for id in USERS:
+        index.db.save(models.GroupUserModel.new(group.id, id))
+    client = index.app.test_client()
+
+    response = client.post("/expenses", json=expense_data(group.id, "Dinner"), environ_base=environ("owner"))
+    expense_id = response.get_json()["id"]
+
+    # The first attempt loses a race on an item written along with the expense,
+    # which DynamoDB reports before the expense's update
+    attempts = []
+    record_expense_changes = index.record_expense_changes
+
+    def racing_record_expense_changes(transaction, *args):
+        attempts.append(transaction)
+        if len(attempts) == 1:
+            raced = "Group#raced"
+            transaction.condition_check(
+                models.GroupModel, raced, raced, condition=models.GroupModel.id.exists()
+            )
+        record_expense_changes(transaction, *args)
+    monkeypatch.setattr(index, "record_expense_changes", racing_record_expense_changes)
+    monkeypatch.setattr(index, "transaction_backoff", lambda attempt: None)
+
+    response = client.put(
+        f"/expenses/{expense_id}", json=expense_data(group.id, "Lunch"), environ_base=environ("owner")
+    )
+    assert response.status_code == 200
+    assert len(attempts) == 2
+    assert index.load_expense(f"Expense#{expense_id}").name == "Lunch"
@@ -0,0 +1,132 @@
+"""
+Tests that editing an expense only writes what changed.
+"""
+from pynamodb.expressions.update import RemoveAction, SetAction
+import pytest
+
+import index
+import models
+
+USERS = ["owner", "payer", "dropped"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def expense_data(group, users, name="Dinner"):
+    return {
+        "name": name,
+        "date": "2026-10-01",
+        "split": "equally",
+        "type": "single",
+        "amount": 30,
+        "notes": "",
+        "images": [],
+        "group": group.id.split("#")[1],
+        "users": [{"user": id} for id in users],
+    }
+
+
+@pytest.fixture
+def group():
+    group = models.GroupModel.new(name="Household")
+    index.db.save(group)
+    for id in USERS:
+        index.db.save(models.GroupUserModel.new(group.id, id))
+    return group
+
+
+@pytest.fixture
+def transactions(monkeypatch):
+    """
+    Records the transactions written by requests.
+    """
+    transactions = []
+    transact_write = index.db.transact_write
+
+    def recording_transact_write():
+        transaction = transact_write()
+        transactions.append(transaction)
+        return transaction
+    monkeypatch.setattr(index.db, "transact_write", recording_transact_write)
+    return transactions
+
+
+def keys(operations):
+    return [operation.key for operation in operations]
+
+
+def create_expense(client, group):
+    response = client.post("/expenses", json=expense_data(group, USERS), environ_base=environ("owner"))
+    assert response.status_code == 201
+    return f"Expense#{response.get_json()['id']}"
+
+
+def test_unchanged_expense_only_checks_its_version(group, transactions):
+    client = index.app.test_client()
+    expense_id = create_expense(client, group)
+    version = index.load_expense(expense_id).version
+    transactions.clear()
+
+    response = client.put(
+        f"/expenses/{expense_id.split('#')[1]}", json=expense_data(group, USERS), environ_base=environ("owner")
+    )
+    assert response.status_code == 200
+
+    transaction, = transactions
+    assert keys(transaction._condition_checks) == [(expense_id, expense_id)]
+    assert transaction._puts == transaction._updates == transaction._deletes == []
+    assert index.load_expense(expense_id).version == version
+
+
+def test_dropping_a_user_only_deletes_their_entry(group, transactions):
+    client = index.app.test_client()
+    expense_id = create_expense(client, group)
+    transactions.clear()
+
+    response = client.put(
+        f"/expenses/{expense_id.split('#')[1]}",
+        json=expense_data(group, ["owner", "payer"]),
+        environ_base=environ("owner"),
+    )
+    assert response.status_code == 200
+
+    transaction, = transactions
+    assert keys(transaction._deletes) == [(expense_id, "User#dropped")]
+    assert keys(transaction._updates) == [(expense_id, expense_id)]
+    # Only change feed entries are put. The remaining users' entries are unchanged.
+    assert all(operation.key[1].startswith("Change#") for operation in transaction._puts)
+    assert sorted(operation.key[0] for operation in transaction._puts) == [
+        models.ExpenseChangeModel.key(id) for id in sorted(USERS)
+    ]
+
+
+def test_update_actions_only_set_changed_attributes():
+    expense = models.ExpenseModel.new(
+        name="Dinner",
+        owner="owner",
+        date="2026-10-01",
+        users=[models.UserStatus(user="payer", paid=False, wage=20.0)],
+        split="equally",
+        expenseType="single",
+        amount=30,
+        notes="Tasty",
+        images=[],
+    )
+    before = expense.serialize()
+    expense.name = "Lunch"
+    expense.notes = None
+
+    actions = index.expense_update_actions(before, expense.serialize())
+    assert [(type(action), action.values[0].attribute.attr_name) for action in actions] == [
+        (SetAction, "name"),
+        (RemoveAction, "notes"),
+    ]
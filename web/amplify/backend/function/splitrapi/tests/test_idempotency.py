@@ -0,0 +1,184 @@
+"""
+Tests that requests made with an Idempotency-Key header are handled once, and replayed after.
+"""
+import hashlib
+import time
+
+from flask import Flask, jsonify
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import coalescing
+import idempotency
+import index
+import models
+import storage
+
+USERS = ["owner", "payer"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    # Other tests' expenses are between users this one doesn't add
+    db = storage.MemoryStorage()
+    monkeypatch.setattr(index, "db", db)
+    monkeypatch.setattr(idempotency, "db", db)
+    coalescing.invalidate()
+    return db
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def with_key(key):
+    return {idempotency.IDEMPOTENCY_HEADER: key}
+
+
+class Work:
+    """
+    An idempotent route, which counts how often it is actually handled and can be made to fail.
+    """
+    def __init__(self):
+        self.count = 0
+        self.fail = False
+        self.app = Flask(__name__)
+
+        @self.app.route("/work", methods=["POST"])
+        @idempotency.idempotent
+        def work():
+            self.count += 1
+            if self.fail:
+                raise BadRequest("Failed")
+            return jsonify({"count": self.count}), 201
+
+    def post(self, key, user_id="owner", body=b""):
+        return self.app.test_client().post("/work", data=body, headers=with_key(key), environ_base=environ(user_id))
+
+
+@pytest.fixture
+def work():
+    return Work()
+
+
+def unique_key(name):
+    return f"{name}-{time.time_ns()}"
+
+
+def test_retries_replay_the_first_response(work):
+    key = unique_key("replay")
+    first = work.post(key)
+    retry = work.post(key)
+
+    assert (first.status_code, first.get_json()) == (201, {"count": 1})
+    assert (retry.status_code, retry.get_json()) == (201, {"count": 1})
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert work.count == 1
+
+
+def test_keys_belong_to_one_user_and_one_request(work):
+    key = unique_key("scoped")
+    work.post(key)
+    assert work.post(key, user_id="payer").get_json() == {"count": 2}
+    assert work.post(key, body=b"different").status_code == 422
+
+
+def test_failed_requests_release_their_key(work):
+    key = unique_key("release")
+    work.fail = True
+    assert work.post(key).status_code == 400
+
+    work.fail = False
+    response = work.post(key)
+    assert response.get_json() == {"count": 2}
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def pending_claim(key, lease):
+    # As left behind by a request which is still being handled, or which went away
+    fingerprint = hashlib.sha256(b"POST /work\n").hexdigest()
+    record = models.IdempotencyModel.new("owner", key, fingerprint=fingerprint, status="pending", lease=lease)
+    idempotency.db.save(record)
+
+
+def test_expired_claims_are_taken_over(work):
+    key = unique_key("expired")
+    pending_claim(key, int(time.time()) - 1)
+    assert work.post(key).get_json() == {"count": 1}
+
+
+def test_retries_of_requests_in_progress_conflict_once_they_stop_waiting(work, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.1)
+    key = unique_key("in-progress")
+    pending_claim(key, int(time.time()) + idempotency.IDEMPOTENCY_LEASE_SECONDS)
+    assert work.post(key).status_code == 409
+    assert work.count == 0
+
+
+@pytest.fixture
+def group():
+    group = models.GroupModel.new(name="Household")
+    index.db.save(group)
+    for id in USERS:
+        index.db.save(models.GroupUserModel.new(group.id, id))
+    return group
+
+
+def test_creating_an_expense_is_replayed(group):
+    client = index.app.test_client()
+    key = unique_key("create")
+    data = {
+        "name": "Dinner",
+        "date": "2026-10-01",
+        "split": "equally",
+        "type": "single",
+        "amount": 30,
+        "notes": "",
+        "images": [],
+        "group": group.id.split("#")[1],
+        "users": [{"user": id} for id in USERS],
+    }
+    first = client.post("/expenses", json=data, headers=with_key(key), environ_base=environ("owner"))
+    retry = client.post("/expenses", json=data, headers=with_key(key), environ_base=environ("owner"))
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json()["id"] == first.get_json()["id"]
+    expenses = client.get("/expenses", query_string={"own": "true"}, environ_base=environ("owner")).get_json()
+    assert [expense["id"] for expense in expenses] == [first.get_json()["id"]]
+
+
+def test_confirming_an_expense_is_replayed(group):
+    expense = models.ExpenseModel.new(
+        name="Dinner",
+        owner="owner",
+        date="2026-10-01",
+        users=[models.UserStatus(user="payer", paid=False, wage=20.0)],
+        split="equally",
+        expenseType="single",
+        amount=30,
+        images=[],
+    )
+    index.db.save(expense)
+    for id in USERS:
+        index.db.save(models.ExpenseUserModel.new(expense, id))
+    client = index.app.test_client()
+    url = f"/expenses/{expense.id.split('#')[1]}/confirm"
+    key = unique_key("confirm")
+
+    first = client.post(url, headers=with_key(key), environ_base=environ("payer"))
+    retry = client.post(url, headers=with_key(key), environ_base=environ("payer"))
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    stored = index.db.get(models.ExpenseModel, expense.id, expense.sk)
+    assert stored.version == expense.version + 1
+
+    # Without the key, confirming again is a new request, and the expense is already confirmed
+    assert client.post(url, environ_base=environ("payer")).status_code == 400
@@ -0,0 +1,75 @@
+"""
+Runs the API end to end through the local runner, against each local storage backend.
+"""
+import pytest
+
+import archive
+import coalescing
+import idempotency
+import index
+import local
+import migrations
+import storage
+
+
+@pytest.fixture(params=["memory://", "sqlite://"])
+def db(request, tmp_path, monkeypatch):
+    url = request.param
+    if url == "sqlite://":
+        url += str(tmp_path / "splitr.db")
+    db = storage.storage_from_url(url)
+    for module in [index, idempotency, archive, migrations]:
+        monkeypatch.setattr(module, "db", db)
+    monkeypatch.setattr(index, "_past_buckets_migrated", False)
+    coalescing.invalidate()
+    return db
+
+
+@pytest.fixture
+def client(db, add_user):
+    for id in ["alice", "bob"]:
+        add_user(id)
+    return local.create_app().test_client()
+
+
+def as_user(user_id):
+    return {local.LOCAL_USER_HEADER: user_id}
+
+
+def test_expense_lifecycle(client):
+    response = client.post("/groups", json={"name": "Flat", "accessKey": "flat-key"}, headers=as_user("alice"))
+    assert response.status_code == 201
+    group_id = response.get_json()["id"]
+    response = client.post("/groups/join", json={"accessKey": "flat-key"}, headers=as_user("bob"))
+    assert response.status_code == 200
+
+    users = client.get("/users", headers=as_user("alice")).get_json()
+    assert sorted(user["user"] for user in users) == ["alice", "bob"]
+
+    response = client.post("/expenses", headers=as_user("alice"), json={
+        "name": "Groceries",
+        "date": "2026-10-01",
+        "split": "equally",
+        "type": "single",
+        "amount": 30,
+        "notes": "",
+        "images": [],
+        "group": group_id,
+        "users": [{"user": "alice"}, {"user": "bob"}],
+    })
+    assert response.status_code == 201
+    expense_id = response.get_json()["id"]
+
+    due = client.get("/expenses", query_string={"own": "false"}, headers=as_user("bob")).get_json()
+    assert [(expense["id"], expense["contribution"]) for expense in due] == [(expense_id, 15)]
+
+    response = client.post(f"/expenses/{expense_id}/confirm", headers=as_user("bob"))
+    assert response.status_code == 200
+
+    past = client.get("/expenses", query_string={"past": "true"}, headers=as_user("bob")).get_json()
+    assert [expense["id"] for expense in past] == [expense_id]
+    assert client.get("/expenses", query_string={"own": "false"}, headers=as_user("bob")).get_json() == []
+
+
+def test_unknown_local_user_is_unauthorized(client):
+    assert client.get("/groups", headers=as_user("mallory")).status_code == 401
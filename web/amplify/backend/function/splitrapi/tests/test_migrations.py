@@ -0,0 +1,40 @@
+"""
+Tests the data migrations against the in-memory storage backend.
+"""
+import pytest
+
+import index
+import migrations
+import models
+
+
+def test_default_group_adopts_existing_users_and_expenses(add_user):
+    add_user("alice")
+    add_user("bob")
+    expense = models.ExpenseModel.new(
+        name="Groceries",
+        owner="alice",
+        date="2022-10-05",
+        users=[models.UserStatus(user="bob", paid=False, wage=20.0)],
+        split="equally",
+        expenseType="single",
+        amount=30,
+        images=[],
+    )
+    index.db.save(expense)
+
+    assert migrations.create_default_group("old-code") >= 3
+    # Running it again changes nothing
+    assert migrations.create_default_group("old-code") == 0
+
+    key = models.GroupAccessKeyModel.key("old-code")
+    group_id = index.db.get(models.GroupAccessKeyModel, key, key).group
+    assert index.get_group_member_ids(group_id) >= {"alice", "bob"}
+    assert index.get_user_group_ids("alice") == [group_id]
+    assert index.db.get(models.ExpenseModel, expense.id, expense.sk).group == group_id
+
+
+def test_default_group_needs_the_old_access_code(monkeypatch):
+    monkeypatch.setattr(migrations, "DEFAULT_ACCESS_KEY", None)
+    with pytest.raises(ValueError):
+        migrations.create_default_group()
@@ -0,0 +1,86 @@
+"""
+Tests paging through past expenses, including those which have yet to be moved into monthly buckets.
+"""
+import pytest
+
+import index
+import migrations
+import models
+
+USERS = ["pastowner", "pastpayer"]
+
+
+@pytest.fixture(autouse=True)
+def users(add_user):
+    for id in USERS:
+        add_user(id)
+
+
+@pytest.fixture(autouse=True)
+def not_migrated(monkeypatch):
+    monkeypatch.setattr(index, "_past_buckets_migrated", False)
+
+
+def environ(user_id):
+    claims = {"cognito:username": user_id, "custom:hourlyWage": "20"}
+    return {"awsgi.event": {"requestContext": {"authorizer": {"claims": claims}}}}
+
+
+def create_legacy_past_expense(date):
+    """
+    Writes a paid off expense the way it was written before past expenses were bucketed.
+    """
+    expense = models.ExpenseModel.new(
+        name=f"Dinner on {date}",
+        owner="pastowner",
+        date=date,
+        users=[models.UserStatus(user="pastpayer", paid=True, wage=20.0)],
+        split="equally",
+        expenseType="single",
+        amount=100,
+        images=[],
+    )
+    index.db.save(expense)
+    for id in ["pastowner", "pastpayer"]:
+        expense_user = models.ExpenseUserModel.new(expense, id)
+        expense_user.tag = models.ExpenseUserModel.legacy_past_tag(id)
+        index.db.save(expense_user)
+    return expense
+
+
+def get_past(client, **args):
+    return client.get(
+        "/expenses", query_string={"past": "true", **args}, environ_base=environ("pastpayer")
+    )
+
+
+def read_all_pages(client, limit):
+    names, cursor = [], None
+    while True:
+        response = get_past(client, limit=limit, **({"cursor": cursor} if cursor else {}))
+        assert response.status_code == 200
+        names += [expense["name"] for expense in response.get_json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return names
+
+
+def test_legacy_past_expenses_are_listed_before_and_after_migration():
+    dates = ["2026-01-15", "2026-02-15", "2026-03-15"]
+    for date in dates:
+        create_legacy_past_expense(date)
+    client = index.app.test_client()
+    expected = [f"Dinner on {date}" for date in reversed(dates)]
+
+    assert read_all_pages(client, limit=2) == expected
+
+    migrations.backfill_past_buckets()
+    assert index.past_buckets_migrated()
+    assert read_all_pages(client, limit=2) == expected
+    assert [expense["name"] for expense in get_past(client).get_json()] == expected
+
+
+@pytest.mark.parametrize("limit", ["0", "-1", "ten", str(index.PAST_PAGE_MAX + 1)])
+def test_invalid_limit_is_rejected(limit):
+    response = get_past(index.app.test_client(), limit=limit)
+    assert response.status_code == 400
@@ -0,0 +1,43 @@
+"""
+Tests that users' display info snapshotted on expenses is used instead of looking them up.
+"""
+import index
+import models
+
+
+def expense(*users):
+    return models.ExpenseModel.new(
+        name="Dinner",
+        owner="owner",
+        date="2026-10-01",
+        users=list(users),
+        split="equally",
+        expenseType="single",
+        amount=30,
+        images=[],
+    )
+
+
+def test_snapshots_without_a_first_name_are_used():
+    nameless = models.UserStatus(user="nameless", paid=False, wage=20.0)
+    nameless.take_snapshot({"venmo": "nameless-venmo"})
+    unsnapshotted = models.UserStatus(user="unsnapshotted", paid=False, wage=20.0)
+    snapshotted = expense(nameless, unsnapshotted)
+    snapshotted.ownerInfo = models.OwnerInfo(wage=20.0)
+    snapshotted.ownerInfo.take_snapshot({"lastName": "Owner"})
+
+    assert index.stale_user_ids([snapshotted]) == {"unsnapshotted"}
+    assert index.stale_user_ids([snapshotted], fresh=True) == {"nameless", "unsnapshotted", "owner"}
+
+
+def test_snapshot_flags_are_not_returned():
+    user = models.UserStatus(user="payer", paid=False, wage=20.0)
+    user.take_snapshot({"firstName": "Payer"})
+    snapshotted = expense(user)
+    snapshotted.ownerInfo = models.OwnerInfo(wage=20.0)
+    snapshotted.ownerInfo.take_snapshot({"firstName": "Owner"})
+
+    encoded = index.transform_expense(index.Encoder.encode(snapshotted), "owner")
+    assert "snapshot" not in encoded["users"][0]
+    assert "snapshot" not in encoded["ownerInfo"]
+    assert encoded["users"][0]["firstName"] == "Payer"
@@ -0,0 +1,40 @@
+"""
+Tests that the local storage backends fail transactions the way DynamoDB does.
+"""
+import pytest
+from pynamodb.exceptions import TransactWriteError
+
+import models
+import storage
+
+
+@pytest.fixture(params=["memory://", "sqlite://"])
+def db(request, tmp_path):
+    url = request.param
+    if url == "sqlite://":
+        url += str(tmp_path / "splitr.db")
+    return storage.storage_from_url(url)
+
+
+def test_transaction_reports_reasons_in_dynamodb_order(db):
+    group = models.GroupModel.new(name="Flat")
+    member = models.GroupUserModel.new(group.id, "alice")
+    joining = models.GroupUserModel.new(group.id, "bob")
+    db.save(group)
+    db.save(member)
+
+    with pytest.raises(TransactWriteError) as e:
+        with db.transact_write() as transaction:
+            # Made in a different order from the one DynamoDB reports reasons in
+            transaction.update(
+                group, [models.GroupModel.name.set("Home")], condition=models.GroupModel.name == "Other"
+            )
+            transaction.save(joining)
+            transaction.condition_check(
+                models.GroupUserModel, member.id, member.sk, models.GroupUserModel.id.exists()
+            )
+
+    expected = [(member.id, member.sk), (joining.id, joining.sk), (group.id, group.sk)]
+    assert storage.transaction_keys(transaction) == expected
+    reasons = [reason["Code"] for reason in e.value.cause.response["CancellationReasons"]]
+    assert reasons == ["None", "None", "ConditionalCheckFailed"]
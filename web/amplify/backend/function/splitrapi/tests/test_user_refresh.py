@@ -0,0 +1,72 @@
+"""
+Tests that refreshing a user's snapshots is queued, and picks up where it left off when it runs out of time.
+"""
+import pytest
+
+import index
+import models
+
+PAYERS = [f"payer-{i}" for i in range(3)]
+
+
+@pytest.fixture
+def expenses(add_user):
+    add_user("refreshed")
+    for id in PAYERS:
+        add_user(id)
+    expenses = []
+    for id in PAYERS:
+        expense = models.ExpenseModel.new(
+            name=f"Dinner with {id}",
+            owner=id,
+            date="2026-10-01",
+            users=[models.UserStatus(user="refreshed", paid=False, wage=20.0, firstName="Old")],
+            split="equally",
+            expenseType="single",
+            amount=30,
+            images=[],
+        )
+        index.db.save(expense)
+        index.db.save(models.ExpenseUserModel.new(expense, "refreshed"))
+        expenses.append(expense)
+    return expenses
+
+
+def first_names(expenses):
+    return [index.db.get(models.ExpenseModel, e.id, e.sk).users[0].firstName for e in expenses]
+
+
+def test_refresh_is_queued_when_deployed(monkeypatch):
+    queued = []
+    monkeypatch.setattr(index, "LAMBDA_FUNCTION_NAME", "splitrapi-test")
+    monkeypatch.setattr(index, "queue_user_refresh", queued.append)
+
+    event = {"requestContext": {"authorizer": {"claims": {"cognito:username": "refreshed"}}}}
+    response = index.app.test_client().post("/users/refresh", environ_base={"awsgi.event": event})
+    assert response.status_code == 202
+    assert queued == ["refreshed"]
+
+
+def test_queued_refresh_requeues_the_rest_when_out_of_time(expenses, monkeypatch):
+    queued = []
+    monkeypatch.setattr(index, "queue_user_refresh", queued.append)
+
+    class Context:
+        # Enough time for one expense, then none
+        remaining = [index.REFRESH_TIME_MARGIN_MILLIS * 2] + [0] * 10
+
+        def get_remaining_time_in_millis(self):
+            return self.remaining.pop(0)
+
+    event = {"action": index.REFRESH_USER_ACTION, "user": "refreshed"}
+    assert index.handler(event, Context()) == {"refreshed": 1, "done": False}
+    assert queued == ["refreshed"]
+    assert sorted(first_names(expenses)) == ["Old", "Old", "Refreshed"]
+
+    class PlentyOfTime:
+        def get_remaining_time_in_millis(self):
+            return 60000
+
+    assert index.handler(event, PlentyOfTime()) == {"refreshed": 2, "done": True}
+    assert queued == ["refreshed"]
+    assert first_names(expenses) == ["Refreshed"] * 3
@@ -0,0 +1,9 @@
+import { AmplifyDDBResourceTemplate } from '@aws-amplify/cli-extensibility-helper';
+
+export function override(resources: AmplifyDDBResourceTemplate) {
+    // Change feed entries and idempotency records are deleted once their `expires` time passes
+    resources.dynamoDBTable.timeToLiveSpecification = {
+        attributeName: 'expires',
+        enabled: true,
+    };
+}
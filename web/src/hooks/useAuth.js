@@ -78,6 +78,20 @@ function AuthProvider({ children }) {
         };
     }
 
+    // Expenses show each user's name and Venmo as they were when the expense was written,
+    // so they must be refreshed whenever the user changes them. The refresh happens in the
+    // background, and failing to start it mustn't fail the change, which has already been saved.
+    async function refreshProfile(updatedUser) {
+        setUser(updatedUser);
+        try {
+            await API.post('splitr', '/users/refresh', {
+                headers: { Authorization: updatedUser.signInUserSession.idToken.jwtToken },
+            });
+        } catch (e) {
+            console.log(`Could not refresh how expenses show the user's profile: ${e}`);
+        }
+    }
+
     const authObject = Object.freeze({
         authenticated() {
             return authenticated;
@@ -137,13 +151,13 @@ function AuthProvider({ children }) {
         async updateAttributes(attributes) {
             if (!authenticated) throw new Error('User was not signed in');
             await Auth.updateUserAttributes(user, attributes);
-            setUser(await Auth.currentAuthenticatedUser());
+            await refreshProfile(await Auth.currentAuthenticatedUser());
         },
 
         async clearAttributes(attributes) {
             if (!authenticated) throw new Error('User was not signed in');
             await Auth.deleteUserAttributes(user, attributes);
-            setUser(await Auth.currentAuthenticatedUser());
+            await refreshProfile(await Auth.currentAuthenticatedUser());
         },
 
         async signOut() {
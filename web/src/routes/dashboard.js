@@ -178,7 +178,36 @@ function ActiveExpenseGroup({ expenses }) {
     );
 }
 
-function PastExpenseGroup({ expenses }) {
+const PastPageSize = 50;
+
+// Past expenses are read a page at a time, with the cursor for the next page returned in a header
+async function fetchPastExpenses(auth, cursor) {
+    const response = await auth.api.get('/expenses', {
+        queryStringParameters: { past: true, limit: PastPageSize, ...(cursor ? { cursor } : {}) },
+        response: true,
+    });
+    return { expenses: response.data, cursor: response.headers['x-next-cursor'] ?? null };
+}
+
+function PastExpenseGroup({ firstPage }) {
+    const auth = useAuth();
+    const [expenses, setExpenses] = useState(firstPage.expenses);
+    const [cursor, setCursor] = useState(firstPage.cursor);
+    const [loading, setLoading] = useState(false);
+
+    async function loadMore() {
+        setLoading(true);
+        try {
+            const page = await fetchPastExpenses(auth, cursor);
+            setExpenses(expenses => [...expenses, ...page.expenses]);
+            setCursor(page.cursor);
+        } catch (e) {
+            console.log(`Could not load more past expenses: ${e}`);
+        } finally {
+            setLoading(false);
+        }
+    }
+
     return (
         <ExpensesContainer empty={expenses.length === 0}>
             <table>
@@ -199,6 +228,11 @@ function PastExpenseGroup({ expenses }) {
                     ))}
                 </tbody>
             </table>
+            {cursor && (
+                <button className='outline secondary' aria-busy={loading} disabled={loading} onClick={loadMore}>
+                    Load more
+                </button>
+            )}
         </ExpensesContainer>
     );
 }
@@ -240,13 +274,8 @@ export default function Dashboard() {
                     </Loadable>
                 </TabPanel>
                 <TabPanel>
-                    <Loadable
-                        fetch={() =>
-                            auth.api.get('/expenses', {
-                                queryStringParameters: { past: true },
-                            })
-                        }>
-                        {expenses => <PastExpenseGroup expenses={expenses} />}
+                    <Loadable fetch={() => fetchPastExpenses(auth)}>
+                        {firstPage => <PastExpenseGroup firstPage={firstPage} />}
                     </Loadable>
                 </TabPanel>
             </Tabs>